@@ -0,0 +1,515 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from henango.server.server import Server
+
+HOST = "localhost"
+
+# --no-serverで、既に起動しているサーバに負荷をかける時のデフォルトのポート
+PORT = 8080
+
+# 負荷をかけるリクエストの種類と、その割合
+ROUTES = {
+    "static_html": 3,
+    "static_css": 2,
+    "now": 2,
+    "user_profile": 2,
+    "parameters": 1,
+}
+
+# I/Oを待つview関数の、同期的なものとasync defのもののルート
+# --routes wait_sync,wait_async で指定すると、同時に待てるリクエストの数を比べられる
+# --no-serverの場合は、環境変数HENANGO_BENCHMARK_ROUTES=1で起動したサーバが必要
+WAIT_ROUTES = ("wait_sync", "wait_async")
+
+# WAIT_ROUTESのview関数で待たせるミリ秒
+WAIT_MILLISECONDS = 100
+
+
+def build_request(route: str, keep_alive: bool, port: int = PORT) -> bytes:
+    """
+    ベンチマークで送るリクエストのバイト列を作る
+    """
+    connection = "keep-alive" if keep_alive else "close"
+    headers = f"Host: {HOST}:{port}\r\nConnection: {connection}\r\n"
+
+    if route == "static_html":
+        return f"GET /index.html HTTP/1.1\r\n{headers}\r\n".encode()
+    if route == "static_css":
+        return f"GET /index.css HTTP/1.1\r\n{headers}\r\n".encode()
+    if route == "now":
+        return f"GET /now HTTP/1.1\r\n{headers}\r\n".encode()
+    if route == "user_profile":
+        user_id = random.randint(1, 10000)
+        return f"GET /user/{user_id}/profile HTTP/1.1\r\n{headers}\r\n".encode()
+    if route == "parameters":
+        body = "name=henango&message=hello+benchmark"
+        return (
+            "POST /parameters HTTP/1.1\r\n"
+            f"{headers}"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n{body}"
+        ).encode()
+    if route in WAIT_ROUTES:
+        path = f"/bench/{route}/{WAIT_MILLISECONDS}"
+        return f"GET {path} HTTP/1.1\r\n{headers}\r\n".encode()
+    raise ValueError(f"不明なルートです: {route}")
+
+
+async def read_response(
+    reader: asyncio.StreamReader, has_body: bool = True
+) -> Tuple[int, bool]:
+    """
+    レスポンスを1つ最後まで読み込む
+
+    Args:
+        has_body: レスポンスにボディがあるか。HEADリクエストへのレスポンスではFalse
+
+    Returns:
+        Tuple[int, bool]: (ステータスコード, サーバがコネクションを閉じるか)
+    """
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status_code = int(lines[0].split(" ")[1])
+
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+    closing = headers.get("connection", "").lower() == "close"
+
+    if not has_body or status_code in (204, 304):
+        pass
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            size = int(size_line.split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else:
+        # 長さが分からない場合は、サーバが閉じるまでがボディ
+        await reader.read()
+        closing = True
+
+    return status_code, closing
+
+
+class LoadGenerator:
+    """
+    多数のクライアントから並行してリクエストを送り、レイテンシを記録する
+    """
+
+    def __init__(
+        self,
+        connections: int,
+        duration: float,
+        keep_alive_ratio: float,
+        routes: Dict[str, int] = ROUTES,
+        port: int = PORT,
+    ):
+        """
+        Args:
+            connections: 並行して動かすクライアントの数
+            duration: 負荷をかける秒数
+            keep_alive_ratio: クライアントのうち、keep-aliveを使うものの割合
+            routes: リクエストを送るルートと、その割合
+            port: 負荷をかけるサーバのポート
+        """
+        self.connections = connections
+        self.duration = duration
+        self.keep_alive_ratio = keep_alive_ratio
+        self.routes = routes
+        self.port = port
+        # ルートごとのレイテンシ（秒）
+        self.latencies: Dict[str, List[float]] = {route: [] for route in routes}
+        self.status_codes: Dict[int, int] = {}
+        self.errors = 0
+
+    async def run(self) -> float:
+        """
+        負荷をかける
+
+        Returns:
+            float: 実際に負荷をかけていた秒数
+        """
+        keep_alive_clients = round(self.connections * self.keep_alive_ratio)
+        deadline = time.monotonic() + self.duration
+        started_at = time.monotonic()
+        await asyncio.gather(
+            *(
+                self.client(deadline, keep_alive=i < keep_alive_clients)
+                for i in range(self.connections)
+            )
+        )
+        return time.monotonic() - started_at
+
+    async def client(self, deadline: float, keep_alive: bool) -> None:
+        routes = list(self.routes)
+        weights = list(self.routes.values())
+        reader: Optional[asyncio.StreamReader] = None
+        writer: Optional[asyncio.StreamWriter] = None
+
+        while time.monotonic() < deadline:
+            route = random.choices(routes, weights)[0]
+            started_at = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(HOST, self.port)
+                writer.write(build_request(route, keep_alive, self.port))
+                await writer.drain()
+                status_code, closing = await read_response(reader)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                self.errors += 1
+                closing = True
+            else:
+                self.latencies[route].append(time.perf_counter() - started_at)
+                self.status_codes[status_code] = (
+                    self.status_codes.get(status_code, 0) + 1
+                )
+
+            if closing or not keep_alive:
+                if writer is not None:
+                    writer.close()
+                reader, writer = None, None
+
+        if writer is not None:
+            writer.close()
+
+
+class RssMonitor:
+    """
+    サーバのプロセス（子プロセスを含む）のメモリ使用量(RSS)の最大値を記録する
+
+    Linuxの/procから読み取るので、それ以外の環境では記録されない
+    """
+
+    INTERVAL = 0.1
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss_kb: Optional[int] = None
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            rss = self.read_rss_kb()
+            if rss is not None:
+                self.peak_rss_kb = max(self.peak_rss_kb or 0, rss)
+            try:
+                await asyncio.wait_for(stop.wait(), self.INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def read_rss_kb(self) -> Optional[int]:
+        total = 0
+        for pid in self.process_tree():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1])
+            except OSError:
+                continue
+        return total or None
+
+    def process_tree(self) -> List[int]:
+        pids = [self.pid]
+        for pid in pids:
+            try:
+                with open(f"/proc/{pid}/task/{pid}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                continue
+        return pids
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """
+    ソート済みの値からpパーセンタイルを求める（最近傍法）
+    """
+    if not sorted_values:
+        return None
+    index = round(p / 100 * len(sorted_values)) - 1
+    index = min(len(sorted_values) - 1, max(0, index))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> dict:
+    """
+    レイテンシの一覧から、リクエスト数・秒間リクエスト数・パーセンタイルを求める
+    """
+    values = sorted(latencies)
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "requests": len(values),
+        "rps": round(len(values) / elapsed, 1) if elapsed else 0,
+        "p50_ms": ms(percentile(values, 50)),
+        "p99_ms": ms(percentile(values, 99)),
+        "p999_ms": ms(percentile(values, 99.9)),
+        "max_ms": ms(values[-1] if values else None),
+    }
+
+
+def find_free_port() -> int:
+    """
+    空いているポートをOSに選ばせる
+    """
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def is_listening(port: int) -> bool:
+    """
+    portで接続を受け付けているサーバがあるか
+    """
+    try:
+        socket.create_connection((HOST, port), timeout=0.5).close()
+    except OSError:
+        return False
+    return True
+
+
+def wait_for_server(
+    port: int,
+    server_process: Optional[subprocess.Popen] = None,
+    timeout: float = 10,
+) -> None:
+    """
+    サーバが接続を受け付けるようになるまで待つ
+
+    Args:
+        server_process: 起動したサーバのプロセス。起動に失敗して終了した場合は
+            待つのをやめる
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server_process is not None and server_process.poll() is not None:
+            raise RuntimeError("サーバが起動に失敗して終了しました")
+        if is_listening(port):
+            return
+        time.sleep(0.1)
+    raise RuntimeError("サーバが起動しませんでした")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args: argparse.Namespace, server_pid: Optional[int]) -> dict:
+    routes = ROUTES
+    if args.routes:
+        routes = {route: 1 for route in args.routes.split(",")}
+    generator = LoadGenerator(
+        args.connections, args.duration, args.keep_alive_ratio, routes, args.port
+    )
+
+    stop = asyncio.Event()
+    monitor = RssMonitor(server_pid) if server_pid is not None else None
+    monitor_task = asyncio.create_task(monitor.run(stop)) if monitor else None
+
+    elapsed = await generator.run()
+
+    stop.set()
+    if monitor_task is not None:
+        await monitor_task
+
+    all_latencies = [
+        value for values in generator.latencies.values() for value in values
+    ]
+    return {
+        "version": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            "mode": args.mode,
+            "processes": args.processes,
+            "connections": args.connections,
+            "duration": args.duration,
+            "keep_alive_ratio": args.keep_alive_ratio,
+            "routes": routes,
+        },
+        "elapsed": round(elapsed, 3),
+        "errors": generator.errors,
+        "status_codes": {
+            str(code): n for code, n in sorted(generator.status_codes.items())
+        },
+        "peak_rss_kb": monitor.peak_rss_kb if monitor else None,
+        "total": summarize(all_latencies, elapsed),
+        "routes": {
+            route: summarize(latencies, elapsed)
+            for route, latencies in generator.latencies.items()
+        },
+    }
+
+
+def print_report(result: dict) -> None:
+    print(
+        f"mode={result['config']['mode']} "
+        f"processes={result['config'].get('processes', 1)} "
+        f"connections={result['config']['connections']} "
+        f"keep_alive_ratio={result['config']['keep_alive_ratio']} "
+        f"elapsed={result['elapsed']}s errors={result['errors']} "
+        f"peak_rss={result['peak_rss_kb']}KB"
+    )
+    print(
+        f"{'route':<14}{'requests':>10}{'rps':>10}"
+        f"{'p50ms':>10}{'p99ms':>10}{'p999ms':>10}"
+    )
+    rows = list(result["routes"].items()) + [("total", result["total"])]
+    for route, stats in rows:
+        print(
+            f"{route:<14}{stats['requests']:>10}{stats['rps']:>10}"
+            f"{str(stats['p50_ms']):>10}{str(stats['p99_ms']):>10}"
+            f"{str(stats['p999_ms']):>10}"
+        )
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> bool:
+    """
+    以前の結果と比べ、秒間リクエスト数がthreshold(%)以上落ちていないか確認する
+
+    Returns:
+        bool: 性能が落ちていなければTrue
+    """
+    current_rps = result["total"]["rps"]
+    baseline_rps = baseline["total"]["rps"]
+    change = (current_rps - baseline_rps) / baseline_rps * 100 if baseline_rps else 0
+    print(
+        f"rps: {baseline_rps} ({baseline.get('version')}) -> "
+        f"{current_rps} ({result.get('version')}) {change:+.1f}%"
+    )
+    for key in ("p50_ms", "p99_ms", "p999_ms"):
+        print(f"{key}: {baseline['total'][key]} -> {result['total'][key]}")
+    return change > -threshold
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="HenaServerのベンチマークを行う")
+    parser.add_argument("--mode", choices=Server.MODES, default="thread")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="起動するワーカープロセスの数。2以上でpreforkモードになる",
+    )
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--keep-alive-ratio",
+        type=float,
+        default=0.5,
+        help="keep-aliveを使うクライアントの割合 (0〜1)",
+    )
+    parser.add_argument(
+        "--routes",
+        help="負荷をかけるルートをカンマ区切りで指定する。同じ割合で送る"
+        " ex) wait_sync,wait_async",
+    )
+    parser.add_argument(
+        "--no-server",
+        action="store_true",
+        help="サーバを起動せず、既に起動しているサーバに負荷をかける",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="サーバのポート。省略時は、サーバを起動する場合は空いているポートを選び、"
+        f"--no-serverの場合は{PORT}",
+    )
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較対象とする以前の結果のJSONファイル")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="--compareで、性能低下とみなす秒間リクエスト数の低下率(%%)",
+    )
+    args = parser.parse_args()
+    if args.routes:
+        for route in args.routes.split(","):
+            if route not in ROUTES and route not in WAIT_ROUTES:
+                parser.error(f"不明なルートです: {route}")
+    if args.processes < 1:
+        parser.error("--processesには1以上を指定してください")
+
+    if args.no_server:
+        if args.port is None:
+            args.port = PORT
+    elif args.port is None:
+        args.port = find_free_port()
+    elif is_listening(args.port):
+        # 起動したサーバではなく、既にいるサーバに負荷をかけてしまわないようにする
+        parser.error(f"ポート{args.port}は既に他のサーバが使っています")
+
+    server_process = None
+    if not args.no_server:
+        server_process = subprocess.Popen(
+            [
+                sys.executable,
+                "start.py",
+                "--mode",
+                args.mode,
+                "--host",
+                HOST,
+                "--port",
+                str(args.port),
+                "--processes",
+                str(args.processes),
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            # wait_sync,wait_asyncのルートを登録させる
+            env={**os.environ, "HENANGO_BENCHMARK_ROUTES": "1"},
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    try:
+        wait_for_server(args.port, server_process)
+        server_pid = server_process.pid if server_process else None
+        result = asyncio.run(run_benchmark(args, server_pid))
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.threshold):
+            print("性能が低下しています")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
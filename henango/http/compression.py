@@ -0,0 +1,178 @@
+import zlib
+from typing import Iterable, Iterator, Optional, Sequence
+
+import settings
+from henango.http.mime import get_content_type
+from henango.http.request import HttpRequest
+from henango.http.response import FileResponse, HttpResponse
+
+# 対応しているContent-Encodingと、zlibに渡すwbits。先にあるものほど優先して使う
+# deflateはHTTPの定義通り、zlib形式で包んだものを返す
+ENCODINGS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+}
+
+# 圧縮しても意味が無い、または圧縮してはいけないステータスコード
+UNCOMPRESSED_STATUS_CODES = (204, 206, 304)
+
+# ストリーミングで圧縮する時に、1度に圧縮器へ渡す最大バイト数
+CHUNK_SIZE = 64 * 1024
+
+
+def negotiate_encoding(
+    accept_encoding: str, available: Sequence[str] = tuple(ENCODINGS)
+) -> Optional[str]:
+    """
+    Accept-Encodingから、レスポンスに使うContent-Encodingを決める
+
+    qの値が最も大きいものを選び、同じ場合はavailableの順で優先する。
+    q=0は受け付けないことを表し、"*"は明示されていない全てのものを表す
+
+    Args:
+        accept_encoding: リクエストのAccept-Encodingヘッダーの値
+        available: サーバが返せるContent-Encoding
+
+    Returns:
+        Optional[str]: 使うContent-Encoding。圧縮しない場合はNone
+    """
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: str) -> bool:
+    """
+    圧縮する対象のContent-Typeか判定する
+    """
+    return content_type.startswith(settings.COMPRESSION_CONTENT_TYPES)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """
+    バイト列全体を圧縮する
+    """
+    compressor = zlib.compressobj(
+        settings.COMPRESSION_LEVEL, zlib.DEFLATED, ENCODINGS[encoding]
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """
+    少しずつ作られるボディを、全体をメモリに載せずに圧縮する
+
+    入力の塊ごとに圧縮器をフラッシュするので、ゆっくり作られるボディでも
+    作られた分はすぐにクライアントへ届く。
+    途中で送信をやめてcloseされた場合は、元のボディもcloseする
+    """
+    compressor = zlib.compressobj(
+        settings.COMPRESSION_LEVEL, zlib.DEFLATED, ENCODINGS[encoding]
+    )
+    try:
+        for chunk in chunks:
+            data = [
+                compressor.compress(chunk[start : start + CHUNK_SIZE])
+                for start in range(0, len(chunk), CHUNK_SIZE)
+            ]
+            data.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+            yield b"".join(data)
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def find_header(headers: dict, field: str) -> Optional[str]:
+    """
+    レスポンスヘッダーの辞書から、大文字・小文字を区別せずにfieldのキーを探す
+
+    Returns:
+        Optional[str]: view関数が使ったキーの名前。ヘッダーが無い場合はNone
+    """
+    field = field.lower()
+    for name in headers:
+        if name.lower() == field:
+            return name
+    return None
+
+
+def add_vary(headers: dict, field: str) -> None:
+    """
+    Varyヘッダーにfieldを加える
+    """
+    name = find_header(headers, "Vary") or "Vary"
+    vary = headers.get(name)
+    if not vary:
+        headers[name] = field
+    elif field.lower() not in (value.strip().lower() for value in vary.split(",")):
+        headers[name] = f"{vary}, {field}"
+
+
+def compress_response(request: HttpRequest, response: HttpResponse) -> HttpResponse:
+    """
+    クライアントが受け付ける場合に、view関数が作ったレスポンスのボディを圧縮する
+
+    長さの分かっているボディはsettings.COMPRESSION_MIN_SIZEより小さければ圧縮しない。
+    settings.COMPRESSION_CONTENT_TYPESに含まれないContent-Typeは圧縮しない。
+    ファイルを送るレスポンスや、既に圧縮済みのレスポンスはそのまま返す。
+    ETagを持つレスポンスは、圧縮したものに別のETagを付ける必要があるので、
+    静的ファイルのように、view関数の側で圧縮済みのものを選んで返す
+    """
+    if find_header(response.headers, "Content-Encoding") is not None:
+        # view関数がAccept-Encodingを見て圧縮済みのものを選んだので、キャッシュに区別させる
+        add_vary(response.headers, "Accept-Encoding")
+        return response
+
+    if (
+        isinstance(response, FileResponse)
+        or response.status_code in UNCOMPRESSED_STATUS_CODES
+        or find_header(response.headers, "ETag") is not None
+        or (
+            response.content_length is not None
+            and response.content_length < settings.COMPRESSION_MIN_SIZE
+        )
+    ):
+        return response
+
+    content_type = response.content_type or get_content_type(request.path)
+    if not is_compressible(content_type):
+        return response
+
+    # クライアントによって圧縮するかどうかが変わるので、キャッシュに区別させる
+    add_vary(response.headers, "Accept-Encoding")
+
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return response
+
+    if response.is_streaming:
+        # 長さの分からないボディは、作られた分から圧縮して送る
+        response.body = compress_chunks(response.iter_body(), encoding)
+    else:
+        response.body = compress(response.body, encoding)
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,314 @@
+import re
+from tempfile import SpooledTemporaryFile
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote_to_bytes
+
+import settings
+from henango.http.headers import Headers
+from henango.http.parser import HttpParseError
+
+# フォームの値。同じ名前の値が複数あり得るので、名前ごとにリストで持つ
+Form = Dict[str, List[str]]
+
+# Content-Typeなどのヘッダーの値のパラメータ ex) '; boundary="abc"'
+HEADER_PARAMETER_PATTERN = re.compile(
+    r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^;]*)'
+)
+
+
+def parse_header_value(value: str) -> Tuple[str, Dict[str, str]]:
+    """
+    ヘッダーの値を、本体とパラメータに分ける
+
+    ex) 'multipart/form-data; boundary="abc"'
+        => ('multipart/form-data', {'boundary': 'abc'})
+    """
+    main, _, rest = value.partition(";")
+    params = {}
+    for match in HEADER_PARAMETER_PATTERN.finditer(";" + rest):
+        name, param_value = match.groups()
+        param_value = param_value.strip()
+        if param_value.startswith('"'):
+            param_value = re.sub(r"\\(.)", r"\1", param_value[1:-1])
+        params[name.lower()] = param_value
+    return main.strip().lower(), params
+
+
+class UploadedFile:
+    """
+    multipart/form-dataで送られてきたファイル
+
+    中身はsettings.UPLOAD_MAX_MEMORY_SIZEまではメモリに持ち、
+    それを超えると一時ファイルに書き出す。一時ファイルは閉じると削除される
+    """
+
+    def __init__(self, name: str, filename: str, content_type: str, headers: Headers):
+        """
+        Args:
+            name: フォームの項目名
+            filename: クライアントが送ってきたファイル名（パスとして信用しないこと）
+            content_type: クライアントが送ってきたContent-Type
+            headers: パートのヘッダー
+        """
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.headers = headers
+        self.size = 0
+        self.file = SpooledTemporaryFile(max_size=settings.UPLOAD_MAX_MEMORY_SIZE)
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.size += len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self.file.read(size)
+
+    def seek(self, offset: int) -> None:
+        self.file.seek(offset)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __repr__(self) -> str:
+        return f"<UploadedFile {self.name}: {self.filename!r} ({self.size} bytes)>"
+
+
+def add_value(form: dict, name: str, value) -> None:
+    form.setdefault(name, []).append(value)
+
+
+def parse_urlencoded(chunks: Iterable[bytes]) -> Form:
+    """
+    application/x-www-form-urlencodedのボディを、受信した分から順にパースする
+
+    空の値も残す。値を持たない "name" だけの項目は空文字列の値として扱う
+    """
+    form: Form = {}
+    count = 0
+    # まだ&が現れておらず、続きがあるかもしれない末尾の項目
+    rest = b""
+    for chunk in chunks:
+        pairs = (rest + chunk).split(b"&")
+        rest = pairs.pop()
+        if len(rest) > settings.FORM_MAX_FIELD_SIZE:
+            raise HttpParseError(413, "フォームの値が大きすぎます")
+        for pair in pairs:
+            count += add_pair(form, pair)
+        if count > settings.FORM_MAX_FIELDS:
+            raise HttpParseError(413, "フォームの項目が多すぎます")
+    add_pair(form, rest)
+    return form
+
+
+def add_pair(form: Form, pair: bytes) -> int:
+    """
+    "name=value" を1つパースしてformに加える
+
+    Returns:
+        int: 加えた項目の数
+    """
+    if not pair:
+        return 0
+    name, _, value = pair.partition(b"=")
+    add_value(form, decode_component(name), decode_component(value))
+    return 1
+
+
+def decode_component(component: bytes) -> str:
+    return unquote_to_bytes(component.replace(b"+", b" ")).decode("utf-8", "replace")
+
+
+class MultipartParser:
+    """
+    multipart/form-dataのボディを、受信した分から順にパースする
+
+    ボディ全体をメモリに載せず、ファイルの中身は受信したそばからUploadedFileに書き込む。
+    区切り(boundary)を探す時は、探し終えた部分を次の受信でもう一度探さないよう、
+    区切りの途中かもしれない末尾だけを残して、それより前は先にパートへ渡してしまう
+    """
+
+    # 状態
+    PREAMBLE = "preamble"  # 最初の区切りの前
+    BOUNDARY_END = "boundary_end"  # 区切りの後の "--" か改行の受信待ち
+    HEADERS = "headers"  # パートのヘッダーの受信中
+    DATA = "data"  # パートの中身の受信中
+    END = "end"  # 最後の区切りの後
+
+    # パートのヘッダーとして許容する最大バイト数
+    MAX_PART_HEADER_SIZE = 16 * 1024
+
+    def __init__(self, boundary: bytes):
+        # パートの中身の後には改行が付き、その後に区切りが来る
+        self.delimiter = b"\r\n--" + boundary
+        # 最初の区切りの前には改行が無いので、補っておく
+        self.buffer = bytearray(b"\r\n")
+        self.state = self.PREAMBLE
+        self.form: Form = {}
+        self.files: Dict[str, List[UploadedFile]] = {}
+        self.parts = 0
+
+        # 受信中のパート。ファイルの場合はfile、それ以外はfield_name・field_valueを使う
+        self.file: Optional[UploadedFile] = None
+        self.field_name = ""
+        self.field_value = bytearray()
+
+    def parse(
+        self, chunks: Iterable[bytes]
+    ) -> Tuple[Form, Dict[str, List[UploadedFile]]]:
+        """
+        Returns:
+            Tuple[Form, Dict[str, List[UploadedFile]]]: ファイル以外の値と、ファイル
+
+        Raises:
+            HttpParseError: ボディが不正な場合や、大きすぎる場合
+        """
+        try:
+            for chunk in chunks:
+                self.buffer += chunk
+                self.process()
+                if self.state == self.END:
+                    break
+            if self.state != self.END:
+                raise HttpParseError(400, "multipartのボディが途中で終わっています")
+        except BaseException:
+            # 途中までに受け取ったファイルは返せないので、ここで閉じる
+            self.close()
+            raise
+        return self.form, self.files
+
+    def close(self) -> None:
+        """
+        受け取ったファイルと、受信中のファイルを閉じる
+        """
+        for uploaded_files in self.files.values():
+            for uploaded_file in uploaded_files:
+                uploaded_file.close()
+        if self.file is not None:
+            self.file.close()
+
+    def process(self) -> None:
+        """
+        バッファにあるデータを、これ以上進められなくなるまでパースする
+        """
+        while True:
+            if self.state == self.PREAMBLE:
+                index = self.buffer.find(self.delimiter)
+                if index == -1:
+                    # 区切りの前のデータは読み捨てる
+                    self.discard_scanned()
+                    return
+                del self.buffer[: index + len(self.delimiter)]
+                self.state = self.BOUNDARY_END
+
+            elif self.state == self.BOUNDARY_END:
+                if len(self.buffer) < 2:
+                    return
+                if self.buffer[:2] == b"--":
+                    self.state = self.END
+                    return
+                if self.buffer[:2] != b"\r\n":
+                    raise HttpParseError(400, "multipartの区切りが不正です")
+                # 改行は残し、ヘッダーが空のパートも "\r\n\r\n" で終わりを見つけられるようにする
+                self.state = self.HEADERS
+
+            elif self.state == self.HEADERS:
+                index = self.buffer.find(b"\r\n\r\n")
+                if index == -1:
+                    if len(self.buffer) > self.MAX_PART_HEADER_SIZE:
+                        raise HttpParseError(431, "multipartのヘッダーが大きすぎます")
+                    return
+                self.start_part(Headers(bytes(self.buffer[2:index])))
+                del self.buffer[: index + 4]
+                self.state = self.DATA
+
+            elif self.state == self.DATA:
+                index = self.buffer.find(self.delimiter)
+                if index == -1:
+                    # 区切りの途中かもしれない末尾以外は、パートの中身として確定する
+                    size = len(self.buffer) - len(self.delimiter) + 1
+                    if size > 0:
+                        self.write_part(self.buffer[:size])
+                        del self.buffer[:size]
+                    return
+                self.write_part(self.buffer[:index])
+                del self.buffer[: index + len(self.delimiter)]
+                self.finish_part()
+                self.state = self.BOUNDARY_END
+
+            else:
+                return
+
+    def discard_scanned(self) -> None:
+        size = len(self.buffer) - len(self.delimiter) + 1
+        if size > 0:
+            del self.buffer[:size]
+
+    def start_part(self, headers: Headers) -> None:
+        self.parts += 1
+        if self.parts > settings.FORM_MAX_FIELDS:
+            raise HttpParseError(413, "フォームの項目が多すぎます")
+
+        disposition, params = parse_header_value(
+            headers.get("Content-Disposition", "")
+        )
+        if disposition != "form-data" or "name" not in params:
+            raise HttpParseError(400, "multipartのContent-Dispositionが不正です")
+
+        if "filename" in params:
+            self.file = UploadedFile(
+                params["name"],
+                params["filename"],
+                headers.get("Content-Type", "application/octet-stream"),
+                headers,
+            )
+        else:
+            self.file = None
+            self.field_name = params["name"]
+            self.field_value = bytearray()
+
+    def write_part(self, data: bytearray) -> None:
+        if self.file is not None:
+            self.file.write(data)
+            return
+        self.field_value += data
+        if len(self.field_value) > settings.FORM_MAX_FIELD_SIZE:
+            raise HttpParseError(413, "フォームの値が大きすぎます")
+
+    def finish_part(self) -> None:
+        if self.file is not None:
+            self.file.seek(0)
+            add_value(self.files, self.file.name, self.file)
+            self.file = None
+        else:
+            add_value(
+                self.form, self.field_name, self.field_value.decode("utf-8", "replace")
+            )
+
+
+def parse_form(
+    content_type: str, chunks: Iterable[bytes]
+) -> Tuple[Form, Dict[str, List[UploadedFile]]]:
+    """
+    Content-Typeに応じてリクエストボディをパースする
+
+    Args:
+        content_type: リクエストのContent-Typeヘッダーの値
+        chunks: リクエストボディを少しずつ返すイテラブル
+
+    Returns:
+        Tuple[Form, Dict[str, List[UploadedFile]]]: ファイル以外の値と、ファイル
+        フォームではないContent-Typeの場合は、どちらも空の辞書
+
+    Raises:
+        HttpParseError: ボディが不正な場合や、大きすぎる場合
+    """
+    media_type, params = parse_header_value(content_type)
+    if media_type == "application/x-www-form-urlencoded":
+        return parse_urlencoded(chunks), {}
+    if media_type == "multipart/form-data":
+        boundary = params.get("boundary")
+        if not boundary or len(boundary) > 70:
+            raise HttpParseError(400, "multipartのboundaryが不正です")
+        return MultipartParser(boundary.encode()).parse(chunks)
+    return {}, {}
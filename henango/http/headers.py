@@ -0,0 +1,77 @@
+from typing import Dict, Iterator, Mapping, Optional, Tuple, Union
+
+
+class Headers(Mapping[str, str]):
+    """
+    リクエストヘッダーを、名前の大文字・小文字を区別せずに参照できるマッピング
+
+    受信したヘッダー部分のバイト列をそのまま持っておき、
+    初めて参照された時に1度だけ辞書にパースする。
+    ヘッダーを1つも参照しないリクエストでは、パースも文字列の生成も行わない。
+
+    同じ名前のヘッダーが複数ある場合は、値を ", " で（Cookieは "; " で）連結する
+    """
+
+    __slots__ = ("raw", "_items")
+
+    def __init__(self, raw: Union[bytes, Mapping[str, str]] = b""):
+        """
+        Args:
+            raw: リクエストラインの後から、ヘッダーの終わりの空行の前までのバイト列
+                組み立て済みのヘッダーを辞書で渡してもよい
+        """
+        # 小文字にした名前と、(元の名前, 値)
+        self._items: Optional[Dict[str, Tuple[str, str]]] = None
+        if isinstance(raw, bytes):
+            self.raw = raw
+        else:
+            self.raw = b""
+            self._items = {
+                name.lower(): (name, value) for name, value in raw.items()
+            }
+
+    @property
+    def items_by_key(self) -> Dict[str, Tuple[str, str]]:
+        if self._items is None:
+            self._items = self.parse(self.raw)
+        return self._items
+
+    @staticmethod
+    def parse(raw: bytes) -> Dict[str, Tuple[str, str]]:
+        """
+        ヘッダー部分のバイト列を辞書にパースする
+
+        行の形式はHttpRequestParserが受信時に検証しているので、ここでは検証しない
+        """
+        items: Dict[str, Tuple[str, str]] = {}
+        if not raw:
+            return items
+        for line in raw.decode("utf-8", "replace").split("\r\n"):
+            name, _, value = line.partition(":")
+            key = name.lower()
+            value = value.strip()
+            if key in items:
+                separator = "; " if key == "cookie" else ", "
+                value = items[key][1] + separator + value
+                name = items[key][0]
+            items[key] = (name, value)
+        return items
+
+    def __getitem__(self, name: str) -> str:
+        return self.items_by_key[name.lower()][1]
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and name.lower() in self.items_by_key
+
+    def get(self, name: str, default=None):
+        item = self.items_by_key.get(name.lower())
+        return default if item is None else item[1]
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name, _ in self.items_by_key.values())
+
+    def __len__(self) -> int:
+        return len(self.items_by_key)
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items_by_key.values()))
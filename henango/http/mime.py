@@ -0,0 +1,20 @@
+# 拡張子とMIME Typeの対応
+MIME_TYPES = {
+    "html": "text/html; charset=UTF-8",
+    "css": "text/css",
+    "png": "image/png",
+    "jpg": "image/jpg",
+    "gif": "image/gif",
+}
+
+
+def get_content_type(path: str) -> str:
+    """
+    pathの拡張子からMIME Typeを特定する
+
+    拡張子が無い場合はHTMLとみなし、対応していない拡張子の場合はoctet-streamとする
+    """
+    if "." not in path:
+        return "text/html; charset=UTF-8"
+    ext = path.rsplit(".", maxsplit=1)[-1]
+    return MIME_TYPES.get(ext, "application/octet-stream")
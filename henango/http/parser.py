@@ -0,0 +1,314 @@
+import re
+import time
+from typing import Optional
+
+from henango.http.headers import Headers
+from henango.http.request import HttpRequest
+
+# ヘッダー部分全体の形式。各行は "名前:値" で、名前に空白などは含められない
+HEADER_BLOCK_PATTERN = re.compile(
+    rb"[!#$%&'*+\-.^_`|~0-9A-Za-z]+:[^\r\n]*"
+    rb"(?:\r\n[!#$%&'*+\-.^_`|~0-9A-Za-z]+:[^\r\n]*)*"
+)
+
+# ボディの長さの決め方と、コネクションの扱いに関わるヘッダーの行
+FRAMING_HEADER_PATTERN = re.compile(
+    rb"^(content-length|transfer-encoding|connection|expect):"
+    rb"[ \t]*([^\r\n]*?)[ \t]*(?:\r|\Z)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Content-Lengthの値。符号や空白、ASCII以外の数字は認めない
+CONTENT_LENGTH_PATTERN = re.compile(r"[0-9]+")
+
+# チャンクのサイズ。intが受け付ける符号や0x、_などは認めない
+CHUNK_SIZE_PATTERN = re.compile(rb"[0-9A-Fa-f]+")
+
+
+class HttpParseError(Exception):
+    """
+    受信したデータがHTTPリクエストとして解釈できない場合に送出する例外
+
+    status_codeは、クライアントへ返すべきレスポンスのステータスコード
+    """
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class HttpRequestParser:
+    """
+    HTTPリクエストをインクリメンタルにパースする
+
+    受信したバイト列をfeedで少しずつ渡していき、ヘッダーが揃ったらparse_headで
+    HttpRequestを、その後はparse_bodyでボディを少しずつ取り出す。
+    ボディを読み終わったら、バッファに残っているデータは次のリクエストとして扱う。
+    """
+
+    # 状態
+    HEAD = "head"  # ヘッダーの受信待ち
+    BODY = "body"  # Content-Lengthで長さが決まっているボディの受信中
+    CHUNK_SIZE = "chunk_size"  # チャンクのサイズ行の受信待ち
+    CHUNK_DATA = "chunk_data"  # チャンクのデータの受信中
+    CHUNK_DATA_END = "chunk_data_end"  # チャンクのデータの後の改行の受信待ち
+    TRAILER = "trailer"  # 最後のチャンクの後のトレイラーの受信中
+
+    # チャンクのサイズ行として許容する長さ
+    MAX_CHUNK_SIZE_LINE = 1024
+
+    def __init__(self, max_header_size: int, max_body_size: int):
+        """
+        Args:
+            max_header_size: リクエストライン・ヘッダーの合計の最大バイト数
+            max_body_size: ボディの最大バイト数
+        """
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+
+        self.buffer = bytearray()
+        self.state = self.HEAD
+        # ヘッダーの終わりを探し始める位置。探し終えた部分を何度も走査しないようにする
+        self.scan_position = 0
+        # 現在のチャンク、またはContent-Lengthのボディの残りバイト数
+        self.remaining = 0
+        # これまでに読み出したボディのバイト数
+        self.body_size = 0
+        # 最後にパースしたリクエストライン・ヘッダーのバイト列
+        self.raw_head = b""
+        # 最後にパースしたリクエストライン・ヘッダーのパースにかかった秒数
+        self.parse_duration = 0.0
+        # 記録中のリクエストの生のバイト列。記録していない場合はNone
+        self.recording: Optional[bytearray] = None
+
+    def feed(self, data: bytes) -> None:
+        """
+        受信したバイト列をバッファに追加する
+        """
+        self.buffer += data
+
+    @property
+    def has_buffered_data(self) -> bool:
+        """
+        まだパースしていないデータがバッファに残っているか
+        """
+        return len(self.buffer) > 0
+
+    def parse_head(self) -> Optional[HttpRequest]:
+        """
+        バッファからリクエストライン・ヘッダーをパースする
+
+        Returns:
+            Optional[HttpRequest]: ボディ以外をパースしたリクエスト
+            ヘッダーの終わりまで受信できていない場合はNone
+
+        Raises:
+            HttpParseError: リクエストが不正な場合や、ヘッダーが大きすぎる場合
+        """
+        started_at = time.perf_counter()
+        end = self.buffer.find(b"\r\n\r\n", self.scan_position)
+        if end == -1:
+            if len(self.buffer) > self.max_header_size:
+                raise HttpParseError(431, "リクエストヘッダーが大きすぎます")
+            # 区切りがバッファの末尾をまたいでいる可能性があるので、3バイト戻った位置から探す
+            self.scan_position = max(0, len(self.buffer) - 3)
+            return None
+        if end > self.max_header_size:
+            raise HttpParseError(431, "リクエストヘッダーが大きすぎます")
+
+        self.raw_head = bytes(self.buffer[:end])
+        del self.buffer[: end + 4]
+        self.scan_position = 0
+
+        request_line, _, header_block = self.raw_head.partition(b"\r\n")
+
+        # リクエストラインをパースする
+        try:
+            parts = request_line.decode().split(" ")
+        except UnicodeDecodeError:
+            raise HttpParseError(400, "リクエストラインをデコードできません")
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise HttpParseError(400, f"不正なリクエストラインです: {request_line!r}")
+        method, target, http_version = parts
+        path, _, query_string = target.partition("?")
+
+        # ヘッダーは形式の検証だけを行い、辞書へのパースは参照された時に行う
+        if header_block and not HEADER_BLOCK_PATTERN.fullmatch(header_block):
+            raise HttpParseError(400, "不正なヘッダーです")
+
+        # ボディの長さの決め方と、リクエストごとに参照するコネクションの扱いに
+        # 関わるヘッダーだけは、ここで拾っておく
+        content_length = None
+        transfer_encodings = []
+        connections = []
+        expect = ""
+        for match in FRAMING_HEADER_PATTERN.finditer(header_block):
+            name, value = match.group(1).lower(), match.group(2).decode("latin-1")
+            if name == b"transfer-encoding":
+                transfer_encodings.append(value.lower())
+            elif name == b"connection":
+                connections.append(value)
+            elif name == b"expect":
+                expect = value
+            elif content_length is not None and value != content_length:
+                # 食い違うContent-Lengthは、どちらを信じるかで解釈が分かれるので拒否する
+                raise HttpParseError(400, "Content-Lengthが複数あります")
+            else:
+                content_length = value
+        transfer_encoding = ", ".join(transfer_encodings) or None
+
+        self.start_body(content_length, transfer_encoding)
+
+        request = HttpRequest(
+            method=method,
+            path=path,
+            query_string=query_string,
+            http_version=http_version,
+            headers=Headers(header_block),
+            connection=", ".join(connections),
+            expect=expect,
+        )
+        self.parse_duration = time.perf_counter() - started_at
+        return request
+
+    def start_body(
+        self, content_length: Optional[str], transfer_encoding: Optional[str]
+    ) -> None:
+        """
+        ヘッダーからボディの長さの決め方を判断し、ボディの受信を始める状態にする
+        """
+        self.body_size = 0
+
+        # Transfer-EncodingとContent-Lengthの両方がある場合はTransfer-Encodingを優先する
+        if transfer_encoding is not None:
+            if transfer_encoding.split(",")[-1].strip() != "chunked":
+                raise HttpParseError(
+                    501, f"未対応のTransfer-Encodingです: {transfer_encoding}"
+                )
+            self.state = self.CHUNK_SIZE
+            return
+
+        if content_length is None:
+            self.remaining = 0
+        elif CONTENT_LENGTH_PATTERN.fullmatch(content_length):
+            self.remaining = int(content_length)
+        else:
+            raise HttpParseError(400, f"不正なContent-Lengthです: {content_length}")
+
+        if self.remaining > self.max_body_size:
+            raise HttpParseError(413, "リクエストボディが大きすぎます")
+        self.state = self.BODY
+
+    def start_recording(self) -> None:
+        """
+        最後にパースしたリクエストの生のバイト列の記録を始める
+
+        チャンクの区切りなども含め、受信した通りのバイト列をボディの終わりまで記録する
+        """
+        self.recording = bytearray(self.raw_head + b"\r\n\r\n")
+
+    def stop_recording(self) -> Optional[bytes]:
+        """
+        記録を終え、記録したバイト列を返す。記録していなかった場合はNone
+        """
+        recording, self.recording = self.recording, None
+        return bytes(recording) if recording is not None else None
+
+    def parse_body(self) -> Optional[bytes]:
+        """
+        バッファからボディの続きを取り出す
+
+        チャンク形式の場合は、チャンクの区切りを取り除いたデータを返す
+
+        Returns:
+            Optional[bytes]: 取り出せたボディの一部
+            ボディを最後まで読み終わった場合はb""、データが足りない場合はNone
+
+        Raises:
+            HttpParseError: チャンクの形式が不正な場合や、ボディが大きすぎる場合
+        """
+        if self.state == self.HEAD:
+            return b""
+        if self.state == self.BODY:
+            return self.parse_fixed_body()
+        return self.parse_chunked_body()
+
+    def parse_fixed_body(self) -> Optional[bytes]:
+        if self.remaining == 0:
+            self.state = self.HEAD
+            return b""
+        if not self.buffer:
+            return None
+
+        data = self.take(self.remaining)
+        self.remaining -= len(data)
+        return data
+
+    def parse_chunked_body(self) -> Optional[bytes]:
+        while True:
+            if self.state == self.CHUNK_SIZE:
+                line = self.take_line()
+                if line is None:
+                    return None
+                size_string = line.split(b";", maxsplit=1)[0].strip()
+                if not CHUNK_SIZE_PATTERN.fullmatch(size_string):
+                    raise HttpParseError(400, f"不正なチャンクサイズです: {line!r}")
+                self.remaining = int(size_string, 16)
+                if self.body_size + self.remaining > self.max_body_size:
+                    raise HttpParseError(413, "リクエストボディが大きすぎます")
+                self.state = self.CHUNK_DATA if self.remaining else self.TRAILER
+
+            elif self.state == self.CHUNK_DATA:
+                if not self.buffer:
+                    return None
+                data = self.take(self.remaining)
+                self.remaining -= len(data)
+                if self.remaining == 0:
+                    self.state = self.CHUNK_DATA_END
+                return data
+
+            elif self.state == self.CHUNK_DATA_END:
+                if len(self.buffer) < 2:
+                    return None
+                if self.buffer[:2] != b"\r\n":
+                    raise HttpParseError(400, "チャンクの終わりに改行がありません")
+                self.consume(2)
+                self.state = self.CHUNK_SIZE
+
+            elif self.state == self.TRAILER:
+                # トレイラーは読み飛ばし、空行が来たらボディの終わり
+                line = self.take_line()
+                if line is None:
+                    return None
+                if not line:
+                    self.state = self.HEAD
+                    return b""
+
+    def take(self, size: int) -> bytes:
+        """
+        バッファの先頭から最大sizeバイトを取り出す
+        """
+        data = self.consume(size)
+        self.body_size += len(data)
+        return data
+
+    def take_line(self) -> Optional[bytes]:
+        """
+        バッファの先頭から改行までを取り出す。改行まで受信できていない場合はNone
+        """
+        end = self.buffer.find(b"\r\n")
+        if end == -1:
+            if len(self.buffer) > self.MAX_CHUNK_SIZE_LINE:
+                raise HttpParseError(400, "チャンクのサイズ行が長すぎます")
+            return None
+        return self.consume(end + 2)[:-2]
+
+    def consume(self, size: int) -> bytes:
+        """
+        バッファの先頭からsizeバイトを取り除いて返す。記録中の場合は記録もする
+        """
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        if self.recording is not None:
+            self.recording += data
+        return data
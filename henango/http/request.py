@@ -1,26 +1,304 @@
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Union,
+)
+from urllib.parse import parse_qs
+
+import settings
+from henango.http.headers import Headers
+from henango.http.session import Session, session_store, unsign
+
+
+class RequestBody:
+    """
+    リクエストボディを読み出すためのストリーム
+
+    ボディは必要になった時にソケットなどから少しずつ受信されるので、
+    大きなボディでも全体をメモリに載せずに読み進められる
+    """
+
+    __slots__ = ("read_chunk", "buffer", "finished", "file")
+
+    def __init__(
+        self,
+        read_chunk: Optional[Callable[[], bytes]] = None,
+        file: Optional[BinaryIO] = None,
+    ):
+        """
+        Args:
+            read_chunk: ボディの続きを受信して返す関数。ボディの終わりではb""を返す
+            file: read_chunkが読み出す一時ファイルなど。closeで閉じる
+        """
+        self.read_chunk = read_chunk
+        self.file = file
+        # 受信済みで、まだ読み出されていないデータ
+        self.buffer = b""
+        self.finished = read_chunk is None
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "RequestBody":
+        """
+        受信済みのバイト列からストリームを作る
+        """
+        body = cls()
+        body.buffer = data
+        return body
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        ボディを最大sizeバイト読み出す。sizeが負の場合は最後まで読み出す
+
+        Returns:
+            bytes: 読み出したデータ。ボディの終わりに達している場合はb""
+        """
+        if size < 0:
+            chunks = [self.buffer]
+            self.buffer = b""
+            chunks.extend(self)
+            return b"".join(chunks)
+
+        while len(self.buffer) < size and not self.finished:
+            self.buffer += self.next_chunk()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def __iter__(self) -> Iterator[bytes]:
+        """
+        受信した単位でボディを読み出す
+        """
+        if self.buffer:
+            data, self.buffer = self.buffer, b""
+            yield data
+        while not self.finished:
+            chunk = self.next_chunk()
+            if chunk:
+                yield chunk
+
+    def drain(self) -> None:
+        """
+        読み出されていない残りのボディを読み捨てる
+        """
+        self.buffer = b""
+        for _ in self:
+            pass
+
+    def close(self) -> None:
+        """
+        レスポンスを返し終えた後に呼び、ボディを読み出していたファイルを閉じる
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def next_chunk(self) -> bytes:
+        chunk = self.read_chunk()
+        if not chunk:
+            self.finished = True
+        return chunk
+
+
 class HttpRequest:
+    """
+    受信したHTTPリクエスト
+
+    インスタンスの数が多いので、__slots__で属性を固定してメモリを節約する。
+    Cookieやクエリ文字列、セッション、フォームは、view関数が参照した時に初めてパースする
+    """
+
+    __slots__ = (
+        "path",
+        "method",
+        "http_version",
+        "query_string",
+        "headers",
+        "connection",
+        "expect",
+        "stream",
+        "params",
+        "route",
+        "view",
+        "view_is_async",
+        "_body",
+        "_cookies",
+        "_query",
+        "_session",
+        "_form",
+        "_files",
+    )
+
     path: str
     method: str
     http_version: str
-    headers: dict
-    cookies: dict
-    body: bytes
+    query_string: str
+    headers: Headers
+    connection: str
+    expect: str
+    stream: RequestBody
     params: dict
+    route: str
+    view: Optional[Callable[["HttpRequest"], Any]]
+    view_is_async: bool
 
     def __init__(
         self,
         path: str = "",
         method: str = "",
         http_version: str = "",
-        headers: dict = {},
+        headers: Union[Headers, Mapping[str, str], None] = None,
         body: bytes = b"",
-        params: dict = {},
-        cookies: dict = {},
+        params: Optional[dict] = None,
+        cookies: Optional[Dict[str, str]] = None,
+        query_string: str = "",
+        stream: Optional[RequestBody] = None,
+        connection: Optional[str] = None,
+        expect: Optional[str] = None,
     ):
+        """
+        Args:
+            connection: Connectionヘッダーの値
+            expect: Expectヘッダーの値
+                どちらもリクエストごとに参照するので、パーサーがヘッダーの検証と同時に
+                拾って渡す。省略した場合はheadersから取り出す
+        """
         self.path = path
         self.method = method
         self.http_version = http_version
-        self.headers = headers
-        self.body = body
-        self.params = params
-        self.cookies = cookies
+        self.query_string = query_string
+        if isinstance(headers, Headers):
+            self.headers = headers
+        else:
+            self.headers = Headers(headers or b"")
+        if connection is None:
+            connection = self.headers.get("Connection", "")
+        if expect is None:
+            expect = self.headers.get("Expect", "")
+        # 比べやすいよう小文字にしておく
+        self.connection = connection.lower()
+        self.expect = expect.lower()
+        self.stream = stream if stream is not None else RequestBody.from_bytes(body)
+        self._body: Optional[bytes] = None
+        # 辞書はインスタンスごとに作り、他のリクエストと共有しない
+        self.params = params if params is not None else {}
+        # URL解決でマッチしたURLパターン。メトリクスのラベルに使う
+        self.route = ""
+        # URL解決で見つかったview関数
+        self.view = None
+        # viewがasync defで定義されたものか
+        self.view_is_async = False
+        self._cookies = cookies
+        self._query: Optional[Dict[str, List[str]]] = None
+        self._session: Optional[Session] = None
+        self._form: Optional[Dict[str, List[str]]] = None
+        self._files: Optional[Dict[str, list]] = None
+
+    @property
+    def body(self) -> bytes:
+        """
+        リクエストボディ全体
+
+        初めて参照した時にstreamから最後まで読み出してメモリに載せる。
+        大きなボディを扱う場合はstreamから少しずつ読み出すこと
+        """
+        if self._body is None:
+            self._body = self.stream.read()
+        return self._body
+
+    @property
+    def cookies(self) -> Dict[str, str]:
+        """
+        Cookieヘッダーをパースした辞書。初めて参照した時にパースする
+        """
+        if self._cookies is None:
+            self._cookies = {}
+            cookie_header = self.headers.get("Cookie")
+            if cookie_header:
+                for cookie_string in cookie_header.split(";"):
+                    name, _, value = cookie_string.strip().partition("=")
+                    if name:
+                        self._cookies[name] = value
+        return self._cookies
+
+    @property
+    def query(self) -> Dict[str, List[str]]:
+        """
+        クエリ文字列をパースした辞書。初めて参照した時にパースする
+        """
+        if self._query is None:
+            self._query = parse_qs(self.query_string)
+        return self._query
+
+    @property
+    def session(self) -> Session:
+        """
+        Cookieのセッションに紐づくデータ。初めて参照した時にセッションIDを検証する
+
+        データは更に、中身を参照した時に初めて保存先から読み出す
+        """
+        if self._session is None:
+            value = self.cookies.get(settings.SESSION_COOKIE_NAME)
+            session_key = unsign(value) if value else None
+            self._session = Session(session_store, session_key)
+        return self._session
+
+    @property
+    def has_session(self) -> bool:
+        """
+        view関数がセッションを参照したか
+        """
+        return self._session is not None
+
+    @property
+    def form(self) -> Dict[str, List[str]]:
+        """
+        application/x-www-form-urlencoded, multipart/form-dataのボディの、
+        ファイル以外の値。初めて参照した時にパースする
+        """
+        if self._form is None:
+            self.parse_form()
+        return self._form
+
+    @property
+    def files(self) -> Dict[str, list]:
+        """
+        multipart/form-dataで送られてきたファイル (UploadedFileのリスト)
+        初めて参照した時にパースする
+        """
+        if self._files is None:
+            self.parse_form()
+        return self._files
+
+    def close(self) -> None:
+        """
+        レスポンスを返し終えた後に呼び、ボディを書き出した一時ファイルと、
+        アップロードされたファイルを閉じる
+        """
+        self.stream.close()
+        if self._files:
+            for uploaded_files in self._files.values():
+                for uploaded_file in uploaded_files:
+                    uploaded_file.close()
+
+    def parse_form(self) -> None:
+        """
+        ボディをstreamから少しずつ読み出しながらパースする
+
+        ファイルの中身はメモリに溜めず、大きいものは一時ファイルに書き出す
+
+        Raises:
+            HttpParseError: ボディが不正な場合や、大きすぎる場合
+        """
+        # パーサーがこのモジュールを読み込むので、循環しないようここで読み込む
+        from henango.http.form import parse_form
+
+        # 既にbodyで全体を読み出している場合は、それをパースする
+        chunks = self.stream if self._body is None else (self._body,)
+        self._form, self._files = parse_form(
+            self.headers.get("Content-Type", ""), chunks
+        )
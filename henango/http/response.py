@@ -1,25 +1,138 @@
-from typing import Optional, Union, List
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Union
 
 from henango.http.cookie import Cookie
 
+# レスポンスボディとして渡せるもの
+# イテラブルの場合は、要素を順に送信する（strの要素はUTF-8にエンコードする）
+Body = Union[bytes, str, Iterable[Union[bytes, str]]]
+
+
+def encode_chunks(chunks: Iterable[Union[bytes, str]]) -> Iterator[bytes]:
+    """
+    イテラブルのボディの要素を、順にbytesにして返す
+
+    途中で送信をやめてcloseされた場合は、元のボディもcloseする
+    """
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            # 空のチャンクはチャンク形式の終わりと区別できないので送らない
+            if chunk:
+                yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
 
 class HttpResponse:
+    """
+    view関数が返すレスポンス
+
+    ボディにはbytes, strの他に、ジェネレーターなどのイテラブルを渡せる。
+    イテラブルの場合は全体を組み立てずに、作られた分から順に送信する。
+    """
+
+    __slots__ = ("status_code", "headers", "cookies", "content_type", "body")
+
     status_code: int
     headers: dict
     cookies: List[Cookie]
     content_type: Optional[str]
-    body: Union[bytes, str]
+    body: Body
 
     def __init__(
         self,
         status_code: int = 200,
-        headers: dict = {},
-        cookies: List[Cookie] = [],
+        headers: Optional[dict] = None,
+        cookies: Optional[List[Cookie]] = None,
         content_type: Optional[str] = None,
-        body: Union[bytes, str] = b"",
+        body: Body = b"",
     ):
         self.status_code = status_code
-        self.headers = headers
+        # 辞書やリストはインスタンスごとに作り、他のレスポンスと共有しない
+        self.headers = headers if headers is not None else {}
         self.content_type = content_type
         self.body = body
-        self.cookies = cookies
+        self.cookies = cookies if cookies is not None else []
+
+    @property
+    def is_streaming(self) -> bool:
+        """
+        ボディがイテラブルで、少しずつ送信するか
+        """
+        return not isinstance(self.body, (bytes, str))
+
+    @property
+    def content_length(self) -> Optional[int]:
+        """
+        Content-Lengthとして送るボディのバイト数
+
+        ボディがイテラブルで、送り終えるまで長さが分からない場合はNone
+        """
+        if self.is_streaming:
+            return None
+        return len(self.body)
+
+    def iter_body(self) -> Iterator[bytes]:
+        """
+        ボディを少しずつbytesで返す
+        """
+        if not self.is_streaming:
+            return iter((self.body,))
+        return encode_chunks(self.body)
+
+    def close(self) -> None:
+        """
+        レスポンスを送信し終えた後に呼ばれる。ファイルなどのリソースを解放する
+
+        ボディがジェネレーターの場合は、途中で送信をやめた時のためにcloseしておく
+        """
+        close = getattr(self.body, "close", None)
+        if close is not None:
+            close()
+
+
+class FileResponse(HttpResponse):
+    """
+    ファイルの内容をボディとするレスポンス
+
+    ファイルの中身をPythonのメモリに読み込まず、送信時にos.sendfileで
+    カーネルからソケットへ直接送る
+    """
+
+    __slots__ = ("file", "offset", "length")
+
+    file: BinaryIO
+    offset: int
+    length: int
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        offset: int = 0,
+        length: int = 0,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+        content_type: Optional[str] = None,
+    ):
+        """
+        Args:
+            file: バイナリモードで開いたファイル。送信後に閉じられる
+            offset: 送信を始めるファイル中の位置
+            length: 送信するバイト数
+        """
+        super().__init__(
+            status_code=status_code, headers=headers, content_type=content_type
+        )
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    @property
+    def content_length(self) -> int:
+        return self.length
+
+    def close(self) -> None:
+        self.file.close()
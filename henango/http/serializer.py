@@ -0,0 +1,186 @@
+import time
+from email.utils import formatdate
+from http import HTTPStatus
+from typing import Dict, List, Tuple
+
+import settings
+from henango.http.cookie import Cookie
+from henango.http.mime import get_content_type
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+
+# HTTPStatusの説明句のうち、RFC 9110で名前が変わったもの
+REASON_PHRASES = {
+    413: "Content Too Large",
+    416: "Range Not Satisfiable",
+}
+
+
+def reason_phrase(status_code: int) -> str:
+    """
+    ステータスコードの説明句を返す。知らないステータスコードの場合は"Unknown"
+    """
+    if status_code in REASON_PHRASES:
+        return REASON_PHRASES[status_code]
+    try:
+        return HTTPStatus(status_code).phrase
+    except ValueError:
+        return "Unknown"
+
+
+# ボディを持たないステータスコード。1xxも含め、Content-Lengthなどのボディの長さを送らない
+# RFC 9110 8.6, 6.4.1
+BODILESS_STATUS_CODES = (204, 304)
+
+
+def has_body(status_code: int) -> bool:
+    """
+    そのステータスコードのレスポンスがボディを持つか
+    """
+    return not (100 <= status_code < 200 or status_code in BODILESS_STATUS_CODES)
+
+
+# ステータスコードと、レスポンスラインのバイト列の対応
+STATUS_LINES: Dict[int, bytes] = {
+    status.value: f"HTTP/1.1 {status.value} {reason_phrase(status.value)}\r\n".encode()
+    for status in HTTPStatus
+}
+
+
+class HttpDate:
+    """
+    Dateヘッダーの値を1秒に1回だけ作り直して使い回す
+
+    Dateヘッダーの精度は秒なので、同じ秒の間は同じバイト列を返せばよい
+    """
+
+    def __init__(self):
+        # (作った時刻の秒, Dateヘッダーの行)
+        # 複数のスレッドから参照されるので、1つのタプルとしてまとめて入れ替える
+        self.cache: Tuple[int, bytes] = (-1, b"")
+
+    def header_line(self) -> bytes:
+        now = int(time.time())
+        second, line = self.cache
+        if second != now:
+            line = f"Date: {formatdate(now, usegmt=True)}\r\n".encode()
+            self.cache = (now, line)
+        return line
+
+
+class ResponseSerializer:
+    """
+    レスポンスライン・レスポンスヘッダーを、送信できるバイト列にする
+
+    変化しないヘッダーの行は予めバイト列にしておき、
+    レスポンスごとに変わる行だけを作ってリストに集め、最後に1度だけ連結する
+    """
+
+    SERVER_LINE = b"Server: HenaServer/0.1\r\n"
+    CONNECTION_CLOSE_LINE = b"Connection: close\r\n"
+    CHUNKED_LINE = b"Transfer-Encoding: chunked\r\n"
+
+    def __init__(self):
+        self.date = HttpDate()
+        # このコネクションで処理したリクエストの数と、keep-aliveの時に送る行
+        self.keep_alive_lines = [
+            (
+                "Connection: keep-alive\r\n"
+                f"Keep-Alive: timeout={settings.KEEP_ALIVE_TIMEOUT}, "
+                f"max={max(settings.KEEP_ALIVE_MAX_REQUESTS - count, 0)}\r\n"
+            ).encode()
+            for count in range(settings.KEEP_ALIVE_MAX_REQUESTS + 1)
+        ]
+        # Content-Typeの値と、その行。種類は限られるので作ったものを覚えておく
+        self.content_type_lines: Dict[str, bytes] = {}
+
+    def status_line(self, status_code: int) -> bytes:
+        line = STATUS_LINES.get(status_code)
+        if line is None:
+            line = f"HTTP/1.1 {status_code} {reason_phrase(status_code)}\r\n".encode()
+        return line
+
+    def content_type_line(self, content_type: str) -> bytes:
+        line = self.content_type_lines.get(content_type)
+        if line is None:
+            line = f"Content-Type: {content_type}\r\n".encode()
+            self.content_type_lines[content_type] = line
+        return line
+
+    def serialize_head(
+        self,
+        response: HttpResponse,
+        request: HttpRequest,
+        keep_alive: bool,
+        handled_count: int,
+        chunked: bool,
+    ) -> bytes:
+        """
+        レスポンスライン、レスポンスヘッダーと、その後の空行までのバイト列を作る
+
+        Args:
+            response: レスポンス
+            request: リクエスト（MIMEタイプの判定に使用）
+            keep_alive: レスポンスを返した後もコネクションを維持するか
+            handled_count: このコネクションで処理したリクエストの数
+            chunked: ボディをTransfer-Encoding: chunkedで送るか
+        """
+        # Content-Typeが指定されていない場合はpathから特定する
+        if response.content_type is None:
+            response.content_type = get_content_type(request.path)
+
+        lines: List[bytes] = [
+            self.status_line(response.status_code),
+            self.date.header_line(),
+            self.SERVER_LINE,
+        ]
+
+        # 1xx, 204, 304はボディを持たないので、Content-Lengthも送らない
+        if has_body(response.status_code):
+            content_length = response.content_length
+            if content_length is not None:
+                lines.append(b"Content-Length: %d\r\n" % content_length)
+            elif chunked:
+                lines.append(self.CHUNKED_LINE)
+
+        if keep_alive:
+            lines.append(
+                self.keep_alive_lines[
+                    min(handled_count, settings.KEEP_ALIVE_MAX_REQUESTS)
+                ]
+            )
+        else:
+            lines.append(self.CONNECTION_CLOSE_LINE)
+
+        lines.append(self.content_type_line(response.content_type))
+
+        for cookie in response.cookies:
+            lines.append(b"Set-Cookie: " + serialize_cookie(cookie) + b"\r\n")
+
+        for header_name, header_value in response.headers.items():
+            lines.append(f"{header_name}: {header_value}\r\n".encode())
+
+        lines.append(b"\r\n")
+        return b"".join(lines)
+
+
+def serialize_cookie(cookie: Cookie) -> bytes:
+    """
+    Set-Cookieヘッダーの値を作る
+    """
+    attributes = [f"{cookie.name}={cookie.value}"]
+    if cookie.expires is not None:
+        attributes.append(
+            f"Expires={cookie.expires.strftime('%a, %d %b %Y %H:%M:%S GMT')}"
+        )
+    if cookie.max_age is not None:
+        attributes.append(f"Max-Age={cookie.max_age}")
+    if cookie.domain:
+        attributes.append(f"Domain={cookie.domain}")
+    if cookie.path:
+        attributes.append(f"Path={cookie.path}")
+    if cookie.secure:
+        attributes.append("Secure")
+    if cookie.http_only:
+        attributes.append("HttpOnly")
+    return "; ".join(attributes).encode()
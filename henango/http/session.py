@@ -0,0 +1,336 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, MutableMapping, Optional, Tuple
+
+import settings
+from henango.http.cookie import Cookie
+from henango.http.response import HttpResponse
+
+if TYPE_CHECKING:
+    import sqlite3
+
+
+def sign(session_key: str) -> str:
+    """
+    セッションIDに、settings.SECRET_KEYで作った署名を付けてCookieの値にする
+    """
+    return f"{session_key}.{signature(session_key)}"
+
+
+def unsign(value: str) -> Optional[str]:
+    """
+    Cookieの値の署名を検証し、セッションIDを取り出す
+
+    Returns:
+        Optional[str]: セッションID。署名が正しくない場合はNone
+    """
+    session_key, _, value_signature = value.rpartition(".")
+    if not session_key or not hmac.compare_digest(
+        value_signature, signature(session_key)
+    ):
+        return None
+    return session_key
+
+
+def signature(session_key: str) -> str:
+    digest = hmac.new(
+        settings.SECRET_KEY.encode(), session_key.encode(), hashlib.sha256
+    ).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+class SessionStore:
+    """
+    セッションのデータを保存する場所
+
+    データはJSONにして保存し、読み出すたびに新しい辞書を作るので、
+    保存した後に辞書を書き換えても保存されたデータは変わらない
+    """
+
+    def load(self, session_key: str) -> Optional[dict]:
+        """
+        セッションのデータを読み出す。存在しないか有効期限が切れている場合はNone
+        """
+        raise NotImplementedError
+
+    def save(self, session_key: str, data: dict, max_age: int) -> None:
+        """
+        セッションのデータを、max_age秒後まで有効なものとして保存する
+        """
+        raise NotImplementedError
+
+    def delete(self, session_key: str) -> None:
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """
+    プロセスのメモリにセッションを保存する
+
+    プロセスごとに別のデータを持つので、WORKER_PROCESSESが1の時に使う。
+    有効期限が切れたセッションは、sweep_interval秒に1回まとめて捨てる
+    """
+
+    def __init__(self, sweep_interval: float):
+        self.sweep_interval = sweep_interval
+        self.lock = threading.Lock()
+        # セッションIDと、(有効期限のUNIX時刻, JSONにしたデータ)
+        self.sessions: Dict[str, Tuple[float, str]] = {}
+        self.swept_at = time.time()
+
+    def load(self, session_key: str) -> Optional[dict]:
+        with self.lock:
+            item = self.sessions.get(session_key)
+        if item is None:
+            return None
+        expires_at, serialized = item
+        if expires_at <= time.time():
+            return None
+        return json.loads(serialized)
+
+    def save(self, session_key: str, data: dict, max_age: int) -> None:
+        serialized = json.dumps(data)
+        now = time.time()
+        with self.lock:
+            self.sessions[session_key] = (now + max_age, serialized)
+            if now - self.swept_at >= self.sweep_interval:
+                self.sweep(now)
+
+    def delete(self, session_key: str) -> None:
+        with self.lock:
+            self.sessions.pop(session_key, None)
+
+    def sweep(self, now: float) -> None:
+        """
+        有効期限が切れたセッションを捨てる。lockを取得した状態で呼ぶ
+        """
+        expired = [
+            session_key
+            for session_key, (expires_at, _) in self.sessions.items()
+            if expires_at <= now
+        ]
+        for session_key in expired:
+            del self.sessions[session_key]
+        self.swept_at = now
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    SQLiteのファイルにセッションを保存する
+
+    WORKER_PROCESSESで複数のプロセスを起動した場合も、全てのプロセスで同じセッションを使える。
+    接続はリクエストのたびに開かず、使い終わったものを取っておいて使い回す。
+    threadモードではコネクションごとにスレッドが作られるので、スレッドごとには開かない
+    """
+
+    # 使い終わった後に取っておく接続の最大数。これを超えた分は閉じる
+    MAX_IDLE_CONNECTIONS = 8
+
+    def __init__(self, path: str, sweep_interval: float):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.swept_at = time.time()
+        self.lock = threading.Lock()
+        # 使い終わった接続と、それを開いたプロセス
+        self.idle_connections: List["sqlite3.Connection"] = []
+        self.pid = os.getpid()
+
+        # ジャーナルモードはファイルに保存されるので、テーブルと合わせて起動時に1度だけ設定する
+        connection = self.open_connection()
+        try:
+            # 読み出しと書き込みが互いを待たずに済むようにする
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_key TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                "expires_at REAL NOT NULL)"
+            )
+        finally:
+            connection.close()
+
+    def open_connection(self) -> "sqlite3.Connection":
+        # SESSION_BACKENDが"sqlite"の場合だけ読み込む
+        import sqlite3
+
+        # 借りたスレッドだけが使うので、別のスレッドで開いた接続も使えるようにする
+        return sqlite3.connect(
+            self.path, timeout=10, isolation_level=None, check_same_thread=False
+        )
+
+    @contextmanager
+    def connection(self) -> Iterator["sqlite3.Connection"]:
+        """
+        接続を1つ借りる。使い終わったら、次に借りるスレッドのために取っておく
+
+        fork後の子プロセスでは、親のプロセスで開いた接続は使わずに開き直す
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.idle_connections = []
+                self.pid = os.getpid()
+            connection = self.idle_connections.pop() if self.idle_connections else None
+        if connection is None:
+            connection = self.open_connection()
+
+        try:
+            yield connection
+        finally:
+            with self.lock:
+                if len(self.idle_connections) < self.MAX_IDLE_CONNECTIONS:
+                    self.idle_connections.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+
+    def load(self, session_key: str) -> Optional[dict]:
+        with self.connection() as connection:
+            row = connection.execute(
+                "SELECT data FROM sessions WHERE session_key = ? AND expires_at > ?",
+                (session_key, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def save(self, session_key: str, data: dict, max_age: int) -> None:
+        now = time.time()
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_key, data, expires_at) "
+                "VALUES (?, ?, ?)",
+                (session_key, json.dumps(data), now + max_age),
+            )
+            if now - self.swept_at >= self.sweep_interval:
+                self.swept_at = now
+                connection.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+
+    def delete(self, session_key: str) -> None:
+        with self.connection() as connection:
+            connection.execute(
+                "DELETE FROM sessions WHERE session_key = ?", (session_key,)
+            )
+
+
+def create_session_store() -> SessionStore:
+    if settings.SESSION_BACKEND == "memory":
+        return MemorySessionStore(settings.SESSION_SWEEP_INTERVAL)
+    if settings.SESSION_BACKEND == "sqlite":
+        return SqliteSessionStore(
+            settings.SESSION_SQLITE_PATH, settings.SESSION_SWEEP_INTERVAL
+        )
+    raise ValueError(f"不明なSESSION_BACKENDです: {settings.SESSION_BACKEND}")
+
+
+# プロセス内の全てのスレッドで共有するセッションの保存先
+session_store = create_session_store()
+
+
+class Session(MutableMapping[str, object]):
+    """
+    リクエストに紐づくセッションのデータ
+
+    データは初めて参照した時に保存先から読み出す。
+    書き換えられた場合だけ、レスポンスを返す前に保存先へ書き戻す
+    """
+
+    def __init__(self, store: SessionStore, session_key: Optional[str]):
+        """
+        Args:
+            store: セッションの保存先
+            session_key: Cookieから取り出したセッションID。無い場合はNone
+        """
+        self.store = store
+        self.session_key = session_key
+        # 保存先から取り除くセッションID
+        self.deleted_key: Optional[str] = None
+        self.modified = False
+        self._data: Optional[dict] = None
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            data = None
+            if self.session_key is not None:
+                data = self.store.load(self.session_key)
+            if data is None:
+                # 存在しないか期限切れのセッションIDは使わず、保存する時に新しく作る
+                data = {}
+                self.session_key = None
+            self._data = data
+        return self._data
+
+    def __getitem__(self, key: str) -> object:
+        return self.data[key]
+
+    def __setitem__(self, key: str, value: object) -> None:
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key: str) -> None:
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def cycle_key(self) -> None:
+        """
+        データはそのままで、セッションIDを新しいものに変える
+
+        ログインの前後で同じセッションIDを使い続けないようにするために呼ぶ
+        """
+        self.data
+        if self.session_key is not None:
+            self.deleted_key = self.session_key
+            self.session_key = None
+        self.modified = True
+
+    def flush(self) -> None:
+        """
+        データを全て消し、セッションを終わらせる
+        """
+        self.cycle_key()
+        self._data = {}
+
+    def save(self, response: HttpResponse) -> None:
+        """
+        書き換えられたデータを保存し、セッションIDのCookieをレスポンスに付ける
+        """
+        if not self.modified:
+            return
+        if self.deleted_key is not None:
+            self.store.delete(self.deleted_key)
+
+        if not self.data:
+            if self.deleted_key is not None:
+                # クライアントが持っているCookieも消させる
+                response.cookies.append(session_cookie("", max_age=0))
+            return
+
+        if self.session_key is None:
+            self.session_key = secrets.token_urlsafe(32)
+        self.store.save(self.session_key, self.data, settings.SESSION_MAX_AGE)
+        response.cookies.append(
+            session_cookie(sign(self.session_key), settings.SESSION_MAX_AGE)
+        )
+        self.modified = False
+
+
+def session_cookie(value: str, max_age: int) -> Cookie:
+    return Cookie(
+        name=settings.SESSION_COOKIE_NAME,
+        value=value,
+        max_age=max_age,
+        path="/",
+        http_only=True,
+    )
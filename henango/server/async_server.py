@@ -0,0 +1,540 @@
+import asyncio
+import time
+
+from functools import partial
+from tempfile import TemporaryFile
+from socket import IPPROTO_TCP, TCP_NODELAY, socket
+from threading import Event
+from typing import BinaryIO, Iterator, Optional, Set
+
+from henango.http.parser import HttpParseError, HttpRequestParser
+from henango.http.request import HttpRequest, RequestBody
+from henango.http.response import FileResponse, HttpResponse
+from henango.server.background_loop import background_loop
+from henango.server.capture import request_capture
+from henango.server.executor import DaemonThreadPoolExecutor
+from henango.server.handler import RequestHandler
+from henango.server.limits import PER_IP_LIMIT, connection_limiter
+from henango.server.metrics import metrics
+from henango.server.timeouts import (
+    BODY_TIMEOUT,
+    HEADER_TIMEOUT,
+    IDLE,
+    SEND_BLOCK_SIZE,
+    WRITE_TIMEOUT,
+    RequestTimeout,
+    TransferClock,
+    write_deadline,
+)
+from mylog import access_log, debug, error, warning
+import settings
+
+
+class AsyncServer:
+    """
+    asyncioのイベントループ上で動くWEBサーバ
+
+    コネクションごとにスレッドを作る代わりに、コルーチンでコネクションを処理する。
+    同期的なview関数は、設定に応じて上限付きのスレッドプールで実行する。
+    """
+
+    # リクエストからレスポンスを作る処理は全コネクションで共有する
+    handler = RequestHandler()
+
+    # 停止が要求されていないかを確認する間隔（秒）
+    POLL_INTERVAL = 0.5
+
+    # 1回の受信で読み出す最大バイト数
+    RECV_SIZE = 65536
+
+    def __init__(self, server_socket: socket, stopping: Optional[Event] = None):
+        """
+        Args:
+            server_socket: bind, listen済みのサーバソケット
+            stopping: サーバの停止が要求されるとセットされるイベント
+        """
+        self.server_socket = server_socket
+        self.stopping = stopping or Event()
+        # 処理中のコネクションのタスク
+        self.connections: Set[asyncio.Task] = set()
+        # そのうち、次のリクエストを待っているだけのタスク
+        self.idle_connections: Set[asyncio.Task] = set()
+        # 同期的なview関数を実行するスレッドプール
+        # スレッドはデーモンスレッドなので、停止の期限を過ぎたら終わるのを待たない
+        self.executor: Optional[DaemonThreadPoolExecutor] = None
+        if settings.ASYNC_RUN_SYNC_VIEWS_IN_EXECUTOR:
+            self.executor = DaemonThreadPoolExecutor(
+                settings.ASYNC_EXECUTOR_MAX_WORKERS, thread_name_prefix="view"
+            )
+
+    def serve(self) -> None:
+        """
+        イベントループを起動し、サーバを動かし続ける
+        """
+        try:
+            asyncio.run(self.serve_forever())
+        finally:
+            # 期限を過ぎても実行中のview関数は待たずに、実行を待っているものは取り消す
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def serve_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        # スレッドで動く同期的なミドルウェアから実行するコルーチンも、このイベントループで動かす
+        background_loop.attach(loop)
+        metrics.register(
+            "henango_asyncio_tasks",
+            "イベントループ上のタスクの数",
+            lambda: len(asyncio.all_tasks(loop)),
+        )
+        server = await asyncio.start_server(
+            self.handle_connection, sock=self.server_socket
+        )
+        async with server:
+            await server.start_serving()
+
+            # シグナルハンドラなど別の場所から停止が要求されるまで待つ
+            while not self.stopping.is_set():
+                await asyncio.sleep(self.POLL_INTERVAL)
+
+            # 新しい接続の受け付けをやめ、次のリクエストを待っているだけのコネクションは
+            # すぐに閉じて、処理中のコネクションが終わるのを待つ
+            server.close()
+            for task in self.idle_connections:
+                task.cancel()
+            if self.connections:
+                await asyncio.wait(
+                    set(self.connections), timeout=settings.GRACEFUL_TIMEOUT
+                )
+
+            # 期限を過ぎても終わらないコネクションは、処理を打ち切って閉じる
+            remaining = list(self.connections)
+            for task in remaining:
+                task.cancel()
+            await asyncio.gather(*remaining, return_exceptions=True)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        1つのコネクションを処理する
+
+        Workerと同様に、クライアントが切断するかkeep-aliveを終了するまで
+        リクエストを受信してはレスポンスを返す処理を繰り返す。
+        """
+        address = writer.get_extra_info("peername")
+        # asyncioはprotoが0のソケットにはTCP_NODELAYを設定しないので、ここで設定する
+        # ヘッダーとボディ、チャンクごとの小さな送信が遅延ACKを待たないようにするため
+        writer.get_extra_info("socket").setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        debug("クライアントからの接続が完了しました remote_address: {}", address)
+        if not connection_limiter.acquire(address[0]):
+            metrics.connection_dropped(PER_IP_LIMIT)
+            writer.write(self.handler.build_rejection_bytes(429))
+            writer.close()
+            return
+        task = asyncio.current_task()
+        self.connections.add(task)
+        metrics.connection_opened()
+        request: Optional[HttpRequest] = None
+        # 処理中のリクエストへのレスポンスを、書き込み始めたか
+        response_started = False
+        try:
+            parser = HttpRequestParser(
+                settings.MAX_HEADER_SIZE, settings.MAX_BODY_SIZE
+            )
+            handled_count = 0
+            while True:
+                request = await self.receive_request(reader, writer, parser)
+                if request is None:
+                    break
+                handled_count += 1
+                response_started = False
+
+                started_at = time.perf_counter()
+                response = await self.get_response(request)
+                metrics.observe(request.route, "parse", parser.parse_duration)
+
+                keep_alive = (
+                    self.handler.should_keep_alive(request, handled_count, response)
+                    and not self.stopping.is_set()
+                )
+
+                sending_at = time.perf_counter()
+                response_started = True
+                body_size = await self.send_response(
+                    writer, response, request, keep_alive, handled_count
+                )
+                # ボディやアップロードされたファイルを一時ファイルに書き出していた場合は、
+                # ここで閉じる
+                request.close()
+                metrics.observe(
+                    request.route, "send", time.perf_counter() - sending_at
+                )
+                metrics.count_request(
+                    request.route, request.method, response.status_code
+                )
+                access_log(
+                    address,
+                    request.method,
+                    request.path,
+                    request.http_version,
+                    response.status_code,
+                    body_size,
+                    time.perf_counter() - started_at,
+                )
+
+                if not keep_alive:
+                    break
+
+        except HttpParseError as e:
+            if isinstance(e, RequestTimeout):
+                # 遅いクライアントが多い時にログで溢れないよう、数えるだけにする
+                debug("{} remote_address: {}", e, address)
+                metrics.connection_dropped(e.reason)
+            else:
+                warning("不正なリクエストを受信しました: {}", e)
+            metrics.count_request("", "", e.status_code)
+            self.write_error_response(writer, e.status_code)
+
+        except ConnectionError:
+            # クライアントが切断した、または送信の期限を過ぎてこちらから切断した
+            debug("クライアントとの通信が切断されました remote_address: {}", address)
+
+        except asyncio.CancelledError:
+            # サーバの停止時に、次のリクエストを待っているだけのコネクションや、
+            # 期限を過ぎても終わらないコネクションの処理を打ち切った。
+            # タスクを取り消されたまま終えると、asyncioが例外のログを出すので正常に終える
+            debug("処理を打ち切りました remote_address: {}", address)
+
+        except Exception:
+            error("リクエストの処理中にエラーが発生しました", exc_info=True)
+            # Workerと同様に、レスポンスをまだ書き込み始めていなければ500を返す
+            if request is not None and not response_started:
+                metrics.count_request(request.route, request.method, 500)
+                self.write_error_response(writer, 500, request)
+
+        finally:
+            debug("クライアントとの通信を終了します remote_address: {}", address)
+            if request is not None:
+                request.close()
+            writer.close()
+            connection_limiter.release(address[0])
+            self.connections.discard(task)
+            metrics.connection_closed()
+
+    def write_error_response(
+        self,
+        writer: asyncio.StreamWriter,
+        status_code: int,
+        request: Optional[HttpRequest] = None,
+    ) -> None:
+        """
+        エラーレスポンスを書き込み、コネクションを閉じることを伝える
+
+        送信はこの後のwriter.closeに任せ、待たない
+
+        Args:
+            request: エラーになったリクエスト。HEADリクエストにはボディを送らない
+        """
+        writer.write(
+            self.handler.build_response_bytes(
+                self.handler.build_error_response(status_code),
+                request or HttpRequest(),
+                keep_alive=False,
+                handled_count=1,
+            )
+        )
+
+    async def receive_request(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        parser: HttpRequestParser,
+    ) -> Optional[HttpRequest]:
+        """
+        ストリームから1リクエスト分を受信してパースする
+
+        パイプライン化されたリクエストの続きはパーサーのバッファに残るので、
+        次回の呼び出しでそのまま使われる。
+        view関数はイベントループの外で動くことがあり、そこからストリームを
+        読むことはできないので、ボディは上限の範囲でview関数を呼ぶ前に受信しきる。
+        settings.UPLOAD_MAX_MEMORY_SIZEを超えるボディは、一時ファイルに書き出しておく
+
+        期限はWorkerと同じく、アイドルタイムアウトの後、最初のバイトを受信してからは
+        ヘッダーの期限、ボディは最低限の受信の速さを求める期限を適用する。
+        期限はasyncio.wait_forでイベントループのタイマーに積まれるので、
+        コネクションごとに定期的に確認するようなコストはかからない
+
+        Returns:
+            Optional[HttpRequest]: ボディまで受信したリクエスト
+            クライアントが切断した場合や、アイドルタイムアウトに達した場合はNone
+
+        Raises:
+            HttpParseError: 受信したデータがHTTPリクエストとして不正な場合
+            RequestTimeout: ヘッダーやボディを期限までに受信しきれなかった場合
+        """
+        # 大きなボディを書き出す一時ファイル。受信しきれなかった場合はここで閉じる
+        spool: Optional[BinaryIO] = None
+        received_body = False
+        try:
+            request = parser.parse_head()
+            if request is None and not parser.has_buffered_data:
+                task = asyncio.current_task()
+                self.idle_connections.add(task)
+                try:
+                    if not await self.receive(
+                        reader, parser, settings.KEEP_ALIVE_TIMEOUT, IDLE
+                    ):
+                        return None
+                except RequestTimeout:
+                    metrics.connection_dropped(IDLE)
+                    return None
+                finally:
+                    self.idle_connections.discard(task)
+                request = parser.parse_head()
+
+            header_deadline = time.monotonic() + settings.HEADER_TIMEOUT
+            while request is None:
+                timeout = header_deadline - time.monotonic()
+                if not await self.receive(reader, parser, timeout, HEADER_TIMEOUT):
+                    return None
+                request = parser.parse_head()
+
+            if request_capture is not None and request_capture.sample():
+                parser.start_recording()
+
+            expect_continue = request.expect == "100-continue"
+            chunks = []
+            body_size = 0
+            body_clock = TransferClock(settings.BODY_TIMEOUT)
+            while True:
+                chunk = parser.parse_body()
+                if chunk is None:
+                    if expect_continue:
+                        # クライアントはボディを送ってよいか確認を待っているので、続きを促す
+                        expect_continue = False
+                        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                    started_at = time.monotonic()
+                    timeout = body_clock.deadline(started_at) - started_at
+                    received = await self.receive(reader, parser, timeout, BODY_TIMEOUT)
+                    if not received:
+                        return None
+                    body_clock.add(time.monotonic() - started_at, received)
+                    continue
+                if not chunk:
+                    break
+                if spool is not None:
+                    spool.write(chunk)
+                    continue
+                chunks.append(chunk)
+                body_size += len(chunk)
+                if body_size > settings.UPLOAD_MAX_MEMORY_SIZE:
+                    spool = TemporaryFile()
+                    spool.writelines(chunks)
+                    chunks = []
+            received_body = True
+        except ConnectionError:
+            return None
+        finally:
+            if spool is not None and not received_body:
+                spool.close()
+
+        raw_request = parser.stop_recording()
+        if raw_request is not None:
+            request_capture.write(raw_request)
+
+        if spool is None:
+            request.stream = RequestBody.from_bytes(b"".join(chunks))
+        else:
+            spool.seek(0)
+            request.stream = RequestBody(partial(spool.read, self.RECV_SIZE), spool)
+        return request
+
+    async def receive(
+        self,
+        reader: asyncio.StreamReader,
+        parser: HttpRequestParser,
+        timeout: float,
+        reason: str,
+    ) -> int:
+        """
+        ストリームからデータを受信してパーサーに渡す
+
+        Args:
+            timeout: 受信を待つ最大秒数
+            reason: 待ちきれなかった場合のタイムアウトの理由
+
+        Returns:
+            int: 受信したバイト数。クライアントが切断した場合は0
+
+        Raises:
+            RequestTimeout: timeout秒以内にデータが届かなかった場合
+        """
+        try:
+            data = await asyncio.wait_for(
+                reader.read(self.RECV_SIZE), max(timeout, 0)
+            )
+        except asyncio.TimeoutError:
+            raise RequestTimeout(reason) from None
+        if data:
+            parser.feed(data)
+        return len(data)
+
+    async def send_response(
+        self,
+        writer: asyncio.StreamWriter,
+        response: HttpResponse,
+        request: HttpRequest,
+        keep_alive: bool,
+        handled_count: int,
+    ) -> int:
+        """
+        レスポンスをクライアントへ送信する
+
+        FileResponseの場合は、loop.sendfileでファイルの中身をカーネルから直接送る。
+        ボディがイテラブルの場合は、作られた分から順に送る。
+
+        Returns:
+            int: 送信したボディのバイト数
+
+        Raises:
+            ConnectionAbortedError: 送信の期限を過ぎて、コネクションを切断した場合
+        """
+        try:
+            writer.write(
+                self.handler.build_response_head(
+                    response, request, keep_alive, handled_count
+                )
+            )
+            if request.method == "HEAD":
+                await self.drain(writer)
+                return 0
+
+            if isinstance(response, FileResponse):
+                await self.drain(writer)
+                await self.send_file(writer, response)
+                return response.content_length
+
+            if not response.is_streaming:
+                await self.write(writer, response.body)
+                return response.content_length
+
+            chunked = self.handler.uses_chunked(response, request)
+            body_size = 0
+            chunks = response.iter_body()
+            while True:
+                chunk = await self.next_chunk(chunks)
+                if chunk is None:
+                    break
+                body_size += len(chunk)
+                # クライアントの受信が遅い場合は、送信が進むまで次のチャンクを作らない
+                if chunked:
+                    size_line, data, end = self.handler.build_chunk(chunk)
+                    writer.write(size_line)
+                    await self.write(writer, data)
+                    writer.write(end)
+                else:
+                    await self.write(writer, chunk)
+            if chunked:
+                # 長さ0のチャンクでボディの終わりを伝える
+                writer.write(b"0\r\n\r\n")
+            await self.drain(writer)
+            return body_size
+        finally:
+            response.close()
+
+    async def write(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        """
+        dataを、送信の期限を設けるSEND_BLOCK_SIZEずつ書き込んでは送信を待つ
+        """
+        view = memoryview(data)
+        for start in range(0, len(view), SEND_BLOCK_SIZE):
+            writer.write(view[start : start + SEND_BLOCK_SIZE])
+            await self.drain(writer)
+
+    async def send_file(
+        self, writer: asyncio.StreamWriter, response: FileResponse
+    ) -> None:
+        """
+        ファイルの中身を、loop.sendfileでSEND_BLOCK_SIZEずつ送信する
+        """
+        loop = asyncio.get_running_loop()
+        offset = response.offset
+        end = response.offset + response.content_length
+        while offset < end:
+            size = min(end - offset, SEND_BLOCK_SIZE)
+            now = time.monotonic()
+            try:
+                await asyncio.wait_for(
+                    loop.sendfile(writer.transport, response.file, offset, size),
+                    write_deadline(now, size) - now,
+                )
+            except asyncio.TimeoutError:
+                self.abort(writer)
+            offset += size
+
+    async def drain(self, writer: asyncio.StreamWriter) -> None:
+        """
+        送信バッファが空くまで待つ。クライアントが受信しないまま期限を過ぎたら切断する
+        """
+        pending = writer.transport.get_write_buffer_size()
+        if not pending:
+            # 書き込んだそばから送信できている場合は、期限のタイマーを作らない
+            await writer.drain()
+            return
+        now = time.monotonic()
+        try:
+            await asyncio.wait_for(writer.drain(), write_deadline(now, pending) - now)
+        except asyncio.TimeoutError:
+            self.abort(writer)
+
+    def abort(self, writer: asyncio.StreamWriter) -> None:
+        """
+        送信バッファに残ったデータを捨てて、コネクションを切断する
+
+        Raises:
+            ConnectionAbortedError: 常に送出し、送信中の処理を終わらせる
+        """
+        metrics.connection_dropped(WRITE_TIMEOUT)
+        writer.transport.abort()
+        raise ConnectionAbortedError("レスポンスの送信がタイムアウトしました")
+
+    async def next_chunk(self, chunks: Iterator[bytes]) -> Optional[bytes]:
+        """
+        ボディの次のチャンクを作る。ボディの終わりではNone
+
+        ボディを作るジェネレーターがイベントループを止めないよう、
+        スレッドプールが有効な場合はそちらで実行する。
+        """
+        if self.executor is None:
+            return next(chunks, None)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, next, chunks, None)
+
+    async def get_response(self, request: HttpRequest) -> HttpResponse:
+        """
+        view関数を呼び出してレスポンスを作る
+
+        同期的なview関数がイベントループを止めないよう、
+        スレッドプールが有効な場合はそちらで実行する。
+        最も外側のミドルウェアが非同期の場合や、async defのview関数は、
+        このイベントループ上で実行する
+        """
+        resolved_at = self.handler.resolve(request)
+        if self.handler.runs_on_loop(request):
+            return await self.handler.respond_async(request, resolved_at)
+
+        if self.executor is None and not self.handler.waits_for_coroutine(request):
+            return self.handler.respond(request, resolved_at)
+
+        # スレッドプールを使わない設定でも、同期的なミドルウェアの中でコルーチンの
+        # 完了を待つ場合は、イベントループを止めないようスレッドで実行する。
+        # コルーチン自体はbackground_loopを通して、このイベントループ上で動く
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor or background_loop.get_executor(),
+            self.handler.respond,
+            request,
+            resolved_at,
+        )
@@ -0,0 +1,92 @@
+import os
+import threading
+from typing import TYPE_CHECKING, Any, Coroutine, Optional, TypeVar
+
+from henango.server.executor import DaemonThreadPoolExecutor
+import settings
+
+if TYPE_CHECKING:
+    import asyncio
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    """
+    専用のスレッドで動かし続けるイベントループ
+
+    スレッドで動くWorkerなど、イベントループの外からコルーチンを実行するために使う。
+    リクエストごとにasyncio.runでイベントループを作り直すと遅いので、
+    プロセス内の全てのスレッドで1つのイベントループを共有する
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid: Optional[int] = None
+        self.loop: Optional["asyncio.AbstractEventLoop"] = None
+        # イベントループから同期的な関数を実行するスレッドプールと、それを作ったプロセス
+        self.executor: Optional[DaemonThreadPoolExecutor] = None
+        self.executor_pid: Optional[int] = None
+
+    def start(self) -> "asyncio.AbstractEventLoop":
+        """
+        イベントループのスレッドを起動する
+
+        fork後の子プロセスには親のスレッドが引き継がれないので、プロセスごとに起動し直す。
+        コルーチンを使わない場合は読み込まずに済むよう、asyncioはここで読み込む
+        """
+        import asyncio
+
+        with self.lock:
+            if self.pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="background-loop", daemon=True
+                )
+                thread.start()
+                self.loop = loop
+                self.pid = os.getpid()
+            return self.loop
+
+    def attach(self, loop: "asyncio.AbstractEventLoop") -> None:
+        """
+        既に動いているイベントループを、このプロセスの共有のイベントループとして使う
+
+        asyncioモードでは、スレッドプールで動く同期的なミドルウェアなどから実行する
+        コルーチンも、別のイベントループを起動せずにサーバのイベントループ上で動かす
+        """
+        with self.lock:
+            self.loop = loop
+            self.pid = os.getpid()
+
+    def get_executor(self) -> DaemonThreadPoolExecutor:
+        """
+        イベントループから同期的な関数を実行する、プロセス内で共有のスレッドプールを返す
+
+        非同期のミドルウェアの内側にある同期的なview関数などを実行する。
+        asyncioのデフォルトのスレッドプールは、プロセスの終了時に実行中の関数が
+        終わるまで待つので、停止の期限を守れるようデーモンスレッドのものを使う。
+        fork後の子プロセスには親のスレッドが引き継がれないので、プロセスごとに作り直す
+        """
+        with self.lock:
+            if self.executor_pid != os.getpid():
+                self.executor = DaemonThreadPoolExecutor(
+                    settings.ASYNC_EXECUTOR_MAX_WORKERS, thread_name_prefix="adapter"
+                )
+                self.executor_pid = os.getpid()
+            return self.executor
+
+    def run(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """
+        コルーチンをイベントループで実行し、終わるまで待って結果を返す
+
+        このイベントループのスレッドの中から呼んではいけない
+        """
+        import asyncio
+
+        loop = self.loop if self.pid == os.getpid() else self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+# プロセス内の全てのスレッドで共有する。初めてコルーチンを実行する時に起動する
+background_loop = BackgroundLoop()
@@ -0,0 +1,173 @@
+import os
+import queue
+import random
+import struct
+import threading
+import time
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+import settings
+
+# キャプチャファイルの先頭に書くマジックナンバー
+FILE_MAGIC = b"HENACAP1"
+
+# 各レコードの先頭: 受信時刻(UNIX時間, 秒)とリクエストのバイト数
+RECORD_HEADER = struct.Struct(">dI")
+
+
+class RequestCapture:
+    """
+    受信したリクエストの生のバイト列を、サンプリングしてファイルに記録する
+
+    記録は専用のスレッドで行うので、リクエストを処理するスレッドはキューに積むだけで済む。
+    キューが一杯の時は記録を諦め、諦めた数を数えておく。
+
+    ファイルは追記のみのバイナリ形式で、FILE_MAGICの後にレコードが並ぶ。
+    各レコードはRECORD_HEADERとリクエストのバイト列からなる。
+    ファイルがmax_bytesを超えると、ログと同じように path.1, path.2, ... とずらして
+    新しいファイルに切り替え、backup_countより古いものは消す。
+
+    複数のプロセスで動かす場合に、書き込みや切り替えが混ざってレコードが壊れないよう、
+    ファイルはプロセスごとに分け、pathの後にプロセスIDを付けたものに記録する。
+    replay.pyに全てのファイルを渡せば、受信した順に並べ直して再送できる
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float,
+        max_bytes: int,
+        backup_count: int,
+        queue_size: int,
+    ):
+        """
+        Args:
+            path: 記録するファイルのパス。実際には "{path}.{プロセスID}" に記録する
+            sample_rate: 記録するリクエストの割合 (0〜1)
+            max_bytes: 1ファイルの最大バイト数
+            backup_count: 残しておく古いファイルの数
+            queue_size: 書き出し待ちにできるリクエストの最大数
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.queue_size = queue_size
+        # 書き出しが追いつかずに記録を諦めたリクエストの数
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.pid: Optional[int] = None
+        # このプロセスが記録するファイルのパス
+        self.process_path = path
+        self.queue: "queue.Queue[Tuple[float, bytes]]" = queue.Queue(queue_size)
+
+    def sample(self) -> bool:
+        """
+        次のリクエストを記録するかを決める
+        """
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def write(self, raw_request: bytes) -> None:
+        """
+        リクエストの生のバイト列を記録する
+        """
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait((time.time(), raw_request))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        """
+        書き出しスレッドを起動する
+
+        fork後の子プロセスには親のスレッドが引き継がれないので、プロセスごとに起動し直す
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self.process_path = f"{self.path}.{os.getpid()}"
+            thread = threading.Thread(
+                target=self.run, name="capture-writer", daemon=True
+            )
+            thread.start()
+            self.pid = os.getpid()
+
+    def run(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        f = self.open()
+        try:
+            while True:
+                received_at, raw_request = self.queue.get()
+                size = RECORD_HEADER.size + len(raw_request)
+                if f.tell() > len(FILE_MAGIC) and f.tell() + size > self.max_bytes:
+                    f.close()
+                    self.rotate()
+                    f = self.open()
+                f.write(RECORD_HEADER.pack(received_at, len(raw_request)))
+                f.write(raw_request)
+                if self.queue.empty():
+                    f.flush()
+        finally:
+            f.close()
+
+    def open(self) -> BinaryIO:
+        f = open(self.process_path, "ab")
+        if f.tell() == 0:
+            f.write(FILE_MAGIC)
+        return f
+
+    def rotate(self) -> None:
+        """
+        path.1, path.2, ... と1つずつずらし、今のファイルをpath.1にする
+        """
+        path = self.process_path
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+
+def read_capture(f: BinaryIO) -> Iterator[Tuple[float, bytes]]:
+    """
+    キャプチャファイルからレコードを順に読み出す
+
+    書き込みの途中で切れている末尾のレコードは無視する
+
+    Returns:
+        Iterator[Tuple[float, bytes]]: (受信時刻, リクエストのバイト列)
+    """
+    if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+        raise ValueError("キャプチャファイルではありません")
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        received_at, length = RECORD_HEADER.unpack(header)
+        raw_request = f.read(length)
+        if len(raw_request) < length:
+            return
+        yield received_at, raw_request
+
+
+# 有効な場合だけ作る。無効な場合、リクエストの処理にかかるコストはNoneとの比較だけ
+request_capture = (
+    RequestCapture(
+        settings.CAPTURE_PATH,
+        settings.CAPTURE_SAMPLE_RATE,
+        settings.CAPTURE_MAX_BYTES,
+        settings.CAPTURE_BACKUP_COUNT,
+        settings.CAPTURE_QUEUE_SIZE,
+    )
+    if settings.CAPTURE_ENABLED
+    else None
+)
@@ -0,0 +1,95 @@
+import queue
+import threading
+from concurrent.futures import Executor, Future
+from typing import Callable, List, Optional, Tuple
+
+# 実行を依頼された関数と、その結果を受け取るFuture
+WorkItem = Tuple[Future, Callable, tuple, dict]
+
+
+class DaemonThreadPoolExecutor(Executor):
+    """
+    デーモンスレッドで関数を実行する、スレッド数に上限のあるスレッドプール
+
+    concurrent.futures.ThreadPoolExecutorのスレッドは、プロセスの終了時に実行中の関数が
+    終わるまで待たれるので、停止の期限を過ぎてもプロセスを終了できない。
+    WorkerPoolと同じくデーモンスレッドを使い、期限を過ぎたら実行中の関数を残したまま
+    終了できるようにする。
+    スレッドは、空いているスレッドが無い時にだけmax_workersまで増やす
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "executor"):
+        """
+        Args:
+            max_workers: 関数を実行するスレッドの最大数
+            thread_name_prefix: スレッドの名前の先頭
+        """
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+        # Noneはスレッドに終了を伝える目印
+        self.queue: "queue.SimpleQueue[Optional[WorkItem]]" = queue.SimpleQueue()
+        self.threads: List[threading.Thread] = []
+        # 次の関数を待っているスレッドの数
+        self.idle = threading.Semaphore(0)
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("停止したスレッドプールでは実行できません")
+            self.queue.put((future, fn, args, kwargs))
+            if not self.idle.acquire(blocking=False) and (
+                len(self.threads) < self.max_workers
+            ):
+                thread = threading.Thread(
+                    target=self.run,
+                    name=f"{self.thread_name_prefix}-{len(self.threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self.threads.append(thread)
+        return future
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            # 実行を待つ間にキャンセルされたものは実行しない
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            # 例外を保持しているFutureから、関数の引数などを参照し続けないようにする
+            del item, future, fn, args, kwargs
+            self.idle.release()
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        """
+        新しい関数を受け付けるのをやめ、スレッドを終了させる
+
+        Args:
+            wait: スレッドが実行中の関数を終えて、終了するまで待つか
+            cancel_futures: まだ実行を始めていない関数をキャンセルするか
+        """
+        with self.lock:
+            self.stopped = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            for _ in self.threads:
+                self.queue.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
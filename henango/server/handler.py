@@ -0,0 +1,282 @@
+import time
+from typing import List, Optional
+
+from henango.http.compression import compress_response
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.http.serializer import ResponseSerializer, reason_phrase
+from henango.server.background_loop import background_loop
+from henango.server.metrics import metrics
+from henango.urls.resolver import UrlResolver
+import settings
+
+
+class RequestHandler:
+    """
+    受信したリクエストからレスポンスを作るまでの、通信方式に依存しない処理を定義
+
+    スレッドで動くWorkerと、asyncioで動くAsyncServerの両方から使われる
+    """
+
+    def __init__(self):
+        self.serializer = ResponseSerializer()
+        # view関数の呼び出しを、settings.MIDDLEWAREのミドルウェアで包んだもの
+        # 起動時に1度だけ組み立てる
+        self.dispatch = self.call_view
+        # 最も外側のミドルウェアが非同期のものか
+        self.is_async = False
+        # 同期的なミドルウェアが非同期のものを包んでいて、コルーチンの完了を待つ所があるか
+        self.has_sync_bridge = False
+        if settings.MIDDLEWARE:
+            # ミドルウェアを使う場合だけ読み込む
+            from henango.server.middleware import (
+                build_middleware_chain,
+                is_async,
+                is_async_middleware,
+                load_middleware,
+            )
+
+            middlewares = [load_middleware(path) for path in settings.MIDDLEWARE]
+            # 最も内側のミドルウェアが非同期の場合は、async defのview関数を
+            # 別のスレッドに渡さず、そのミドルウェアと同じイベントループでawaitする
+            call_view = self.call_view
+            if is_async_middleware(middlewares[-1]):
+                call_view = self.call_view_async
+            self.dispatch = build_middleware_chain(call_view, middlewares)
+            self.is_async = is_async(self.dispatch)
+            self.has_sync_bridge = any(
+                not is_async_middleware(outer) and is_async_middleware(inner)
+                for outer, inner in zip(middlewares, middlewares[1:])
+            )
+
+    def get_response(self, request: HttpRequest) -> HttpResponse:
+        """
+        リクエストに対応するview関数を呼び出し、レスポンスを生成する
+
+        最も外側のミドルウェアが非同期の場合は、共有のイベントループで実行して待つ
+
+        Args:
+            request: パース済みのリクエスト
+
+        Returns:
+            HttpResponse: strのボディをbytesに変換し、必要であれば圧縮したレスポンス
+            イテラブルのボディは、送信する時に少しずつ変換する
+        """
+        resolved_at = self.resolve(request)
+        return self.respond(request, resolved_at)
+
+    def respond(self, request: HttpRequest, resolved_at: float) -> HttpResponse:
+        """
+        URL解決を終えたリクエストから、レスポンスを生成する
+        """
+        if self.is_async:
+            response = background_loop.run(self.dispatch(request))
+        else:
+            response = self.dispatch(request)
+        return self.finish_response(request, response, resolved_at)
+
+    def runs_on_loop(self, request: HttpRequest) -> bool:
+        """
+        URL解決を終えたリクエストのレスポンスを、イベントループ上で生成するか
+
+        最も外側のミドルウェアが非同期の場合と、ミドルウェアを挟まずに
+        async defのview関数を呼ぶ場合は、スレッドを使わずにawaitできる
+        """
+        return self.is_async or (request.view_is_async and not settings.MIDDLEWARE)
+
+    def waits_for_coroutine(self, request: HttpRequest) -> bool:
+        """
+        runs_on_loopがFalseのリクエストを同期的に処理する時に、コルーチンの完了を待つか
+
+        待つ場合は、イベントループのスレッドで処理するとイベントループが止まってしまう
+        """
+        return self.has_sync_bridge or request.view_is_async
+
+    async def respond_async(
+        self, request: HttpRequest, resolved_at: float
+    ) -> HttpResponse:
+        """
+        runs_on_loopがTrueのリクエストのレスポンスを、イベントループ上で生成する
+        """
+        if self.is_async:
+            response = await self.dispatch(request)
+        else:
+            response = await self.call_view_async(request)
+        return self.finish_response(request, response, resolved_at)
+
+    def resolve(self, request: HttpRequest) -> float:
+        """
+        URL解決を行い、見つかったview関数をrequest.viewに設定する
+
+        ミドルウェアより先に行うので、ミドルウェアはrequest.routeを参照できる
+
+        Returns:
+            float: URL解決を終えた時刻（time.perf_counter）
+        """
+        started_at = time.perf_counter()
+        request.view = UrlResolver().resolve(request)
+        resolved_at = time.perf_counter()
+        metrics.observe(request.route, "resolve", resolved_at - started_at)
+        return resolved_at
+
+    def call_view(self, request: HttpRequest) -> HttpResponse:
+        """
+        ミドルウェアの最も内側で、view関数を呼び出す
+
+        async defのview関数は、共有のイベントループで実行して待つ
+        """
+        # view関数をもとにレスポンス(Html含む)を作る
+        if request.view_is_async:
+            response = background_loop.run(request.view(request))
+        else:
+            response = request.view(request)
+
+        # 書き換えられたセッションだけを保存する
+        if request.has_session:
+            request.session.save(response)
+        return response
+
+    async def call_view_async(self, request: HttpRequest) -> HttpResponse:
+        """
+        イベントループ上で、view関数を呼び出す
+
+        async defのview関数はそのままawaitし、
+        同期的なview関数はイベントループを止めないよう、スレッドプールで実行する
+        """
+        if not request.view_is_async:
+            # イベントループの中でしか呼ばれないので、asyncioは読み込み済み
+            import asyncio
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                background_loop.get_executor(), self.call_view, request
+            )
+
+        response = await request.view(request)
+        if request.has_session:
+            request.session.save(response)
+        return response
+
+    def finish_response(
+        self, request: HttpRequest, response: HttpResponse, resolved_at: float
+    ) -> HttpResponse:
+        """
+        ミドルウェアから返されたレスポンスを、送信できる形に整える
+        """
+        # TODO 全部bytesかstrかどっちか扱って良いようにしたい
+        # レスポンスボディを変換
+        if isinstance(response.body, str):
+            response.body = response.body.encode()
+
+        response = compress_response(request, response)
+        metrics.observe(request.route, "view", time.perf_counter() - resolved_at)
+        return response
+
+    def build_error_response(self, status_code: int) -> HttpResponse:
+        """
+        ステータスラインを本文に表示するだけのエラーレスポンスを作る
+        """
+        status_line = f"{status_code} {reason_phrase(status_code)}"
+        return HttpResponse(
+            status_code=status_code,
+            content_type="text/html; charset=UTF-8",
+            body=f"<html><body><h1>{status_line}</h1></body></html>".encode(),
+        )
+
+    def build_rejection_bytes(self, status_code: int) -> bytes:
+        """
+        受け付けずに切断するコネクションへ返す、レスポンス全体のバイト列を生成する
+
+        混み合っていることを伝え、1秒後に再試行させる
+        """
+        response = self.build_error_response(status_code)
+        response.headers = {"Retry-After": "1"}
+        return self.build_response_bytes(
+            response, HttpRequest(), keep_alive=False, handled_count=1
+        )
+
+    def build_response_bytes(
+        self,
+        response: HttpResponse,
+        request: HttpRequest,
+        keep_alive: bool,
+        handled_count: int,
+    ) -> bytes:
+        """
+        クライアントへ送信するレスポンス全体のバイト列を生成する
+
+        エラーレスポンスのような、ボディがbytesの小さなレスポンスに使う。
+        HEADリクエストに対してはボディを含めない
+        """
+        response_head = self.build_response_head(
+            response, request, keep_alive, handled_count
+        )
+        if request.method == "HEAD":
+            return response_head
+        return response_head + response.body
+
+    def build_response_head(
+        self,
+        response: HttpResponse,
+        request: HttpRequest,
+        keep_alive: bool,
+        handled_count: int,
+    ) -> bytes:
+        """
+        レスポンスライン、レスポンスヘッダーと、その後の空行までのバイト列を生成する
+        """
+        return self.serializer.serialize_head(
+            response,
+            request,
+            keep_alive,
+            handled_count,
+            self.uses_chunked(response, request),
+        )
+
+    def should_keep_alive(
+        self,
+        request: HttpRequest,
+        handled_count: int,
+        response: Optional[HttpResponse] = None,
+    ) -> bool:
+        """
+        レスポンスを返した後もコネクションを維持するか判定する
+
+        HTTP/1.1はConnection: closeが指定されない限り維持し、
+        HTTP/1.0はConnection: keep-aliveが指定された場合のみ維持する。
+        1コネクションあたりの最大リクエスト数に達した場合は維持しない。
+        長さの分からないボディをチャンク形式で送れない場合は、
+        切断してボディの終わりを伝えるので維持しない。
+
+        Args:
+            request: 処理中のリクエスト
+            handled_count: このコネクションで処理したリクエストの数
+            response: 返すレスポンス
+        """
+        if handled_count >= settings.KEEP_ALIVE_MAX_REQUESTS:
+            return False
+
+        if (
+            response is not None
+            and response.content_length is None
+            and not self.uses_chunked(response, request)
+        ):
+            return False
+
+        if request.http_version == "HTTP/1.1":
+            return request.connection != "close"
+        return request.connection == "keep-alive"
+
+    def uses_chunked(self, response: HttpResponse, request: HttpRequest) -> bool:
+        """
+        長さの分からないボディを、Transfer-Encoding: chunkedで送るか
+
+        HTTP/1.0のクライアントはチャンク形式を理解しないので使わない
+        """
+        return response.content_length is None and request.http_version == "HTTP/1.1"
+
+    def build_chunk(self, data: bytes) -> List[bytes]:
+        """
+        チャンク形式の1チャンクを、コピーせずに送れるようバッファのリストで作る
+        """
+        return [b"%x\r\n" % len(data), data, b"\r\n"]
@@ -0,0 +1,61 @@
+import threading
+from typing import Dict
+
+import settings
+
+# 接続を拒否した理由
+PER_IP_LIMIT = "per_ip_limit"  # 同じIPアドレスからのコネクションが多すぎる
+POOL_FULL = "pool_full"  # スレッドプールの処理待ちのキューが一杯
+
+
+class ConnectionLimiter:
+    """
+    1つのIPアドレスから同時に張れるコネクションの数を制限する
+
+    少数のクライアントが大量のコネクションを張って、
+    スレッドや処理待ちのキューを使い切ってしまうのを防ぐ
+    """
+
+    def __init__(self, max_per_ip: int):
+        """
+        Args:
+            max_per_ip: 1つのIPアドレスあたりのコネクションの上限。0の場合は制限しない
+        """
+        self.max_per_ip = max_per_ip
+        self.lock = threading.Lock()
+        # IPアドレスと、処理中のコネクションの数
+        self.connections: Dict[str, int] = {}
+
+    def acquire(self, ip: str) -> bool:
+        """
+        コネクションを1つ数える
+
+        Returns:
+            bool: 上限に達しておらず、コネクションを受け付けてよい場合はTrue
+        """
+        if not self.max_per_ip:
+            return True
+        with self.lock:
+            count = self.connections.get(ip, 0)
+            if count >= self.max_per_ip:
+                return False
+            self.connections[ip] = count + 1
+            return True
+
+    def release(self, ip: str) -> None:
+        """
+        acquireで数えたコネクションが閉じられた時に呼ぶ
+        """
+        if not self.max_per_ip:
+            return
+        with self.lock:
+            count = self.connections.get(ip, 0) - 1
+            if count > 0:
+                self.connections[ip] = count
+            else:
+                # 接続してこなくなったIPアドレスを覚え続けないようにする
+                self.connections.pop(ip, None)
+
+
+# プロセス内の全てのコネクションで共有する
+connection_limiter = ConnectionLimiter(settings.MAX_CONNECTIONS_PER_IP)
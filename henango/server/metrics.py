@@ -0,0 +1,228 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import settings
+
+# ラベルにそのまま使うメソッド。メソッドはクライアントが自由に送れるので、
+# それ以外は系列が際限なく増えないよう、まとめて"other"として数える
+KNOWN_METHODS = frozenset(
+    ("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS")
+)
+OTHER_METHOD = "other"
+
+# URL解決まで進まなかったリクエスト（不正なリクエストなど）のルートのラベル
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    """
+    計測値を、上限の決まったバケットごとに数える
+
+    Prometheusの形式で出力する時に、累積した数に直す
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        # 最後の要素は、全てのバケットの上限を超えた値の数
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    return ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in labels.items()
+    )
+
+
+class Metrics:
+    """
+    サーバの内部の状態を計測し、Prometheusのテキスト形式で出力する
+
+    計測値はプロセスごとに持つので、WORKER_PROCESSESが2以上の場合は
+    /metricsに応答したプロセスの値だけが出力される
+    """
+
+    def __init__(self, enabled: bool, buckets: Sequence[float]):
+        """
+        Args:
+            enabled: 計測するか。Falseの場合は全ての計測がすぐに戻る
+            buckets: 処理時間のヒストグラムのバケットの上限（秒）
+        """
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # (ルート, メソッド, ステータスコード)と、リクエストの数
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+        # (ルート, 段階)と、処理時間のヒストグラム
+        self.durations: Dict[Tuple[str, str], Histogram] = {}
+        self.active_connections = 0
+        self.connections = 0
+        # 切断・拒否した理由と、コネクションの数
+        self.dropped: Dict[str, int] = {}
+        # メトリクスの名前と、(種類, 説明, 出力する時に値を返す関数)
+        self.collectors: Dict[str, Tuple[str, str, Callable[[], float]]] = {}
+
+    def connection_opened(self) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.active_connections += 1
+            self.connections += 1
+
+    def connection_closed(self) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.active_connections -= 1
+
+    def connection_dropped(self, reason: str) -> None:
+        """
+        期限切れや上限のために、サーバから切断・拒否したコネクションを数える
+
+        Args:
+            reason: 理由。henango.server.timeouts, henango.server.limitsの定数
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.dropped[reason] = self.dropped.get(reason, 0) + 1
+
+    def observe(self, route: str, phase: str, duration: float) -> None:
+        """
+        ルートのリクエストを処理した段階ごとの時間を記録する
+
+        Args:
+            route: view関数を探すのにマッチしたURLパターン
+            phase: 処理の段階
+                "parse": リクエストライン・ヘッダーのパース（受信を待つ時間は含まない）
+                "resolve": URL解決
+                "view": view関数の実行
+                "send": レスポンスの送信
+            duration: かかった秒数
+        """
+        if not self.enabled:
+            return
+        key = (route, phase)
+        with self.lock:
+            histogram = self.durations.get(key)
+            if histogram is None:
+                histogram = self.durations[key] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def count_request(self, route: str, method: str, status_code: int) -> None:
+        """
+        レスポンスを返したリクエストを数える
+
+        ラベルの組み合わせが際限なく増えないよう、知らないメソッドは"other"に、
+        URL解決まで進まなかったリクエストのルートはUNMATCHED_ROUTEにまとめる
+
+        Args:
+            route: view関数を探すのにマッチしたURLパターン。URL解決の前なら""
+            method: リクエストのメソッド
+            status_code: 返したレスポンスのステータスコード
+        """
+        if not self.enabled:
+            return
+        if method not in KNOWN_METHODS:
+            method = OTHER_METHOD
+        key = (route or UNMATCHED_ROUTE, method, status_code)
+        with self.lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def register(
+        self,
+        name: str,
+        help: str,
+        value: Callable[[], float],
+        type: str = "gauge",
+    ) -> None:
+        """
+        出力する時に値を取得するメトリクスを登録する
+
+        同じ名前で登録し直すと、後から登録したものに置き換わる
+
+        Args:
+            name: メトリクスの名前
+            help: メトリクスの説明
+            value: 値を返す関数
+            type: Prometheusのメトリクスの種類 ("gauge", "counter")
+        """
+        self.collectors[name] = (type, help, value)
+
+    def render(self) -> str:
+        """
+        全てのメトリクスをPrometheusのテキスト形式にする
+        """
+        with self.lock:
+            requests = dict(self.requests)
+            durations = {
+                key: (list(histogram.counts), histogram.sum, histogram.count)
+                for key, histogram in self.durations.items()
+            }
+            active_connections = self.active_connections
+            connections = self.connections
+            dropped = dict(self.dropped)
+
+        lines: List[str] = []
+        lines.append("# HELP henango_requests_total 処理したリクエストの数")
+        lines.append("# TYPE henango_requests_total counter")
+        for (route, method, status_code), count in sorted(requests.items()):
+            labels = format_labels(
+                {"route": route, "method": method, "status": str(status_code)}
+            )
+            lines.append(f"henango_requests_total{{{labels}}} {count}")
+
+        name = "henango_request_phase_seconds"
+        lines.append(f"# HELP {name} リクエストの処理の段階ごとにかかった秒数")
+        lines.append(f"# TYPE {name} histogram")
+        for (route, phase), (counts, total, count) in sorted(durations.items()):
+            labels = format_labels({"route": route, "phase": phase})
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{name}_bucket{{{labels},le="{bucket:g}"}} {cumulative}'
+                )
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{name}_sum{{{labels}}} {total:.9f}")
+            lines.append(f"{name}_count{{{labels}}} {count}")
+
+        lines.append("# HELP henango_connections_active 処理中のコネクションの数")
+        lines.append("# TYPE henango_connections_active gauge")
+        lines.append(f"henango_connections_active {active_connections}")
+        lines.append("# HELP henango_connections_total 受け付けたコネクションの数")
+        lines.append("# TYPE henango_connections_total counter")
+        lines.append(f"henango_connections_total {connections}")
+        name = "henango_connections_dropped_total"
+        lines.append(f"# HELP {name} 期限切れや上限のために切断・拒否したコネクションの数")
+        lines.append(f"# TYPE {name} counter")
+        for reason, count in sorted(dropped.items()):
+            lines.append(f"{name}{{{format_labels({'reason': reason})}}} {count}")
+
+        for name, (type, help, value) in sorted(self.collectors.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            lines.append(f"{name} {value():g}")
+
+        return "\n".join(lines) + "\n"
+
+
+# プロセス内の全てのスレッドで共有するメトリクス
+metrics = Metrics(settings.METRICS_ENABLED, settings.METRICS_LATENCY_BUCKETS)
+
+metrics.register(
+    "henango_threads", "プロセス内のスレッドの数", threading.active_count
+)
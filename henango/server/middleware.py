@@ -0,0 +1,118 @@
+import asyncio
+from importlib import import_module
+from typing import Awaitable, Callable, Iterable, Union
+
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.server.background_loop import background_loop
+
+# リクエストを受け取ってレスポンスを返す関数
+# 同期的なものと、コルーチン関数のものがある
+Handler = Callable[[HttpRequest], Union[HttpResponse, Awaitable[HttpResponse]]]
+
+# ミドルウェア。内側のHandlerを受け取り、それを包んだHandlerを返す
+Middleware = Callable[[Handler], Handler]
+
+
+def is_async(handler: Callable) -> bool:
+    """
+    Handlerがコルーチン関数か判定する。__call__がasync defのインスタンスも含む
+    """
+    return asyncio.iscoroutinefunction(handler) or asyncio.iscoroutinefunction(
+        getattr(handler, "__call__", None)
+    )
+
+
+def is_async_middleware(middleware: Middleware) -> bool:
+    """
+    ミドルウェアが、内側のHandlerをawaitする非同期のものか判定する
+
+    クラスの場合は__call__がasync defか、関数の場合はasync_middleware属性で判定する
+    """
+    if isinstance(middleware, type):
+        return asyncio.iscoroutinefunction(middleware.__call__)
+    return getattr(middleware, "async_middleware", False)
+
+
+def async_middleware(middleware: Middleware) -> Middleware:
+    """
+    関数で書いたミドルウェアを、非同期のものとして扱わせるデコレーター
+
+    ex)
+        @async_middleware
+        def timing(get_response):
+            async def middleware(request):
+                response = await get_response(request)
+                ...
+                return response
+            return middleware
+    """
+    middleware.async_middleware = True
+    return middleware
+
+
+def load_middleware(path: str) -> Middleware:
+    """
+    "モジュール名.属性名"の文字列から、ミドルウェアを読み込む
+    """
+    module_name, _, name = path.rpartition(".")
+    if not module_name:
+        raise ValueError(f"ミドルウェアは'モジュール名.属性名'で指定してください: {path}")
+    return getattr(import_module(module_name), name)
+
+
+def to_async(handler: Handler) -> Handler:
+    """
+    同期的なHandlerを、非同期のミドルウェアからawaitできるようにする
+
+    イベントループを止めないよう、Handlerはスレッドプールで実行する
+    """
+
+    async def async_handler(request: HttpRequest) -> HttpResponse:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            background_loop.get_executor(), handler, request
+        )
+
+    return async_handler
+
+
+def to_sync(handler: Handler) -> Handler:
+    """
+    非同期のHandlerを、同期的なミドルウェアから呼び出せるようにする
+
+    同期的なミドルウェアはイベントループの外のスレッドで動くので、
+    共有のイベントループで実行して結果を待つ
+    """
+
+    def sync_handler(request: HttpRequest) -> HttpResponse:
+        return background_loop.run(handler(request))
+
+    return sync_handler
+
+
+def build_middleware_chain(
+    handler: Handler, middlewares: Iterable[Middleware]
+) -> Handler:
+    """
+    ミドルウェアでHandlerを包み、1つのHandlerにまとめる
+
+    起動時に1度だけ呼び、リクエストごとには作り直さない。
+    ミドルウェアが1つも無い場合はhandlerをそのまま返すので、余計な呼び出しは増えない。
+    同期的なものと非同期のものが隣り合う所だけ、間に変換を挟む
+
+    Args:
+        handler: 最も内側で呼ぶHandler
+        middlewares: ミドルウェア。先にあるものほど外側になる
+
+    Returns:
+        Handler: 最も外側のミドルウェアのHandler
+    """
+    for middleware in reversed(list(middlewares)):
+        if is_async_middleware(middleware):
+            if not is_async(handler):
+                handler = to_async(handler)
+        elif is_async(handler):
+            handler = to_sync(handler)
+        handler = middleware(handler)
+    return handler
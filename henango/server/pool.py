@@ -0,0 +1,102 @@
+import queue
+import time
+
+from socket import socket
+from threading import Event, Lock, Thread
+from typing import List, Optional, Tuple
+
+from henango.server.timeouts import connection_reaper
+from henango.server.worker import Worker
+from mylog import error
+
+
+class WorkerPool:
+    """
+    あらかじめ起動しておいた一定数のスレッドで、コネクションを処理するスレッドプール
+
+    acceptしたソケットは上限付きのキューに積まれ、空いているスレッドが順番に取り出して処理する。
+    キューが一杯の場合は受け付けないので、過負荷時もスレッド数とメモリ使用量が一定に保たれる。
+    keep-aliveで次のリクエストを待っているだけのコネクションもスレッドを占有するので、
+    空いているスレッドが無い時に新しいコネクションが来たら、その1つを切断して譲らせる。
+    """
+
+    def __init__(self, size: int, queue_size: int, stopping: Optional[Event] = None):
+        """
+        Args:
+            size: 処理を行うスレッドの数
+            queue_size: 処理待ちのコネクションを積んでおけるキューの長さ
+            stopping: サーバの停止が要求されるとセットされるイベント（Workerに渡す）
+        """
+        self.size = size
+        self.stopping = stopping or Event()
+        # Noneはスレッドに終了を伝える目印
+        self.queue: "queue.Queue[Optional[Tuple[socket, Tuple[str, int]]]]" = (
+            queue.Queue(maxsize=queue_size)
+        )
+        self.threads: List[Thread] = []
+        # キューからコネクションを取り出そうと待っているスレッドの数
+        self.waiting = 0
+        self.lock = Lock()
+
+    def start(self) -> None:
+        """
+        処理を行うスレッドを起動する
+        """
+        for i in range(self.size):
+            thread = Thread(target=self.run, name=f"pool-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, client_socket: socket, address: Tuple[str, int]) -> bool:
+        """
+        コネクションを処理待ちのキューに積む
+
+        Returns:
+            bool: キューに積めた場合はTrue、キューが一杯で積めなかった場合はFalse
+        """
+        try:
+            self.queue.put_nowait((client_socket, address))
+        except queue.Full:
+            return False
+        if self.waiting == 0:
+            # 全てのスレッドが使われているので、次のリクエストを待っているだけの
+            # コネクションを1つ切断し、そのスレッドにこのコネクションを処理させる
+            connection_reaper.expire_idle(limit=1)
+        return True
+
+    def shutdown(self, timeout: float) -> None:
+        """
+        キューに積まれた分を処理し終えたらスレッドを終了させ、それを待つ
+
+        Args:
+            timeout: 待つ時間の上限（秒）
+        """
+        deadline = time.monotonic() + timeout
+        for _ in self.threads:
+            # キューが一杯の場合は空くまで待つが、timeoutを過ぎたら諦める
+            try:
+                self.queue.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def run(self) -> None:
+        """
+        キューからコネクションを取り出して処理し続ける
+        """
+        while True:
+            with self.lock:
+                self.waiting += 1
+            item = self.queue.get()
+            with self.lock:
+                self.waiting -= 1
+            if item is None:
+                break
+
+            client_socket, address = item
+            try:
+                # スレッドは起動せず、このスレッドの中でWorkerの処理を実行する
+                Worker(client_socket, address, self.stopping).run()
+            except Exception:
+                error("コネクションの処理中にエラーが発生しました", exc_info=True)
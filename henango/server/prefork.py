@@ -0,0 +1,184 @@
+import os
+import signal
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+import mylog
+from mylog import error, log
+import settings
+
+if TYPE_CHECKING:
+    import socket
+
+    from henango.server.server import Server
+
+
+class PreforkSupervisor:
+    """
+    複数のワーカープロセスをforkして監視するスーパーバイザー
+
+    子プロセスはそれぞれServerの動作モードで接続を処理する。
+    GILに縛られずにCPUのコアを使い切るため、プロセスを分けて並列に動かす。
+
+    シグナルによって次のように振る舞う
+        SIGTERM, SIGINT: 全ての子プロセスに処理中の接続を終えさせて停止する
+        SIGHUP: 新しい子プロセスを起動してから、古い子プロセスに処理中の接続を終えさせる
+            子プロセスはスーパーバイザーからforkするので、コードの変更は反映されない
+        SIGUSR2: 同じコマンドで新しいスーパーバイザーを起動してサーバソケットを引き継がせ、
+            新しいスーパーバイザーが子プロセスを起動したら、自身の子プロセスを停止させる
+    """
+
+    # 子プロセスの状態を確認する間隔（秒）
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, server: "Server", processes: int):
+        """
+        Args:
+            server: 子プロセスの中で動かすサーバ
+            processes: 起動する子プロセスの数
+        """
+        self.server = server
+        self.processes = processes
+        self.reuse_port = settings.REUSE_PORT
+        # 子プロセスで共有するサーバソケット。SO_REUSEPORTを使う場合は子プロセスごとに作る
+        self.server_socket: Optional["socket.socket"] = None
+        # 子プロセスのpidと、それが何世代目の子プロセスか
+        self.children: Dict[int, int] = {}
+        self.generation = 0
+        self.stopping = False
+        self.reloading = False
+        self.upgrading = False
+
+    def run(self) -> None:
+        """
+        子プロセスを起動し、停止を要求されるまで監視し続ける
+        """
+        if not self.reuse_port:
+            self.server_socket = self.server.inherit_server_socket()
+            if self.server_socket is None:
+                self.server_socket = self.server.create_server_socket()
+
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        signal.signal(signal.SIGUSR2, self.handle_upgrade)
+
+        for _ in range(self.processes):
+            self.spawn()
+        self.server.notify_ready()
+
+        while not self.stopping:
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            if self.upgrading:
+                self.upgrading = False
+                self.server.spawn_replacement(self.server_socket)
+            self.reap()
+            time.sleep(self.POLL_INTERVAL)
+
+        self.stop()
+
+    def handle_stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def handle_reload(self, signum, frame) -> None:
+        self.reloading = True
+
+    def handle_upgrade(self, signum, frame) -> None:
+        self.upgrading = True
+
+    def spawn(self) -> None:
+        """
+        現在の世代の子プロセスを1つ起動する
+        """
+        pid = os.fork()
+        if pid:
+            self.children[pid] = self.generation
+            log("ワーカープロセスを起動しました pid: {}", pid)
+            return
+
+        # ここから先は子プロセス
+        exit_code = 0
+        try:
+            # 停止のシグナルを受けたら、処理中の接続を終えてから終了する
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.server.shutdown())
+            signal.signal(signal.SIGINT, lambda signum, frame: self.server.shutdown())
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+            server_socket = self.server_socket
+            if server_socket is None:
+                server_socket = self.server.create_server_socket(reuse_port=True)
+            self.server.serve_socket(server_socket)
+        except Exception:
+            error("ワーカープロセスでエラーが発生しました", exc_info=True)
+            exit_code = 1
+        finally:
+            # os._exitではatexitが呼ばれないので、書き出し待ちのログをここで書き出す
+            mylog.close()
+            # スーパーバイザーのfinally節などを実行しないよう、即座に終了する
+            os._exit(exit_code)
+
+    def reap(self) -> None:
+        """
+        終了した子プロセスを回収し、異常終了した現在の世代の子プロセスを起動し直す
+        """
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+
+            generation = self.children.pop(pid, None)
+            if generation is None:
+                continue
+
+            if generation == self.generation and not self.stopping:
+                log(
+                    "ワーカープロセスが終了したため起動し直します pid: {}, status: {}",
+                    pid,
+                    status,
+                )
+                self.spawn()
+
+    def reload(self) -> None:
+        """
+        新しい世代の子プロセスを起動してから、古い世代の子プロセスを停止させる
+
+        古い子プロセスは新しい接続の受け付けをやめ、処理中の接続を終えてから終了する
+        """
+        log("ワーカープロセスを入れ替えます")
+        old_children = list(self.children)
+        self.generation += 1
+        for _ in range(self.processes):
+            self.spawn()
+        for pid in old_children:
+            self.kill(pid, signal.SIGTERM)
+
+    def stop(self) -> None:
+        """
+        全ての子プロセスを停止させ、終了するまで待つ
+
+        settings.GRACEFUL_TIMEOUTを過ぎても終了しない子プロセスは強制終了する
+        """
+        for pid in self.children:
+            self.kill(pid, signal.SIGTERM)
+
+        deadline = time.monotonic() + settings.GRACEFUL_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(self.POLL_INTERVAL / 10)
+
+        for pid in self.children:
+            self.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.children.clear()
+
+        if self.server_socket is not None:
+            self.server_socket.close()
+
+    def kill(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,90 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+from typing import Dict, Optional
+
+import settings
+
+
+class SamplingProfiler:
+    """
+    全てのスレッドのスタックを一定間隔で覗き、よく実行されている箇所を数える
+
+    プロファイラーを組み込んで全ての関数呼び出しを記録するのと違い、
+    計測していない間は何もしないので、本番環境で動いているサーバにも使える。
+    結果は1行に1つのスタックを "スレッド名;ファイル:関数:行;... 回数" の形式で返す。
+    flamegraph.plなどにそのまま渡して、フレームグラフにできる
+    """
+
+    def __init__(self, interval: float, max_duration: float):
+        """
+        Args:
+            interval: スタックを覗く間隔（秒）
+            max_duration: 1回の計測で許す最大秒数
+        """
+        self.interval = interval
+        self.max_duration = max_duration
+        # 同時に2つの計測を行わない
+        self.lock = threading.Lock()
+
+    def profile(self, duration: float) -> Optional[str]:
+        """
+        duration秒の間スタックを覗き続け、その結果を回数の多い順に返す
+
+        Returns:
+            Optional[str]: 計測結果。他の計測が行われている最中の場合はNone
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            samples = self.sample(min(duration, self.max_duration))
+        finally:
+            self.lock.release()
+
+        return "".join(
+            f"{stack} {count}\n" for stack, count in samples.most_common()
+        )
+
+    def sample(self, duration: float) -> "Counter[str]":
+        own_thread_id = threading.get_ident()
+        thread_names: Dict[int, str] = {}
+        samples: "Counter[str]" = Counter()
+
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                # 計測しているこのスレッド自身は数えない
+                if thread_id == own_thread_id:
+                    continue
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                samples[self.fold(thread_name, frame)] += 1
+            time.sleep(self.interval)
+        return samples
+
+    @staticmethod
+    def fold(thread_name: str, frame: Optional[FrameType]) -> str:
+        """
+        スタックを、呼び出し元から順に;で繋いだ1行にする
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+            )
+            frame = frame.f_back
+        names.append(thread_name)
+        return ";".join(reversed(names))
+
+
+# 計測を有効にした場合だけ作る
+profiler = (
+    SamplingProfiler(settings.PROFILER_INTERVAL, settings.PROFILER_MAX_DURATION)
+    if settings.PROFILER_ENABLED
+    else None
+)
@@ -1,6 +1,27 @@
+import os
+import selectors
+import signal
 import socket
-from mylog import log
+import sys
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+from mylog import debug, error, log, warning
+from henango.server.limits import PER_IP_LIMIT, POOL_FULL, connection_limiter
+from henango.server.metrics import metrics
+from henango.server.pool import WorkerPool
+from henango.server.startup import warm_up
+from henango.server.timeouts import connection_reaper
 from henango.server.worker import Worker
+import settings
+
+# 起動し直したプロセスに、引き継ぐサーバソケットのファイルディスクリプタを伝える環境変数
+LISTEN_FD_ENV = "HENANGO_LISTEN_FD"
+
+# 起動し直したプロセスに、古いプロセスのpidを伝える環境変数
+# 新しいプロセスは接続を受け付けられるようになったら、古いプロセスを停止させる
+PARENT_PID_ENV = "HENANGO_PARENT_PID"
 
 
 class Server:
@@ -8,39 +29,308 @@ class Server:
     WEBサーバを表す
     """
 
-    # 拡張子とMIME Typeの対応
-    MIME_TYPES = {
-        "html": "text/html",
-        "css": "text/css",
-        "png": "image/png",
-        "jpg": "image/jpg",
-        "gif": "image/gif",
-    }
+    # 選択できる動作モード
+    MODES = ("thread", "pool", "asyncio")
+
+    # 停止が要求されていないかを確認する間隔（秒）
+    POLL_INTERVAL = 0.5
+
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        processes: Optional[int] = None,
+    ):
+        """
+        Args:
+            mode: 動作モード。指定しない場合はsettings.SERVER_MODEを使う
+                "thread": コネクションごとにWorkerスレッドを起動する
+                "pool": 一定数のスレッドからなるWorkerPoolで処理する
+                "asyncio": イベントループ上のコルーチンでコネクションを処理する
+            host: bindするアドレス。指定しない場合はsettings.HOSTを使う
+            port: bindするポート。指定しない場合はsettings.PORTを使う
+            processes: 起動するワーカープロセスの数。
+                指定しない場合はsettings.WORKER_PROCESSESを使う
+        """
+        self.mode = mode or settings.SERVER_MODE
+        if self.mode not in self.MODES:
+            raise ValueError(f"不明な動作モードです: {self.mode}")
+        self.address = (
+            host or settings.HOST,
+            settings.PORT if port is None else port,
+        )
+        self.processes = settings.WORKER_PROCESSES if processes is None else processes
+
+        # セットされると新しい接続の受け付けをやめ、処理中の接続を終えて停止する
+        self.stopping = threading.Event()
+        # セットされると新しいプロセスを起動し、サーバソケットを引き継がせる
+        self.reloading = threading.Event()
 
     def serve(self):
-        log("サーバ起動します")
+        """
+        サーバを起動し、停止が要求されるまで動かし続ける
+
+        1プロセスで動かす場合は、シグナルによって次のように振る舞う
+            SIGTERM, SIGINT: 新しい接続の受け付けをやめ、処理中の接続を終えて停止する
+            SIGHUP, SIGUSR2: 同じコマンドで新しいプロセスを起動してサーバソケットを
+                引き継がせ、新しいプロセスが受け付けを始めたら停止する
+        """
+        log("サーバ起動します mode: {}, address: {}", self.mode, self.address)
+        try:
+            if settings.WARM_UP:
+                warm_up(self.mode)
+            if self.processes > 1:
+                # 複数プロセスで動かす場合だけ読み込む
+                from henango.server.prefork import PreforkSupervisor
+
+                PreforkSupervisor(self, self.processes).run()
+            else:
+                server_socket = self.inherit_server_socket()
+                if server_socket is None:
+                    server_socket = self.create_server_socket()
+
+                signal.signal(signal.SIGTERM, self.handle_stop)
+                signal.signal(signal.SIGINT, self.handle_stop)
+                signal.signal(signal.SIGHUP, self.handle_reload)
+                signal.signal(signal.SIGUSR2, self.handle_reload)
+                threading.Thread(
+                    target=self.wait_for_reload,
+                    args=(server_socket,),
+                    name="reloader",
+                    daemon=True,
+                ).start()
+
+                self.notify_ready()
+                self.serve_socket(server_socket)
+        finally:
+            log("サーバ停止しました")
+
+    def handle_stop(self, signum, frame) -> None:
+        self.shutdown()
+
+    def handle_reload(self, signum, frame) -> None:
+        # シグナルハンドラの中ではロックを取る処理（ログの出力など）をせず、
+        # 別のスレッドで新しいプロセスを起動する
+        self.reloading.set()
+
+    def wait_for_reload(self, server_socket: Optional[socket.socket]) -> None:
+        """
+        再起動が要求されるたびに、新しいプロセスを起動する
+        """
+        while True:
+            self.reloading.wait()
+            self.reloading.clear()
+            if self.stopping.is_set():
+                return
+            self.spawn_replacement(server_socket)
+
+    def spawn_replacement(self, server_socket: Optional[socket.socket]) -> None:
+        """
+        同じコマンドで新しいプロセスを起動し、サーバソケットを引き継がせる
+
+        サーバソケットは閉じずに新しいプロセスと共有するので、入れ替わる間に届いた接続も
+        listenのキューに溜まり、どちらかのプロセスがacceptする。
+        古いプロセスは、新しいプロセスから停止させられるまで接続を受け付け続ける。
+        新しいプロセスが起動に失敗した場合は、そのまま動き続ける
+
+        Args:
+            server_socket: 引き継がせるサーバソケット
+                Noneの場合、新しいプロセスは自分でソケットを作る（SO_REUSEPORTを使う場合）
+        """
+        env = dict(os.environ)
+        env[PARENT_PID_ENV] = str(os.getpid())
+        # 新しいプロセスでもセッションの署名を検証できるよう、同じ鍵を使わせる
+        env["HENANGO_SECRET_KEY"] = settings.SECRET_KEY
+        pass_fds = ()
+        if server_socket is not None:
+            env[LISTEN_FD_ENV] = str(server_socket.fileno())
+            pass_fds = (server_socket.fileno(),)
+
+        # 再起動する時だけ読み込む
+        import subprocess
+
+        try:
+            process = subprocess.Popen(
+                [sys.executable, *sys.argv], env=env, pass_fds=pass_fds
+            )
+        except OSError:
+            error("新しいプロセスを起動できませんでした", exc_info=True)
+            return
+        log("新しいプロセスを起動しました pid: {}", process.pid)
+
+    def inherit_server_socket(self) -> Optional[socket.socket]:
+        """
+        再起動する前のプロセスから引き継いだサーバソケットがあれば返す
+        """
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd is None:
+            return None
+        server_socket = socket.socket(fileno=int(fd))
+        log("サーバソケットを引き継ぎました address: {}", server_socket.getsockname())
+        return server_socket
+
+    def notify_ready(self) -> None:
+        """
+        接続を受け付ける準備ができたので、再起動する前のプロセスを停止させる
+        """
+        pid = os.environ.pop(PARENT_PID_ENV, None)
+        if pid is None:
+            return
         try:
-            server_socket = socket.socket()
-
-            # 1引数...どのレイヤのものか？ SOL_SOCKETだとソケット自体に関するオプション
-            # 2個目...付け足したいオプション
-            # 3個目...true or false
-            # socket.SO_REUSEADDR: 待ち状態中のポートが存在してもbindする
-            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-            server_socket.bind(("localhost", 8080))
-            server_socket.listen(10)  # 10は同時接続数みたいなもん
-
-            while True:
-                log("クライアントからの接続を待ちます")
-                # 接続完了したsocketインスタンスと、クライアントのaddressがもらえる
-                (client_socket, address) = server_socket.accept()
-                log(
-                    "クライアントからの接続が完了しました remote_address: {}",
+            os.kill(int(pid), signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def create_server_socket(self, reuse_port: bool = False) -> socket.socket:
+        """
+        bind, listen済みのサーバソケットを作る
+
+        Args:
+            reuse_port: SO_REUSEPORTを有効にし、複数のプロセスが同じポートに
+                それぞれソケットをbindできるようにするか
+        """
+        server_socket = socket.socket()
+
+        # 1引数...どのレイヤのものか？ SOL_SOCKETだとソケット自体に関するオプション
+        # 2個目...付け足したいオプション
+        # 3個目...true or false
+        # socket.SO_REUSEADDR: 待ち状態中のポートが存在してもbindする
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # socket.SO_REUSEPORT: 同じポートにbindした複数のソケットに、
+            # カーネルが接続を振り分ける
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        server_socket.bind(self.address)
+        # acceptされるのを待つ接続を、カーネルが溜めておける数
+        server_socket.listen(settings.LISTEN_BACKLOG)
+        return server_socket
+
+    def serve_socket(self, server_socket: socket.socket):
+        """
+        動作モードに応じた方法で、サーバソケットへの接続を処理する
+
+        shutdownが呼ばれるまで処理を続け、呼ばれた後は処理中の接続が終わるのを
+        settings.GRACEFUL_TIMEOUT秒まで待ってから戻る
+        """
+        if self.mode == "asyncio":
+            # asyncioを使う場合だけ読み込む
+            from henango.server.async_server import AsyncServer
+
+            AsyncServer(server_socket, self.stopping).serve()
+        elif self.mode == "pool":
+            self.serve_pool(server_socket)
+        else:
+            self.serve_threads(server_socket)
+
+    def shutdown(self):
+        """
+        サーバの停止を要求する
+
+        シグナルハンドラからも呼べるよう、フラグを立てるだけで待たずに戻る
+        """
+        self.stopping.set()
+
+    def accept_connections(
+        self, server_socket: socket.socket
+    ) -> Iterator[Tuple[socket.socket, Tuple[str, int]]]:
+        """
+        停止が要求されるまで、接続を受け付けて返し続ける
+
+        acceptで止まったままにならないよう、ソケットをノンブロッキングにして
+        一定間隔で停止要求を確認する。停止要求後はサーバソケットを閉じる。
+        """
+        # 複数プロセスで共有している場合、他のプロセスが先にacceptして
+        # 接続が無くなっていることがあるのでノンブロッキングにしておく
+        server_socket.setblocking(False)
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(server_socket, selectors.EVENT_READ)
+                while not self.stopping.is_set():
+                    if not selector.select(self.POLL_INTERVAL):
+                        continue
+                    try:
+                        # 接続完了したsocketインスタンスと、クライアントのaddressがもらえる
+                        (client_socket, address) = server_socket.accept()
+                    except BlockingIOError:
+                        continue
+                    debug(
+                        "クライアントからの接続が完了しました remote_address: {}",
+                        address,
+                    )
+                    if not connection_limiter.acquire(address[0]):
+                        # 解放はコネクションを処理し終えたWorkerが行う
+                        metrics.connection_dropped(PER_IP_LIMIT)
+                        self.reject(client_socket, 429)
+                        continue
+                    yield client_socket, address
+        finally:
+            server_socket.close()
+
+    def serve_threads(self, server_socket: socket.socket):
+        """
+        コネクションごとにWorkerスレッドを起動して処理する
+        """
+        workers = []
+        for client_socket, address in self.accept_connections(server_socket):
+            thread = Worker(client_socket, address, self.stopping)
+            thread.start()
+            # 終了済みのスレッドは覚えておく必要がない
+            workers = [worker for worker in workers if worker.is_alive()]
+            workers.append(thread)
+
+        # 次のリクエストを待っているだけのコネクションはすぐに閉じ、処理中のWorkerが終わるのを待つ
+        connection_reaper.expire_idle()
+        deadline = time.monotonic() + settings.GRACEFUL_TIMEOUT
+        for worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+
+    def serve_pool(self, server_socket: socket.socket):
+        """
+        acceptしたコネクションをWorkerPoolに渡して処理する
+
+        プールの待ちキューが一杯の場合は、503を返してすぐに切断する
+        """
+        pool = WorkerPool(
+            settings.POOL_WORKERS, settings.POOL_QUEUE_SIZE, self.stopping
+        )
+        pool.start()
+        metrics.register(
+            "henango_pool_queued_connections",
+            "スレッドプールで処理を待っているコネクションの数",
+            pool.queue.qsize,
+        )
+
+        for client_socket, address in self.accept_connections(server_socket):
+            if not pool.submit(client_socket, address):
+                warning(
+                    "処理待ちのキューが一杯のため接続を拒否します remote_address: {}",
                     address,
                 )
+                connection_limiter.release(address[0])
+                metrics.connection_dropped(POOL_FULL)
+                self.reject(client_socket, 503)
 
-                thread = Worker(client_socket, address)
-                thread.start()
+        # キューに積まれた接続と処理中の接続が終わるのを待つ
+        connection_reaper.expire_idle()
+        pool.shutdown(settings.GRACEFUL_TIMEOUT)
+
+    def reject(self, client_socket: socket.socket, status_code: int):
+        """
+        エラーレスポンスを返して、コネクションを切断する
+
+        受け付けを担当するスレッドが遅いクライアントに止められないよう、
+        送信はノンブロッキングで1回だけ試みる
+
+        Args:
+            status_code: 503 (処理待ちのキューが一杯), 429 (同じIPアドレスからの接続が多すぎる)
+        """
+        response_bytes = Worker.handler.build_rejection_bytes(status_code)
+        try:
+            client_socket.setblocking(False)
+            client_socket.send(response_bytes)
+        except OSError:
+            pass
         finally:
-            log("サーバ停止しました")
+            client_socket.close()
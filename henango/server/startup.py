@@ -0,0 +1,131 @@
+import marshal
+import os
+import time
+from importlib import import_module
+from importlib.util import MAGIC_NUMBER
+from typing import Callable, List, Optional, Tuple
+
+import settings
+from henango.urls.resolver import load_router
+from henango.views.static import STATIC_ROOT
+from henango.views.static_cache import static_file_cache
+from mylog import log, warning
+
+# スナップショットのファイルの先頭に付ける目印
+# marshalの形式はPythonのバージョンごとに異なるので、バイトコードのマジックナンバーも含める
+SNAPSHOT_HEADER = b"henango-snapshot-1\n" + MAGIC_NUMBER
+
+
+def warm_up(mode: str) -> None:
+    """
+    最初の接続を受け付ける前に、時間のかかる準備をまとめて済ませておく
+
+    URL confの読み込み、URLパターンとテンプレートのコンパイル、静的ファイルの読み込みを行い、
+    それぞれにかかった時間をログに出力する。
+    複数プロセスで動かす場合はfork前のスーパーバイザーで行うので、
+    子プロセスは準備済みの状態を引き継ぎ、起動してすぐにリクエストを処理できる
+
+    Args:
+        mode: サーバの動作モード。そのモードでだけ使うモジュールも読み込んでおく
+    """
+    snapshot = load_snapshot(settings.STARTUP_SNAPSHOT_PATH)
+    timings: List[Tuple[str, float]] = []
+
+    def measure(name: str, function: Callable[[], object]) -> None:
+        started_at = time.perf_counter()
+        function()
+        timings.append((name, time.perf_counter() - started_at))
+
+    measure("urls", lambda: import_module("urls"))
+    measure("routes", load_router)
+    if mode == "asyncio":
+        measure("server", lambda: import_module("henango.server.async_server"))
+    # テンプレートのエンジンはurls（views）から読み込まれている
+    engine = import_module("templates.renderer").engine
+    measure("templates", lambda: engine.preload(snapshot.get("templates")))
+    measure("static", preload_static_files)
+
+    if settings.STARTUP_SNAPSHOT_PATH:
+        measure(
+            "snapshot",
+            lambda: save_snapshot(
+                settings.STARTUP_SNAPSHOT_PATH, {"templates": engine.compiled_code()}
+            ),
+        )
+
+    log(
+        "起動の準備が完了しました {:.1f}ms ({})",
+        sum(duration for _, duration in timings) * 1000,
+        ", ".join(f"{name}: {duration * 1000:.1f}ms" for name, duration in timings),
+    )
+
+
+def preload_static_files() -> int:
+    """
+    静的ファイルのディレクトリを走査し、キャッシュできるファイルを読み込んでおく
+
+    キャッシュの上限に達したら、それ以上は読み込まない
+
+    Returns:
+        int: 読み込んだファイルの数
+    """
+    count = 0
+    for directory, _, filenames in os.walk(STATIC_ROOT):
+        for filename in filenames:
+            if filename.endswith(".gz"):
+                # 圧縮済みのファイルは、大きなファイルを送る時にだけ使う
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            if size > static_file_cache.max_file_size:
+                continue
+            if static_file_cache.size + size > static_file_cache.max_bytes:
+                return count
+            # リクエストで参照されたわけではないので、ヒット・ミスには数えない
+            if static_file_cache.load(path) is not None:
+                count += 1
+    return count
+
+
+def load_snapshot(path: Optional[str]) -> dict:
+    """
+    前回の起動時に書き出したスナップショットを読み込む
+
+    スナップショットにはコンパイル済みのコードが含まれ、読み込むとそのまま実行されるので、
+    サーバを動かすユーザー以外が書き込めない場所に置くこと
+
+    Returns:
+        dict: スナップショット。無い場合や、別のバージョンのPythonで書き出された場合は空
+    """
+    if not path:
+        return {}
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_HEADER)) != SNAPSHOT_HEADER:
+                return {}
+            snapshot = marshal.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, EOFError, ValueError, TypeError):
+        warning("起動時のスナップショットを読み込めませんでした path: {}", path)
+        return {}
+    return snapshot if isinstance(snapshot, dict) else {}
+
+
+def save_snapshot(path: str, snapshot: dict) -> None:
+    """
+    スナップショットを書き出す
+
+    書き出している途中のファイルを他のプロセスが読まないよう、一時ファイルに書いてから置き換える
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER)
+            marshal.dump(snapshot, f)
+        os.replace(temporary_path, path)
+    except OSError:
+        warning("起動時のスナップショットを書き出せませんでした path: {}", path)
@@ -0,0 +1,227 @@
+import heapq
+import itertools
+import os
+import socket
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import settings
+from henango.http.parser import HttpParseError
+
+# タイムアウトの理由
+IDLE = "idle"  # keep-alive中に次のリクエストが来なかった
+HEADER_TIMEOUT = "header_timeout"  # リクエストライン・ヘッダーを受信しきれなかった
+BODY_TIMEOUT = "body_timeout"  # リクエストボディを受信しきれなかった
+WRITE_TIMEOUT = "write_timeout"  # レスポンスを送信しきれなかった
+
+# 送信の期限を設ける単位のバイト数
+# 大きなレスポンスを1度に送ろうとすると、その全体を送る時間を待つことになり、
+# 受信をやめたクライアントに気付くのが遅れるので、この大きさずつ送る
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+class RequestTimeout(HttpParseError):
+    """
+    リクエストを期限までに受信しきれなかった場合に送出する例外
+
+    HttpParseErrorと同じく、408を返してコネクションを閉じる
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(408, f"リクエストの受信がタイムアウトしました: {reason}")
+        self.reason = reason
+
+
+def write_deadline(now: float, size: int) -> float:
+    """
+    sizeバイト(SEND_BLOCK_SIZE以下)の送信を終えるべき時刻
+
+    settings.WRITE_TIMEOUT秒の猶予に加えて、settings.MIN_TRANSFER_RATEの速さで
+    送信するのにかかる時間だけ待つ
+    """
+    return now + settings.WRITE_TIMEOUT + size / settings.MIN_TRANSFER_RATE
+
+
+class TransferClock:
+    """
+    1つのリクエストボディの受信にかけてよい時間を計算する
+
+    timeout秒の猶予に加えて、settings.MIN_TRANSFER_RATEの速さで受信するのに
+    かかる時間だけ待つ。数えるのはクライアントを待っていた時間だけで、
+    view関数がボディを読む合間などに、サーバ側で使った時間は含めない
+    """
+
+    __slots__ = ("timeout", "waited", "transferred")
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        # これまでにクライアントを待っていた秒数と、受信したバイト数
+        self.waited = 0.0
+        self.transferred = 0
+
+    def deadline(self, now: float) -> float:
+        """
+        時刻now（time.monotonic）から始める受信を、終えるべき時刻
+        """
+        budget = self.timeout + self.transferred / settings.MIN_TRANSFER_RATE
+        return now + budget - self.waited
+
+    def add(self, waited: float, size: int) -> None:
+        self.waited += waited
+        self.transferred += size
+
+
+class SocketTimer:
+    """
+    1つのコネクションの期限
+
+    期限はConnectionReaperが監視し、過ぎるとソケットをshutdownして
+    recv, sendで止まっているスレッドを起こす
+    """
+
+    __slots__ = ("sock", "deadline", "reason", "heap_deadline", "expired", "closed")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        # 現在の期限と、その理由。期限が無い場合はNone
+        self.deadline: Optional[float] = None
+        self.reason: Optional[str] = None
+        # ヒープに積まれている、このタイマーの期限
+        self.heap_deadline: Optional[float] = None
+        # 期限切れになった場合は、その理由
+        self.expired: Optional[str] = None
+        self.closed = False
+
+
+class ConnectionReaper:
+    """
+    期限を過ぎたコネクションを、1つのスレッドでまとめて切断する
+
+    期限はヒープに積んで、最も早い期限まで眠るだけなので、コネクションの数が増えても
+    ソケットごとに定期的に確認するようなコストはかからない。
+    期限を延ばす時はヒープに積み直さず、ヒープから取り出した時に延びていれば積み直す。
+    そのため、ヒープの大きさはおおよそコネクションの数に収まる
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # (期限, 積んだ順番, タイマー)
+        self.heap: List[Tuple[float, int, SocketTimer]] = []
+        self.counter = itertools.count()
+        self.pid: Optional[int] = None
+
+    def set(self, timer: SocketTimer, deadline: float, reason: str) -> None:
+        """
+        タイマーの期限をdeadline（time.monotonic）にする
+        """
+        with self.condition:
+            if self.pid != os.getpid():
+                self.start()
+            timer.deadline = deadline
+            timer.reason = reason
+            if timer.heap_deadline is None or deadline < timer.heap_deadline:
+                self.push(timer, deadline)
+                if self.heap[0][2] is timer:
+                    # 最も早い期限が変わったので、眠っているスレッドを起こす
+                    self.condition.notify()
+
+    def clear(self, timer: SocketTimer) -> None:
+        """
+        タイマーの期限を無くす。ヒープに残った分は、取り出した時に捨てる
+        """
+        timer.deadline = None
+
+    def close(self, timer: SocketTimer) -> None:
+        """
+        ソケットを閉じる前に呼ぶ。以降は期限を過ぎても何もしない
+
+        閉じたソケットの番号が別のコネクションに再利用されても、
+        そちらを誤ってshutdownしないよう、ロックを取って確実に止める
+        """
+        with self.condition:
+            timer.deadline = None
+            timer.closed = True
+
+    def expire_idle(self, limit: Optional[int] = None) -> int:
+        """
+        次のリクエストを待っているだけのコネクションを、期限を待たずに切断する
+
+        サーバを停止する時に、keep-aliveのアイドルタイムアウトまで待たずに済むようにする。
+        スレッドプールが埋まった時に、待っているだけのコネクションからスレッドを譲らせる
+
+        Args:
+            limit: 切断するコネクションの最大数。Noneの場合は全て切断する
+
+        Returns:
+            int: 切断したコネクションの数
+        """
+        expired = 0
+        with self.condition:
+            for _, _, timer in self.heap:
+                if limit is not None and expired >= limit:
+                    break
+                idle = timer.reason == IDLE and timer.deadline is not None
+                if idle and not timer.closed:
+                    self.expire(timer)
+                    expired += 1
+        return expired
+
+    def start(self) -> None:
+        """
+        監視スレッドを起動する。conditionを取得した状態で呼ぶ
+
+        fork後の子プロセスには親のスレッドが引き継がれないので、プロセスごとに起動し直す
+        """
+        self.heap = []
+        thread = threading.Thread(target=self.run, name="reaper", daemon=True)
+        thread.start()
+        self.pid = os.getpid()
+
+    def push(self, timer: SocketTimer, deadline: float) -> None:
+        heapq.heappush(self.heap, (deadline, next(self.counter), timer))
+        timer.heap_deadline = deadline
+
+    def run(self) -> None:
+        with self.condition:
+            while True:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                deadline, _, timer = self.heap[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self.condition.wait(deadline - now)
+                    continue
+
+                heapq.heappop(self.heap)
+                if deadline != timer.heap_deadline:
+                    # より早い期限で積み直された後の、古い分
+                    continue
+                timer.heap_deadline = None
+                if timer.deadline is None or timer.closed:
+                    continue
+                if timer.deadline > now:
+                    # 期限が延ばされていたので、延びた期限で積み直す
+                    self.push(timer, timer.deadline)
+                    continue
+                self.expire(timer)
+
+    def expire(self, timer: SocketTimer) -> None:
+        """
+        ソケットをshutdownして、止まっているrecv, sendを終わらせる
+
+        受信のタイムアウトでは受信側だけを閉じ、408を返せるようにしておく
+        """
+        timer.expired = timer.reason
+        timer.deadline = None
+        how = socket.SHUT_RDWR if timer.reason == WRITE_TIMEOUT else socket.SHUT_RD
+        try:
+            timer.sock.shutdown(how)
+        except OSError:
+            pass
+
+
+# プロセス内の全てのWorkerで共有する
+connection_reaper = ConnectionReaper()
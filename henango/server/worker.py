@@ -1,18 +1,29 @@
-import os
-import traceback
-import re
-
-from datetime import datetime, timezone
-from socket import socket
-from typing import Optional, Tuple
-from henango.http.request import HttpRequest
-from henango.http.response import HttpResponse
-from henango.urls.resolver import UrlResolver
-from mylog import log
-from threading import Thread
-from settings import STATIC_ROOT
+import socket
+import time
+
+from threading import Event, Thread
+from typing import List, Optional, Tuple
+from henango.http.parser import HttpParseError, HttpRequestParser
+from henango.http.request import HttpRequest, RequestBody
+from henango.http.response import FileResponse, HttpResponse
+from henango.server.capture import request_capture
+from henango.server.handler import RequestHandler
+from henango.server.limits import connection_limiter
+from henango.server.metrics import metrics
+from henango.server.timeouts import (
+    BODY_TIMEOUT,
+    HEADER_TIMEOUT,
+    IDLE,
+    SEND_BLOCK_SIZE,
+    WRITE_TIMEOUT,
+    RequestTimeout,
+    SocketTimer,
+    TransferClock,
+    connection_reaper,
+    write_deadline,
+)
+from mylog import access_log, debug, error, warning
 import settings
-from urls import url_patterns
 
 
 class Worker(Thread):
@@ -20,248 +31,403 @@ class Worker(Thread):
     WEBサーバが期待される挙動をするスレッドを定義
     """
 
-    # 拡張子とMIME Typeの対応
-    MIME_TYPES = {
-        "html": "text/html; charset=UTF-8",
-        "css": "text/css",
-        "png": "image/png",
-        "jpg": "image/jpg",
-        "gif": "image/gif",
-    }
-
-    # ステータスコードとステータスラインの対応
-    STATUS_LINES = {
-        200: "200 OK",
-        404: "404 Not Found",
-        405: "405 Method Not Allowed",
-        302: "302 Found",
-    }
-
-    def __init__(self, client_socket: socket, address: Tuple[str, int]):
+    # リクエストからレスポンスを作る処理は全スレッドで共有する
+    handler = RequestHandler()
+
+    # 1回のrecvで受信する最大バイト数
+    RECV_SIZE = 65536
+
+    # 続けて送るデータがあることをカーネルに伝えるフラグ（Linuxのみ）
+    MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+    # 複数のバッファをまとめて送るsendmsgが使えるか（Windowsでは使えない）
+    HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+    def __init__(
+        self,
+        client_socket: socket.socket,
+        address: Tuple[str, int],
+        stopping: Optional[Event] = None,
+    ):
         """
         ワーカースレッドを初期化する
 
         Args:
             client_socket: クライアントとの通信を行うソケット
             address: クライアントのアドレス情報 (IP, ポート)
+            stopping: サーバの停止が要求されるとセットされるイベント
+                セットされた後は、処理中のリクエストを最後にコネクションを閉じる
         """
-        super().__init__()
+        # サーバの停止時に、停止の期限を過ぎても終わらないスレッドを待たずに終了できるよう、
+        # デーモンスレッドにする
+        super().__init__(daemon=True)
 
         self.client_socket = client_socket
+        # ヘッダーとボディ、チャンクごとの小さな送信が、Nagleアルゴリズムと
+        # 遅延ACKによって待たされないようにする
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.client_address = address
+        self.stopping = stopping or Event()
+        self.parser = HttpRequestParser(
+            settings.MAX_HEADER_SIZE, settings.MAX_BODY_SIZE
+        )
+        # クライアントがExpect: 100-continueでボディの送信を待っているか
+        self.expect_continue = False
+        # 受信・送信の期限。期限を過ぎるとConnectionReaperがソケットをshutdownする
+        self.timer = SocketTimer(client_socket)
+        # 処理中のリクエストのボディの受信にかけた時間
+        self.body_clock = TransferClock(settings.BODY_TIMEOUT)
+        # 処理中のリクエストへのレスポンスを、一部でも送信し始めたか
+        self.response_started = False
 
     def run(self) -> None:
         """
         ワーカースレッドのメイン処理を実行する
 
-        クライアントからのリクエストを受信し、適切なレスポンスを返す。
+        1つのコネクション上でリクエストを受信してはレスポンスを返す処理を、
+        クライアントが切断するか、keep-aliveを終了するまで繰り返す。
+        パイプライン化されて1回の受信に複数のリクエストが含まれていた場合も、
+        受信した順番通りにレスポンスを返す。
         例外が発生した場合でもクライアントとの接続は確実にクローズする。
         """
+        metrics.connection_opened()
+        request: Optional[HttpRequest] = None
         try:
-            request_bytes = self.client_socket.recv(
-                4096
-            )  # データを4096バイトずつ受け取る
-
-            # クライアントから送られてきたデータをファイルに書き出す
-            with open("server_recv.txt", "wb") as f:
-                f.write(request_bytes)
-
-            # HTTPリクエストをパースする
-            request = self.parse_http_request(request_bytes)
-
-            # URL解決
-            view = UrlResolver().resolve(request)
-
-            # view関数をもとにレスポンス(Html含む)を作る
-            response = view(request)
-
-            # TODO 全部bytesかstrかどっちか扱って良いようにしたい
-            # レスポンスボディを変換
-            if isinstance(response.body, str):
-                response.body = response.body.encode()
-
-            # レスポンスラインを生成
-            response_line = self.build_response_line(response)
+            handled_count = 0
+            while True:
+                # リクエストライン・ヘッダーを受信してパースする
+                # ボディはview関数が読み出す時に受信する
+                request = self.receive_request()
+                if request is None:
+                    # クライアントが切断したか、アイドル状態のままタイムアウトした
+                    break
+                handled_count += 1
+
+                # URL解決を行い、view関数をもとにレスポンスを作る
+                started_at = time.perf_counter()
+                response = self.handler.get_response(request)
+                metrics.observe(request.route, "parse", self.parser.parse_duration)
+
+                # このレスポンスを返した後もコネクションを使い続けるか判定する
+                # サーバが停止しようとしている場合は維持しない
+                keep_alive = (
+                    self.handler.should_keep_alive(request, handled_count, response)
+                    and not self.stopping.is_set()
+                )
 
-            # レスポンスヘッダーを生成
-            response_header = self.build_response_header(response, request)
+                if self.expect_continue and not request.stream.finished:
+                    # クライアントはまだボディを送ってきていないので、
+                    # 受信せずにコネクションを閉じる
+                    keep_alive = False
+                elif keep_alive or self.parser.recording is not None:
+                    # viewが読まなかったボディを読み捨て、次のリクエストの先頭まで進める
+                    # リクエストを記録している場合も、ボディの終わりまで記録するため読み切る
+                    request.stream.drain()
+
+                # リクエストを記録している場合は、ボディまで受信できたものだけ残す
+                raw_request = self.parser.stop_recording()
+                if raw_request is not None and request.stream.finished:
+                    request_capture.write(raw_request)
+
+                sending_at = time.perf_counter()
+                body_size = self.send_response(
+                    response, request, keep_alive, handled_count
+                )
+                # アップロードされたファイルを一時ファイルに書き出していた場合は、ここで閉じる
+                request.close()
+                metrics.observe(
+                    request.route, "send", time.perf_counter() - sending_at
+                )
+                metrics.count_request(
+                    request.route, request.method, response.status_code
+                )
+                access_log(
+                    self.client_address,
+                    request.method,
+                    request.path,
+                    request.http_version,
+                    response.status_code,
+                    body_size,
+                    time.perf_counter() - started_at,
+                )
 
-            # レスポンス全体を生成する
-            response_bytes = (
-                response_line + response_header + "\r\n"
-            ).encode() + response.body
+                if not keep_alive:
+                    break
 
-            # ソケット通信はバイト単位でデータを送受信する必要がある
-            # クライアントへレスポンスを送信する
-            self.client_socket.send(response_bytes)
+        except HttpParseError as e:
+            # リクエストとして解釈できないデータを受信した場合は、エラーを返して切断する
+            if isinstance(e, RequestTimeout):
+                # 遅いクライアントが多い時にログで溢れないよう、数えるだけにする
+                debug("{} remote_address: {}", e, self.client_address)
+                metrics.connection_dropped(e.reason)
+            else:
+                warning("不正なリクエストを受信しました: {}", e)
+            metrics.count_request("", "", e.status_code)
+            self.send_error_response(e.status_code)
+
+        except ConnectionError:
+            # クライアントが切断した、または送信の期限を過ぎてこちらから切断した
+            if self.timer.expired == WRITE_TIMEOUT:
+                metrics.connection_dropped(WRITE_TIMEOUT)
+            debug(
+                "クライアントとの通信が切断されました remote_address: {}",
+                self.client_address,
+            )
 
         except Exception:
-            # リクエストの処理中に例外が発生した場合はコンソールにエラーログを出力し、
-            # 処理を続行する
-            log("リクエストの処理中にエラーが発生しました")
-            traceback.print_exc()  # スタックトレース
+            # リクエストの処理中に例外が発生した場合はコンソールにエラーログを出力する
+            error("リクエストの処理中にエラーが発生しました", exc_info=True)
+            # レスポンスをまだ送り始めていなければ500を返す
+            # 途中まで送ってしまった場合は、切断してクライアントに失敗を伝えるしかない
+            if request is not None and not self.response_started:
+                metrics.count_request(request.route, request.method, 500)
+                self.send_error_response(500, request)
 
         finally:
             # 例外が発生した場合も、発生しなかった場合も、TCP通信のcloseは行う
-            log(
+            debug(
                 "クライアントとの通信を終了します remote_address: {}",
                 self.client_address,
             )
+            if request is not None:
+                request.close()
+            connection_reaper.close(self.timer)
             self.client_socket.close()
-
-    def parse_http_request(self, request: bytes) -> HttpRequest:
+            connection_limiter.release(self.client_address[0])
+            metrics.connection_closed()
+
+    def send_response(
+        self,
+        response: HttpResponse,
+        request: HttpRequest,
+        keep_alive: bool,
+        handled_count: int,
+    ) -> int:
         """
-        HTTPリクエストをパースして各要素を抽出する
+        レスポンスをクライアントへ送信する
 
-        Args:
-            request: クライアントから受信したHTTPリクエスト（バイト列）
+        ヘッダーとボディは連結せず、別々のバッファのままsendmsgで送る。
+        FileResponseの場合は、ファイルの中身をos.sendfileでカーネルから直接送る。
+        ボディがイテラブルの場合は、作られた分から順に送る。
 
         Returns:
-            Tuple[str, str, str, dict, bytes]:
-            (HTTPメソッド, パス, HTTPバージョン, リクエストヘッダー, リクエストボディ)
+            int: 送信したボディのバイト数
         """
+        try:
+            response_head = self.handler.build_response_head(
+                response, request, keep_alive, handled_count
+            )
+            if request.method == "HEAD":
+                self.response_started = True
+                self.send_all(response_head)
+                return 0
+
+            if isinstance(response, FileResponse):
+                self.response_started = True
+                # MSG_MOREでヘッダーだけのパケットを送らず、ファイルの中身とまとめて送らせる
+                self.send_all(response_head, self.MSG_MORE)
+                self.send_file(response)
+                return response.content_length
+
+            if not response.is_streaming:
+                self.send_buffers([response_head, response.body])
+                return response.content_length
+
+            chunked = self.handler.uses_chunked(response, request)
+            body_size = 0
+            # ヘッダーは最初のチャンクと一緒に送る
+            buffers = [response_head]
+            for chunk in response.iter_body():
+                body_size += len(chunk)
+                if chunked:
+                    buffers.extend(self.handler.build_chunk(chunk))
+                else:
+                    buffers.append(chunk)
+                self.send_buffers(buffers)
+                buffers = []
+            if chunked:
+                # 長さ0のチャンクでボディの終わりを伝える
+                buffers.append(b"0\r\n\r\n")
+            if buffers:
+                self.send_buffers(buffers)
+            return body_size
+        finally:
+            response.close()
 
-        request_line, remain = request.split(b"\r\n", maxsplit=1)
-        request_header, request_body = remain.split(b"\r\n\r\n", maxsplit=1)
-
-        # リクエストラインを文字列に変換してパースする
-        method, path, http_version = request_line.decode().split(" ")
-
-        # リクエストヘッダーを辞書にパースする
-        headers = {}
-        for header_row in request_header.decode().split("\r\n"):
-            key, value = re.split(r": *", header_row, maxsplit=1)
-            headers[key] = value
-
-        cookies = {}
-        if "Cookie" in headers:
-            cookie_strings = headers["Cookie"].split("; ")
-            for cookie_string in cookie_strings:
-                name, value = cookie_string.split("=", maxsplit=1)
-                cookies[name] = value
-
-        return HttpRequest(
-            method=method,
-            path=path,
-            http_version=http_version,
-            headers=headers,
-            cookies=cookies,
-            body=request_body,
-        )
-
-    def get_static_file_content(self, path: str) -> bytes:
+    def send_buffers(self, buffers: List[bytes]) -> None:
         """
-        リクエストパスから静的ファイルの絶対パスを取得する
+        複数のバッファを、連結せずにまとめて送信する
 
-        Args:
-            path: リクエストのパス（例: "/index.html", "/css/style.css"）
-
-        Returns:
-            str: 静的ファイルの絶対パス
+        sendmsgは一部しか送信しないことがあるので、全て送り切るまで繰り返す。
+        送信の期限を設けるため、1回に送るのはSEND_BLOCK_SIZEまでにする
         """
+        self.response_started = True
+        if not self.HAS_SENDMSG:
+            for buffer in buffers:
+                self.send_all(buffer)
+            return
+
+        views = [memoryview(buffer) for buffer in buffers if buffer]
+        while views:
+            block = []
+            size = 0
+            for view in views:
+                block.append(view[: SEND_BLOCK_SIZE - size])
+                size += len(block[-1])
+                if size >= SEND_BLOCK_SIZE:
+                    break
+            self.set_write_deadline(size)
+            sent = self.client_socket.sendmsg(block)
+            # 送信し終えたバッファを取り除き、途中まで送ったバッファは残りだけにする
+            while sent:
+                if sent >= len(views[0]):
+                    sent -= len(views[0])
+                    views.pop(0)
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
+        connection_reaper.clear(self.timer)
+
+    def send_all(self, data: bytes, flags: int = 0) -> None:
         """
-        リクエストpathから、staticファイルの内容を取得する
+        dataを全て送信する。send_buffersと同様に、SEND_BLOCK_SIZEずつ期限を設ける
         """
-        default_static_root = os.path.join(os.path.dirname(__file__), "../../static")
-        static_root = getattr(settings, "STATIC_ROOT", default_static_root)
-
-        # pathの先頭の/を削除し、相対パスにしておく
-        relative_path = path.lstrip("/")
-        # デフォルトパス指定
-        if not relative_path:
-            relative_path = "index.html"
-        # ファイルのpathを取得
-        static_file_path = os.path.join(static_root, relative_path)
+        view = memoryview(data)
+        for start in range(0, len(view), SEND_BLOCK_SIZE):
+            block = view[start : start + SEND_BLOCK_SIZE]
+            self.set_write_deadline(len(block))
+            self.client_socket.sendall(block, flags)
+        connection_reaper.clear(self.timer)
+
+    def send_file(self, response: FileResponse) -> None:
+        """
+        ファイルの中身を、os.sendfileでSEND_BLOCK_SIZEずつ送信する
+        """
+        offset = response.offset
+        end = response.offset + response.content_length
+        while offset < end:
+            size = min(end - offset, SEND_BLOCK_SIZE)
+            self.set_write_deadline(size)
+            self.client_socket.sendfile(response.file, offset, size)
+            offset += size
+        connection_reaper.clear(self.timer)
+
+    def set_write_deadline(self, size: int) -> None:
+        """
+        sizeバイトの送信を始める前に、送信の期限を設定する
 
-        with open(static_file_path, "rb") as f:
-            return f.read()
+        クライアントが受信しないまま期限を過ぎると、ソケットがshutdownされて
+        送信中の処理はBrokenPipeErrorになる
+        """
+        connection_reaper.set(
+            self.timer, write_deadline(time.monotonic(), size), WRITE_TIMEOUT
+        )
 
-    def create_response_body(self, path_string: str) -> Tuple[str, str]:
+    def send_error_response(
+        self, status_code: int, request: Optional[HttpRequest] = None
+    ) -> None:
         """
-        静的ファイルからレスポンスボディを生成する
+        エラーレスポンスを送り、コネクションを閉じることを伝える。
+        クライアントが既に切断していれば諦める
 
         Args:
-            static_file_path: 静的ファイルの絶対パス
-
-        Returns:
-            Tuple[str, str]: (HTTPステータスライン, レスポンスボディ)
-            ファイルが見つからない場合は404エラーページを返す
+            request: エラーになったリクエスト。HEADリクエストにはボディを送らない
         """
+        response_bytes = self.handler.build_response_bytes(
+            self.handler.build_error_response(status_code),
+            request or HttpRequest(),
+            keep_alive=False,
+            handled_count=1,
+        )
         try:
-            # ファイルからレスポンスボディを生成　バイナリ、読み取り専用モード
-            with open(path_string, "rb") as f:
-                response_body = f.read()
-            # レスポンスラインを生成
-            response_line = "HTTP/1.1 200 OK\r\n"
+            self.send_all(response_bytes)
         except OSError:
-            log("ファイルが見つかりませんでした")
-            # ファイルが見つからなかった場合は404を返す
-            response_body = b"<html><body><h1>404 Not Found</h1></body></html>"
-            response_line = "HTTP/1.1 404 Not Found\r\n"
-
-        return response_line, response_body.decode()
+            pass
 
-    def build_response_line(self, response: HttpResponse) -> str:
-        """
-        レスポンスラインを構築する
+    def receive_request(self) -> Optional[HttpRequest]:
         """
-        status_line = self.STATUS_LINES[response.status_code]
-        return f"HTTP/1.1 {status_line}"
+        ソケットからリクエストライン・ヘッダーを受信し、リクエストを作る
 
-    def build_response_header(
-        self, response: HttpResponse, request: HttpRequest
-    ) -> str:
+        1回の受信で次のリクエストの一部（パイプライン化されたリクエスト）まで
+        受け取った場合は、その分はパーサーのバッファに残り、次回の呼び出しで使われる。
+
+        Returns:
+            Optional[HttpRequest]: ボディをstreamから読み出せるリクエスト
+            次のリクエストが届く前にクライアントが切断した場合や、
+            keep-aliveのアイドルタイムアウトに達した場合はNone
+
+        Raises:
+            HttpParseError: 受信したデータがHTTPリクエストとして不正な場合
         """
-        HTTPレスポンスヘッダーを生成する
+        # 次のリクエストを待つ間はアイドルタイムアウトを適用し、
+        # 1バイトでも届いたら、そこからヘッダーを受信しきるまでの期限を適用する
+        now = time.monotonic()
+        if self.parser.has_buffered_data:
+            self.set_header_deadline(now)
+        else:
+            connection_reaper.set(
+                self.timer, now + settings.KEEP_ALIVE_TIMEOUT, IDLE
+            )
 
-        Args:
-            path: リクエストパス（MIMEタイプの判定に使用）
-            content_length: レスポンスボディの長さ
+        request = self.parser.parse_head()
+        while request is None:
+            data = self.client_socket.recv(self.RECV_SIZE)
+            if not data:
+                if self.timer.expired == HEADER_TIMEOUT:
+                    raise RequestTimeout(HEADER_TIMEOUT)
+                if self.timer.expired == IDLE:
+                    metrics.connection_dropped(IDLE)
+                return None
+            if self.timer.reason == IDLE:
+                self.set_header_deadline(time.monotonic())
+            self.parser.feed(data)
+            request = self.parser.parse_head()
+        # view関数の処理中はクライアントを待っていないので、期限は設けない
+        connection_reaper.clear(self.timer)
+        self.body_clock = TransferClock(settings.BODY_TIMEOUT)
+        self.response_started = False
+
+        if request_capture is not None and request_capture.sample():
+            self.parser.start_recording()
+
+        request.stream = RequestBody(self.read_body_chunk)
+        self.expect_continue = request.expect == "100-continue"
+        return request
+
+    def read_body_chunk(self) -> bytes:
+        """
+        リクエストボディの続きを、必要であればソケットから受信して返す
 
         Returns:
-            str: 生成されたHTTPレスポンスヘッダー
+            bytes: ボディの一部。ボディの終わりではb""
         """
-        # Content-Typeが指定されていない場合はpathから特定する
-        if response.content_type is None:
-            # pathから拡張子を取得
-            if "." in request.path:
-                ext = request.path.rsplit(".", maxsplit=1)[-1]
-                # 拡張子からMIME Typeを取得
-                # 知らない対応していない拡張子の場合はoctet-streamとする
-                response.content_type = self.MIME_TYPES.get(
-                    ext, "application/octet-stream"
-                )
-            else:
-                response.content_type = "text/html; charset=UTF-8"
-
-        # レスポンスヘッダーを生成
-        response_header = ""
-        response_header += f"Date: {datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')}\r\n"
-        response_header += "Host: HenaServer/0.1\r\n"
-        response_header += f"Content-Length: {len(response.body)}\r\n"
-        response_header += "Connection: Close\r\n"
-        response_header += f"Content-Type: {response.content_type}\r\n"
-
-        # Cookieヘッダーの生成
-        for cookie in response.cookies:
-            cookie_header = f"Set-Cookie: {cookie.name}={cookie.value}"
-            if cookie.expires is not None:
-                cookie_header += (
-                    f"; Expires={cookie.expires.strftime('%a, %d %b %Y %H:%M:%S GMT')}"
-                )
-            if cookie.max_age is not None:
-                cookie_header += f"; Max-Age={cookie.max_age}"
-            if cookie.domain:
-                cookie_header += f"; Domain={cookie.domain}"
-            if cookie.path:
-                cookie_header += f"; Path={cookie.path}"
-            if cookie.secure:
-                cookie_header += "; Secure"
-            if cookie.http_only:
-                cookie_header += "; HttpOnly"
-            response_header += cookie_header + "\r\n"
-
-        for header_name, header_value in response.headers.items():
-            response_header += f"{header_name}: {header_value}\r\n"
-
-        return response_header
+        while True:
+            chunk = self.parser.parse_body()
+            if chunk is not None:
+                return chunk
+
+            if self.expect_continue:
+                # クライアントはボディを送ってよいか確認を待っているので、続きを促す
+                self.expect_continue = False
+                self.send_all(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+            started_at = time.monotonic()
+            connection_reaper.set(
+                self.timer, self.body_clock.deadline(started_at), BODY_TIMEOUT
+            )
+            data = self.client_socket.recv(self.RECV_SIZE)
+            self.body_clock.add(time.monotonic() - started_at, len(data))
+            connection_reaper.clear(self.timer)
+            if not data:
+                if self.timer.expired == BODY_TIMEOUT:
+                    raise RequestTimeout(BODY_TIMEOUT)
+                raise ConnectionError("ボディの受信中にクライアントが切断しました")
+            self.parser.feed(data)
+
+    def set_header_deadline(self, received_at: float) -> None:
+        """
+        リクエストの最初のバイトを受信した時刻から、ヘッダーを受信しきるまでの期限を設定する
+        """
+        connection_reaper.set(
+            self.timer, received_at + settings.HEADER_TIMEOUT, HEADER_TIMEOUT
+        )
@@ -0,0 +1,470 @@
+import ast
+import html
+import os
+import re
+import time
+from threading import Lock
+from types import CodeType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class TemplateSyntaxError(Exception):
+    """
+    テンプレートの構文が不正な場合に送出する例外
+    """
+
+    def __init__(self, message: str, name: str, lineno: int):
+        super().__init__(f"{message} ({name}:{lineno})")
+        self.name = name
+        self.lineno = lineno
+
+
+class Markup(str):
+    """
+    エスケープ済みで、そのまま出力してよい文字列
+    """
+
+
+def escape(value: Any) -> str:
+    """
+    HTMLとして特別な意味を持つ文字をエスケープする。Markupはそのまま返す
+    """
+    if isinstance(value, Markup):
+        return value
+    return html.escape(str(value), quote=True)
+
+
+# {{ value|フィルター名 }} で使えるフィルター
+FILTERS: Dict[str, Callable[[Any], Any]] = {
+    "safe": lambda value: Markup(value),
+    "escape": lambda value: Markup(escape(value)),
+    "upper": lambda value: str(value).upper(),
+    "lower": lambda value: str(value).lower(),
+    "length": len,
+}
+
+# テンプレート中の式から、コンテキストに無い場合に参照できる名前
+GLOBALS: Dict[str, Any] = {
+    "len": len,
+    "range": range,
+    "enumerate": enumerate,
+    "str": str,
+}
+
+# テンプレートを、そのままの文字列と {{ }}, {% %}, {# #} に分割する
+TOKEN_PATTERN = re.compile(r"(\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\})", re.DOTALL)
+# {{ value|filter }} の末尾のフィルターを取り出す
+FILTER_PATTERN = re.compile(r"^(.*[^|])\|\s*(\w+)\s*$", re.DOTALL)
+
+
+class Template:
+    """
+    コンパイル済みのテンプレート
+
+    テンプレートは生成時に一度だけPythonの関数（ジェネレーター）にコンパイルされ、
+    レンダリングのたびにはその関数を呼ぶだけになる
+
+    構文:
+        {{ 式 }}: 式の値を出力する。autoescapeが有効な場合はエスケープする
+        {{ 式|safe }}: フィルターを通した値を出力する
+        {% for x in 式 %} ... {% else %} ... {% endfor %}: 繰り返し
+            elseは繰り返す要素が無かった場合に出力される
+        {% if 式 %} ... {% elif 式 %} ... {% else %} ... {% endif %}: 条件分岐
+        {% include "テンプレート名" %}: 他のテンプレートを埋め込む
+        {# コメント #}: 何も出力しない
+    """
+
+    # streamで一度に出力する文字数の目安
+    STREAM_CHUNK_SIZE = 8192
+
+    def __init__(
+        self,
+        source: str,
+        name: str = "<string>",
+        engine: Optional["TemplateEngine"] = None,
+        autoescape: bool = True,
+        code: Optional[CodeType] = None,
+    ):
+        """
+        Args:
+            source: テンプレートの文字列
+            name: エラーメッセージなどに使うテンプレートの名前
+            engine: {% include %}でテンプレートを探すエンジン
+            autoescape: {{ }}で出力する値をエスケープするか
+            code: sourceをコンパイル済みのコード。指定した場合はコンパイルを省く
+        """
+        self.name = name
+        self.engine = engine
+        self.autoescape = autoescape
+        if code is None:
+            code = compile(TemplateCompiler(source, name).compile(), name, "exec")
+        self.code = code
+        namespace: Dict[str, Any] = {}
+        exec(self.code, namespace)
+        self.render_function = namespace["render"]
+
+    def generate(self, context: dict) -> Iterator[str]:
+        """
+        レンダリングした文字列を、テンプレートの部品ごとに細かく返す
+        """
+        return self.render_function(
+            context,
+            escape if self.autoescape else str,
+            self.include,
+            FILTERS,
+            GLOBALS,
+        )
+
+    def stream(self, context: dict) -> Iterator[str]:
+        """
+        レンダリングした文字列を、STREAM_CHUNK_SIZEほどの塊ごとに返す
+
+        大きなページでも全体を1つの文字列として組み立てずに送信できる
+        """
+        chunks: List[str] = []
+        size = 0
+        for chunk in self.generate(context):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.STREAM_CHUNK_SIZE:
+                yield "".join(chunks)
+                chunks = []
+                size = 0
+        if chunks:
+            yield "".join(chunks)
+
+    def render(self, context: dict) -> str:
+        """
+        レンダリングした文字列全体を返す
+        """
+        return "".join(self.generate(context))
+
+    def include(self, template_name: str, context: dict) -> Iterator[str]:
+        if self.engine is None:
+            raise ValueError(f"エンジンが無いため {template_name} をincludeできません")
+        return self.engine.get_template(template_name).generate(context)
+
+
+class TemplateCompiler:
+    """
+    テンプレートの文字列を、レンダリングを行うPythonのソースコードに変換する
+
+    生成される関数では、コンテキストの値は最初に一度だけローカル変数に取り出され、
+    forで定義した変数もローカル変数になるので、参照のたびに辞書を引かない
+    """
+
+    def __init__(self, source: str, name: str):
+        self.source = source
+        self.name = name
+        self.lines: List[str] = []
+        self.indent = 1
+        # 参照されたコンテキストの名前
+        self.context_names: set = set()
+        # forで定義された変数名と、生成するコード中のローカル変数名の対応（内側ほど後ろ）
+        self.scopes: List[Dict[str, str]] = []
+        # 閉じられていないブロックの種類と、それが始まった行、forの場合はその番号
+        self.blocks: List[Tuple[str, int, int]] = []
+        self.loop_count = 0
+        self.lineno = 1
+
+    def compile(self) -> str:
+        """
+        Returns:
+            str: render(context, escape, include, filters, globals)という
+                ジェネレーター関数を定義するソースコード
+        """
+        for token in TOKEN_PATTERN.split(self.source):
+            if token.startswith("{{") and token.endswith("}}"):
+                self.compile_output(token[2:-2].strip())
+            elif token.startswith("{%") and token.endswith("%}"):
+                self.compile_tag(token[2:-2].strip())
+            elif token.startswith("{#") and token.endswith("#}"):
+                pass
+            elif token:
+                self.emit(f"yield {token!r}")
+            self.lineno += token.count("\n")
+
+        if self.blocks:
+            tag, lineno, _ = self.blocks[-1]
+            raise TemplateSyntaxError(f"{tag}が閉じられていません", self.name, lineno)
+
+        header = [
+            "def render(_context, _escape, _include, _filters, _globals):",
+        ]
+        for name in sorted(self.context_names):
+            header.append(
+                f"    c_{name} = _context[{name!r}] if {name!r} in _context "
+                f"else _globals.get({name!r}, '')"
+            )
+        # yieldが1つも無くてもジェネレーターになるようにする
+        header.append("    if False:")
+        header.append("        yield ''")
+        return "\n".join(header + self.lines) + "\n"
+
+    def emit(self, line: str) -> None:
+        self.lines.append("    " * self.indent + line)
+
+    def compile_output(self, expression: str) -> None:
+        filters = []
+        while True:
+            match = FILTER_PATTERN.match(expression)
+            if match is None or match.group(2) not in FILTERS:
+                break
+            expression, filter_name = match.group(1).strip(), match.group(2)
+            filters.insert(0, filter_name)
+
+        code = self.compile_expression(expression)
+        for filter_name in filters:
+            code = f"_filters[{filter_name!r}]({code})"
+        self.emit(f"yield _escape({code})")
+
+    def compile_tag(self, tag: str) -> None:
+        keyword, _, rest = tag.partition(" ")
+        rest = rest.strip()
+
+        if keyword == "for":
+            target, separator, iterable = rest.partition(" in ")
+            if not separator:
+                self.error(f"不正なforです: {tag}")
+            self.loop_count += 1
+            flag = f"_empty{self.loop_count}"
+            target_code, scope = self.compile_target(target.strip())
+            iterable_code = self.compile_expression(iterable.strip())
+            self.emit(f"{flag} = True")
+            self.emit(f"for {target_code} in {iterable_code}:")
+            self.blocks.append(("for", self.lineno, self.loop_count))
+            self.scopes.append(scope)
+            self.indent += 1
+            self.emit(f"{flag} = False")
+
+        elif keyword == "if":
+            self.emit(f"if {self.compile_expression(rest)}:")
+            self.blocks.append(("if", self.lineno, 0))
+            self.indent += 1
+            self.emit("pass")
+
+        elif keyword == "elif":
+            if self.blocks and self.blocks[-1][0] == "if-else":
+                self.error("elseの後にelifは使えません")
+            self.expect_block("if", tag)
+            self.indent -= 1
+            self.emit(f"elif {self.compile_expression(rest)}:")
+            self.indent += 1
+            self.emit("pass")
+
+        elif keyword == "else":
+            if not self.blocks:
+                self.error("対応するif, forがないelseです")
+            block, lineno, loop_id = self.blocks[-1]
+            self.indent -= 1
+            if block == "for":
+                # forのelseは、要素が1つも無かった場合に出力する
+                self.scopes.pop()
+                self.emit(f"if _empty{loop_id}:")
+                self.blocks[-1] = ("for-else", lineno, loop_id)
+                self.scopes.append({})
+            elif block == "for-else":
+                self.error("forのelseが重複しています")
+            elif block == "if-else":
+                self.error("ifのelseが重複しています")
+            else:
+                self.emit("else:")
+                self.blocks[-1] = ("if-else", lineno, loop_id)
+            self.indent += 1
+            self.emit("pass")
+
+        elif keyword in ("endfor", "endif"):
+            block = self.blocks[-1][0] if self.blocks else None
+            if keyword == "endfor" and block not in ("for", "for-else"):
+                self.error(f"対応するforがない{keyword}です")
+            if keyword == "endif" and block not in ("if", "if-else"):
+                self.error(f"対応するifがない{keyword}です")
+            self.blocks.pop()
+            if keyword == "endfor":
+                self.scopes.pop()
+            self.indent -= 1
+
+        elif keyword == "include":
+            template_code = self.compile_expression(rest)
+            self.emit(f"yield from _include({template_code}, {self.context_code()})")
+
+        else:
+            self.error(f"不明なタグです: {tag}")
+
+    def expect_block(self, block: str, tag: str) -> None:
+        if not self.blocks or self.blocks[-1][0] != block:
+            self.error(f"対応する{block}がないタグです: {tag}")
+
+    def context_code(self) -> str:
+        """
+        includeするテンプレートに渡すコンテキストを作るコード
+
+        forで定義された変数も、コンテキストに加えて渡す
+        """
+        local_names = {}
+        for scope in self.scopes:
+            local_names.update(scope)
+        if not local_names:
+            return "_context"
+        items = ", ".join(f"{name!r}: {code}" for name, code in local_names.items())
+        return f"{{**_context, {items}}}"
+
+    def compile_target(self, target: str) -> Tuple[str, Dict[str, str]]:
+        """
+        forの変数部分を、ローカル変数名に置き換えたコードにする
+        """
+        try:
+            node = ast.parse(f"for {target} in _: pass").body[0].target
+        except SyntaxError:
+            self.error(f"不正なforの変数です: {target}")
+
+        scope = {}
+        for name_node in ast.walk(node):
+            if isinstance(name_node, ast.Name):
+                local_name = f"l{self.loop_count}_{name_node.id}"
+                scope[name_node.id] = local_name
+                name_node.id = local_name
+            elif not isinstance(name_node, (ast.Tuple, ast.List, ast.Store)):
+                self.error(f"不正なforの変数です: {target}")
+        return ast.unparse(node), scope
+
+    def compile_expression(self, expression: str) -> str:
+        """
+        テンプレート中の式を、生成する関数の中で評価できるコードに変換する
+        """
+        try:
+            tree = ast.parse(expression, mode="eval")
+        except SyntaxError:
+            self.error(f"不正な式です: {expression}")
+
+        for node in ast.walk(tree):
+            if isinstance(
+                node,
+                (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp),
+            ):
+                self.error(f"テンプレート中では使えない式です: {expression}")
+            if isinstance(node, ast.Name):
+                node.id = self.resolve_name(node.id)
+        return ast.unparse(tree)
+
+    def resolve_name(self, name: str) -> str:
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        self.context_names.add(name)
+        return f"c_{name}"
+
+    def error(self, message: str) -> None:
+        raise TemplateSyntaxError(message, self.name, self.lineno)
+
+
+class TemplateEngine:
+    """
+    ディレクトリからテンプレートを読み込み、コンパイルしたものをキャッシュする
+
+    キャッシュしたテンプレートは、check_interval秒に1回ファイルの更新日時を確認し、
+    変更されていればコンパイルし直す
+    """
+
+    # autoescapeを有効にするテンプレートの拡張子
+    AUTOESCAPE_EXTENSIONS = (".html", ".htm", ".xml")
+
+    # preloadでまとめてコンパイルするテンプレートの拡張子
+    PRELOAD_EXTENSIONS = AUTOESCAPE_EXTENSIONS + (".txt",)
+
+    def __init__(self, directory: str, check_interval: float = 1.0):
+        """
+        Args:
+            directory: テンプレートを置いたディレクトリ
+            check_interval: テンプレートが変更されていないか確認する間隔（秒）
+        """
+        self.directory = directory
+        self.check_interval = check_interval
+        self.lock = Lock()
+        # テンプレート名と、(コンパイル済みテンプレート, 更新日時, 最後に確認した時刻)
+        self.cache: Dict[str, Tuple[Template, int, float]] = {}
+
+    def get_template(self, template_name: str) -> Template:
+        """
+        コンパイル済みのテンプレートを取得する
+        """
+        cached = self.cache.get(template_name)
+        now = time.monotonic()
+        if cached is not None:
+            template, mtime_ns, checked_at = cached
+            if now - checked_at < self.check_interval:
+                return template
+            path = os.path.join(self.directory, template_name)
+            if os.stat(path).st_mtime_ns == mtime_ns:
+                self.cache[template_name] = (template, mtime_ns, now)
+                return template
+
+        return self.load(template_name)
+
+    def load(
+        self, template_name: str, compiled: Optional[Tuple[int, CodeType]] = None
+    ) -> Template:
+        """
+        テンプレートのファイルを読み込んでコンパイルし、キャッシュする
+
+        Args:
+            compiled: 以前にコンパイルした時の、ファイルの更新日時とコード
+                ファイルが変更されていなければ、コンパイルせずにこれを使う
+        """
+        path = os.path.join(self.directory, template_name)
+        with open(path) as f:
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            if compiled is not None and compiled[0] == mtime_ns:
+                source, code = "", compiled[1]
+            else:
+                source, code = f.read(), None
+
+        template = Template(
+            source,
+            name=template_name,
+            engine=self,
+            autoescape=template_name.endswith(self.AUTOESCAPE_EXTENSIONS),
+            code=code,
+        )
+        with self.lock:
+            self.cache[template_name] = (template, mtime_ns, time.monotonic())
+        return template
+
+    def preload(
+        self, compiled: Optional[Dict[str, Tuple[int, CodeType]]] = None
+    ) -> int:
+        """
+        ディレクトリ内の全てのテンプレートをコンパイルし、キャッシュしておく
+
+        最初のレンダリングでファイルの読み込みとコンパイルを待たずに済むよう、起動時に呼ぶ
+
+        Args:
+            compiled: 以前にコンパイルしたコード。compiled_codeが返したもの
+
+        Returns:
+            int: キャッシュしたテンプレートの数
+        """
+        compiled = compiled or {}
+        count = 0
+        for directory, subdirectories, filenames in os.walk(self.directory):
+            subdirectories[:] = [
+                name for name in subdirectories if name != "__pycache__"
+            ]
+            for filename in filenames:
+                if not filename.endswith(self.PRELOAD_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, filename)
+                template_name = os.path.relpath(path, self.directory)
+                self.load(template_name, compiled.get(template_name))
+                count += 1
+        return count
+
+    def compiled_code(self) -> Dict[str, Tuple[int, CodeType]]:
+        """
+        キャッシュしているテンプレートの、ファイルの更新日時とコンパイル済みのコード
+        """
+        with self.lock:
+            return {
+                template_name: (mtime_ns, template.code)
+                for template_name, (template, mtime_ns, _) in self.cache.items()
+            }
@@ -0,0 +1,51 @@
+import re
+from typing import Any, Dict
+
+
+class Converter:
+    """
+    URLパターン中の <型:名前> の型を表す
+
+    regexはパスの1セグメント（pathの場合は残り全て）にマッチする正規表現
+    to_pythonが値を変換できずにValueErrorを送出した場合は、マッチしなかったことになる
+    """
+
+    regex = "[^/]+"
+
+    def __init__(self):
+        self.pattern = re.compile(self.regex)
+
+    def to_python(self, value: str) -> Any:
+        return value
+
+
+class StringConverter(Converter):
+    regex = "[^/]+"
+
+
+class IntConverter(Converter):
+    regex = "[0-9]+"
+
+    def to_python(self, value: str) -> int:
+        return int(value)
+
+
+class SlugConverter(Converter):
+    regex = "[-a-zA-Z0-9_]+"
+
+
+class PathConverter(Converter):
+    """
+    /を含む残りのパス全体にマッチする。パターンの最後にだけ使える
+    """
+
+    regex = ".+"
+
+
+# 型名と変換器の対応。型を省略した場合はstrになる
+CONVERTERS: Dict[str, Converter] = {
+    "str": StringConverter(),
+    "int": IntConverter(),
+    "slug": SlugConverter(),
+    "path": PathConverter(),
+}
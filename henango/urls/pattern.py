@@ -1,25 +1,138 @@
+import inspect
 import re
 from re import Match
-from typing import Callable, Optional
+from typing import (
+    TYPE_CHECKING,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from henango.http.request import HttpRequest
 from henango.http.response import HttpResponse
+from henango.urls.converters import CONVERTERS, Converter, PathConverter
+
+if TYPE_CHECKING:
+    from henango.views.cache import CachePolicy
+
+# パターン中の <名前> または <型:名前>
+PARAMETER_PATTERN = re.compile(r"^<(?:(\w+):)?(\w+)>$")
+
+# パスの1セグメント。固定の文字列か、(変換器, パラメータ名)
+Segment = Union[str, Tuple[Converter, str]]
+
+# view関数。async defで定義したコルーチン関数も使える
+View = Callable[[HttpRequest], Union[HttpResponse, Awaitable[HttpResponse]]]
+
+
+def is_async_view(view: View) -> bool:
+    """
+    view関数がasync defで定義されたものか判定する。__call__がasync defのインスタンスも含む
+    """
+    return inspect.iscoroutinefunction(view) or inspect.iscoroutinefunction(
+        getattr(view, "__call__", None)
+    )
 
 
 class UrlPattern:
     pattern: str
-    view: Callable[[HttpRequest], HttpResponse]  # 関数を引数とするイメージ
+    view: View  # 関数を引数とするイメージ
+    is_async: bool
+    methods: Optional[frozenset]
+    segments: List[Segment]
+    regex: re.Pattern
 
-    def __init__(self, pattern: str, view: Callable[[HttpRequest], HttpResponse]):
+    def __init__(
+        self,
+        pattern: str,
+        view: View,
+        methods: Optional[Iterable[str]] = None,
+        cache: Optional["CachePolicy"] = None,
+    ):
+        """
+        Args:
+            pattern: URLパターン ex) "/now", "/user/<int:user_id>/profile"
+            view: パターンにマッチした時に呼ぶview関数。async defで定義したものも使える
+            methods: 受け付けるHTTPメソッド。省略した場合は全てのメソッドを受け付ける
+            cache: view関数のレスポンスをキャッシュする場合は、そのポリシー
+        """
         self.pattern = pattern
-        self.view = view
+        # リクエストごとに調べずに済むよう、async defのview関数かはここで一度だけ判定する
+        self.is_async = is_async_view(view)
+        self.view = view if cache is None else cache.wrap(view)
+        self.methods = None
+        if methods is not None:
+            self.methods = frozenset(method.upper() for method in methods)
+            # GETを受け付ける場合はHEADも受け付ける
+            if "GET" in self.methods:
+                self.methods |= {"HEAD"}
+
+        # パターンの解析と正規表現のコンパイルは、ここで一度だけ行う
+        self.segments = self.parse_segments(pattern)
+        self.regex = re.compile(self.build_regex(self.segments))
+
+    @property
+    def is_static(self) -> bool:
+        """
+        パラメータを含まない固定のパスか
+        """
+        return all(isinstance(segment, str) for segment in self.segments)
+
+    def allows(self, method: str) -> bool:
+        return self.methods is None or method in self.methods
 
     def match(self, path: str) -> Optional[Match]:
         """
         pathがURLパターンにマッチするか判定する
         マッチした場合はMatchオブジェクトを返し、マッチしなかった場合はNoneを返す
         """
-        # URLパターンを正規表現パターンに変換する
-        # ex) '/user/<user_id>/profile' => '/user/(?P<user_id>[^/]+)/profile'
-        pattern = re.sub(r"<(.+?)>", r"(?P<\1>[^/]+)", self.pattern)
-        return re.match(pattern, path)
+        return self.regex.fullmatch(path)
+
+    @staticmethod
+    def parse_segments(pattern: str) -> List[Segment]:
+        """
+        URLパターンを/で区切り、それぞれを固定の文字列かパラメータに変換する
+
+        ex) '/user/<int:user_id>/profile' => ['user', (IntConverter, 'user_id'), 'profile']
+        """
+        if not pattern.startswith("/"):
+            raise ValueError(f"URLパターンは/から始めてください: {pattern}")
+
+        raw_segments = pattern[1:].split("/")
+        segments: List[Segment] = []
+        for i, raw_segment in enumerate(raw_segments):
+            match = PARAMETER_PATTERN.match(raw_segment)
+            if match is None:
+                if "<" in raw_segment or ">" in raw_segment:
+                    raise ValueError(f"不正なURLパターンです: {pattern}")
+                segments.append(raw_segment)
+                continue
+
+            converter_name, name = match.groups()
+            converter = CONVERTERS.get(converter_name or "str")
+            if converter is None:
+                raise ValueError(f"不明な型です: {converter_name} ({pattern})")
+            if isinstance(converter, PathConverter) and i != len(raw_segments) - 1:
+                raise ValueError(f"pathはパターンの最後にだけ使えます: {pattern}")
+            segments.append((converter, name))
+        return segments
+
+    @staticmethod
+    def build_regex(segments: List[Segment]) -> str:
+        """
+        URLパターンを正規表現パターンに変換する
+
+        ex) '/user/<user_id>/profile' => '/user/(?P<user_id>[^/]+)/profile'
+        """
+        parts = []
+        for segment in segments:
+            if isinstance(segment, str):
+                parts.append(re.escape(segment))
+            else:
+                converter, name = segment
+                parts.append(f"(?P<{name}>{converter.regex})")
+        return "/" + "/".join(parts)
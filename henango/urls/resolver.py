@@ -1,18 +1,94 @@
-from typing import Callable, Optional
+from typing import Callable, List, Optional, Set
 
+import settings
 from henango.http.request import HttpRequest
 from henango.http.response import HttpResponse
+from henango.urls.pattern import UrlPattern, View
+from henango.urls.router import Router
 from henango.views.static import static
-from urls import url_patterns
+
+# どのURLパターンにもマッチせず、静的ファイルを探したリクエストのルート名
+STATIC_ROUTE = "static"
+
+# パスにはマッチしたが、メソッドを受け付けるものが無かったリクエストのルート名
+METHOD_NOT_ALLOWED_ROUTE = "method_not_allowed"
+
+
+def builtin_url_patterns() -> List[UrlPattern]:
+    """
+    設定で有効にした、サーバに組み込みのURLパターン
+    """
+    patterns = []
+    if settings.METRICS_ENABLED and settings.METRICS_PATH:
+        from henango.views.metrics import metrics_view, profile
+
+        patterns.append(
+            UrlPattern(settings.METRICS_PATH, metrics_view, methods=["GET"])
+        )
+        if settings.PROFILER_ENABLED:
+            patterns.append(
+                UrlPattern(f"{settings.METRICS_PATH}/profile", profile, methods=["GET"])
+            )
+    return patterns
+
+
+# URLパターンは起動時に一度だけコンパイルし、全てのリクエストで共有する
+# URL confを読み込むとview関数やテンプレートも読み込まれるので、load_routerを呼ぶまで遅らせる
+router: Optional[Router] = None
+
+
+def load_router() -> Router:
+    """
+    URL conf（urls.py）を読み込み、URLパターンをコンパイルする
+
+    起動時の準備で呼ばれる。呼ばれていなければ、最初のリクエストで呼ばれる
+    """
+    global router
+    if router is None:
+        from urls import url_patterns
+
+        router = Router(builtin_url_patterns() + url_patterns)
+    return router
 
 
 class UrlResolver:
-    def resolve(self, request: HttpRequest) -> Callable[[HttpRequest], HttpResponse]:
-        for url_pattern in url_patterns:
-            match = url_pattern.match(request.path)
-            if match:
-                request.params.update(match.groupdict())
-                return url_pattern.view
-
-        # 見つからんかった時は静的ファイル走査に任せる
-        return static
+    def resolve(self, request: HttpRequest) -> View:
+        """
+        リクエストのメソッドとパスから、レスポンスを作るview関数を探す
+
+        マッチしたURLパターンを、メトリクスのルート名としてrequest.routeに設定する。
+        view関数がasync defで定義されたものかは、request.view_is_asyncに設定する
+        """
+        route_match = (router or load_router()).resolve(request.method, request.path)
+        if route_match is None:
+            # 見つからんかった時は静的ファイル走査に任せる
+            request.route = STATIC_ROUTE
+            return static
+
+        if route_match.url_pattern is None:
+            # パスにはマッチしたが、メソッドを受け付けるものが無かった
+            request.route = METHOD_NOT_ALLOWED_ROUTE
+            return method_not_allowed(route_match.allowed_methods)
+
+        request.route = route_match.url_pattern.pattern
+        request.params = route_match.params
+        request.view_is_async = route_match.url_pattern.is_async
+        return route_match.url_pattern.view
+
+
+def method_not_allowed(
+    allowed_methods: Set[str],
+) -> Callable[[HttpRequest], HttpResponse]:
+    """
+    405 Method Not Allowedを返すview関数を作る
+    """
+
+    def view(request: HttpRequest) -> HttpResponse:
+        body = b"<html><body><h1>405 Method Not Allowed</h1></body></html>"
+        return HttpResponse(
+            status_code=405,
+            headers={"Allow": ", ".join(sorted(allowed_methods))},
+            body=body,
+        )
+
+    return view
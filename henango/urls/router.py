@@ -0,0 +1,154 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+from henango.urls.converters import Converter, PathConverter
+from henango.urls.pattern import UrlPattern
+
+
+class RouteNode:
+    """
+    パラメータを含むURLパターンを、パスのセグメントごとに分けて保持する木構造の節
+    """
+
+    def __init__(self):
+        # 固定の文字列のセグメントと、その次の節
+        self.children: Dict[str, "RouteNode"] = {}
+        # パラメータのセグメントと、その次の節（登録順に試す）
+        self.parameters: List[Tuple[Converter, str, "RouteNode"]] = []
+        # この節でパスが終わる場合にマッチするURLパターン
+        self.url_patterns: List[UrlPattern] = []
+
+    def child(self, converter: Converter, name: str) -> "RouteNode":
+        """
+        同じ型・名前のパラメータの節があれば再利用し、無ければ作る
+        """
+        for parameter_converter, parameter_name, node in self.parameters:
+            if parameter_converter is converter and parameter_name == name:
+                return node
+        node = RouteNode()
+        self.parameters.append((converter, name, node))
+        return node
+
+
+class RouteMatch:
+    """
+    パスに対するURL解決の結果
+    """
+
+    url_pattern: Optional[UrlPattern]
+    params: dict
+    allowed_methods: Set[str]
+
+    def __init__(
+        self,
+        url_pattern: Optional[UrlPattern] = None,
+        params: Optional[dict] = None,
+        allowed_methods: Optional[Set[str]] = None,
+    ):
+        """
+        Args:
+            url_pattern: マッチしたURLパターン。パスにはマッチしたが、
+                メソッドを受け付けるものが無かった場合はNone
+            params: パスから取り出したパラメータ
+            allowed_methods: パスにマッチしたURLパターンが受け付けるメソッド
+        """
+        self.url_pattern = url_pattern
+        self.params = params or {}
+        self.allowed_methods = allowed_methods or set()
+
+
+class Router:
+    """
+    起動時に全てのURLパターンをコンパイルしておき、パスから素早くview関数を探す
+
+    パラメータを含まないパスは辞書から1回で探し、パラメータを含むパスは
+    セグメントごとの木構造をたどって探すので、URLパターンの数が増えても
+    探索にかかる時間はほとんど変わらない
+    """
+
+    def __init__(self, url_patterns: Iterable[UrlPattern]):
+        # 固定のパスと、それにマッチするURLパターン（登録順）
+        self.static_routes: Dict[str, List[UrlPattern]] = {}
+        self.root = RouteNode()
+
+        for url_pattern in url_patterns:
+            self.add(url_pattern)
+
+    def add(self, url_pattern: UrlPattern) -> None:
+        if url_pattern.is_static:
+            self.static_routes.setdefault(url_pattern.pattern, []).append(url_pattern)
+            return
+
+        node = self.root
+        for segment in url_pattern.segments:
+            if isinstance(segment, str):
+                node = node.children.setdefault(segment, RouteNode())
+            else:
+                node = node.child(*segment)
+        node.url_patterns.append(url_pattern)
+
+    def resolve(self, method: str, path: str) -> Optional[RouteMatch]:
+        """
+        メソッドとパスにマッチするURLパターンを探す
+
+        Returns:
+            Optional[RouteMatch]: マッチした結果。パスにマッチするURLパターンが無ければNone
+            パスにはマッチしたがメソッドが受け付けられない場合は、url_patternがNoneになる
+        """
+        allowed_methods: Set[str] = set()
+
+        url_patterns = self.static_routes.get(path)
+        if url_patterns is not None:
+            for url_pattern in url_patterns:
+                if url_pattern.allows(method):
+                    return RouteMatch(url_pattern)
+                allowed_methods |= url_pattern.methods
+
+        if path.startswith("/"):
+            segments = path[1:].split("/")
+            for url_pattern, params in self.match(self.root, segments, 0, {}):
+                if url_pattern.allows(method):
+                    return RouteMatch(url_pattern, params)
+                allowed_methods |= url_pattern.methods
+
+        if allowed_methods:
+            return RouteMatch(allowed_methods=allowed_methods)
+        return None
+
+    def match(
+        self, node: RouteNode, segments: List[str], index: int, params: dict
+    ) -> Iterator[Tuple[UrlPattern, dict]]:
+        """
+        木構造をたどり、パスにマッチするURLパターンとパラメータを優先度順に返す
+
+        固定の文字列のセグメントを、パラメータのセグメントより優先する
+        """
+        if index == len(segments):
+            for url_pattern in node.url_patterns:
+                yield url_pattern, params
+            return
+
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            yield from self.match(child, segments, index + 1, params)
+
+        for converter, name, child in node.parameters:
+            if isinstance(converter, PathConverter):
+                # 残りのセグメントを全てまとめて1つのパラメータにする
+                value = "/".join(segments[index:])
+                if value and child.url_patterns:
+                    params = {**params, name: converter.to_python(unquote(value))}
+                    for url_pattern in child.url_patterns:
+                        yield url_pattern, params
+                continue
+
+            if not segment or not converter.pattern.fullmatch(segment):
+                continue
+            try:
+                value = converter.to_python(unquote(segment))
+            except ValueError:
+                # 正規表現にはマッチしても変換できない値（桁数が多すぎる整数など）は、
+                # マッチしなかったことにする
+                continue
+            yield from self.match(child, segments, index + 1, {**params, name: value})
@@ -0,0 +1,271 @@
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Event, Lock
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import settings
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.urls.pattern import is_async_view
+
+# view関数の型
+View = Callable[[HttpRequest], HttpResponse]
+
+# キャッシュするステータスコード
+CACHEABLE_STATUS_CODES = (200, 203, 204, 300, 301, 404, 405, 410)
+
+# キャッシュするリクエストメソッド。HEADはGETと同じレスポンスを使う
+CACHEABLE_METHODS = ("GET", "HEAD")
+
+
+class CachedResponse:
+    """
+    キャッシュされたレスポンス
+
+    ボディは圧縮する前のbytesで持ち、ヒットするたびに新しいHttpResponseを作って返す
+    """
+
+    __slots__ = ("status_code", "headers", "content_type", "body", "expires_at")
+
+    def __init__(self, response: HttpResponse, expires_at: float):
+        self.status_code = response.status_code
+        self.headers = dict(response.headers)
+        self.content_type = response.content_type
+        self.body: bytes = response.body
+        self.expires_at = expires_at
+
+    @property
+    def size(self) -> int:
+        """
+        キャッシュが使うメモリの量として数えるバイト数
+        """
+        return len(self.body) + sum(
+            len(name) + len(value) for name, value in self.headers.items()
+        )
+
+    def to_response(self) -> HttpResponse:
+        # 送信時の圧縮などでヘッダーが書き換えられるので、辞書は毎回複製する
+        return HttpResponse(
+            status_code=self.status_code,
+            headers=dict(self.headers),
+            content_type=self.content_type,
+            body=self.body,
+        )
+
+
+class Flight:
+    """
+    キャッシュに無かったレスポンスを作っている最中であることを表す
+
+    同じキーのリクエストは、先に来た1つがレスポンスを作り終えるのを待つ
+    """
+
+    __slots__ = ("done", "entry")
+
+    def __init__(self):
+        self.done = Event()
+        # 作ったレスポンスがキャッシュできなかった場合はNoneのまま
+        self.entry: Optional[CachedResponse] = None
+
+
+class ResponseCache:
+    """
+    view関数が作ったレスポンスをメモリに保持しておくキャッシュ
+
+    有効期限を過ぎたものは使わない。合計サイズが上限を超えると、
+    最も長く使われていないものから捨てる(LRU)。
+    キャッシュに無いキーへの同時のリクエストは1つにまとめ、view関数を1回だけ呼ぶ
+    """
+
+    def __init__(self, max_bytes: int, max_entry_size: int, wait_timeout: float):
+        """
+        Args:
+            max_bytes: キャッシュ全体で保持するバイト数の上限
+            max_entry_size: キャッシュするレスポンスボディの最大バイト数
+            wait_timeout: 他のスレッドがレスポンスを作り終えるのを待つ最大秒数
+                超えた場合は待つのをやめて、自分でview関数を呼ぶ
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_size = max_entry_size
+        self.wait_timeout = wait_timeout
+
+        self.lock = Lock()
+        self.entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self.flights: Dict[tuple, Flight] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+
+    def get_response(
+        self, key: tuple, view: View, request: HttpRequest, ttl: float
+    ) -> HttpResponse:
+        """
+        キャッシュからレスポンスを返す。無ければview関数を呼んでキャッシュする
+
+        Args:
+            key: キャッシュのキー
+            view: キャッシュに無い時に呼ぶview関数
+            request: view関数に渡すリクエスト
+            ttl: キャッシュの有効期限（秒）
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry.expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.to_response()
+                self.remove(key)
+
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.misses += 1
+            else:
+                self.waits += 1
+
+        if not leader:
+            # 先に来たリクエストがレスポンスを作り終えるのを待ち、それを使う
+            if flight.done.wait(self.wait_timeout) and flight.entry is not None:
+                return flight.entry.to_response()
+            return view(request)
+
+        try:
+            response = view(request)
+            if self.is_cacheable(response):
+                if isinstance(response.body, str):
+                    response.body = response.body.encode()
+                flight.entry = CachedResponse(response, time.monotonic() + ttl)
+                self.add(key, flight.entry)
+            return response
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def is_cacheable(self, response: HttpResponse) -> bool:
+        """
+        レスポンスをキャッシュしてよいか判定する
+
+        クライアントごとに変わるCookieを設定するものや、
+        長さの分からないボディを少しずつ送るものはキャッシュしない
+        """
+        return (
+            response.status_code in CACHEABLE_STATUS_CODES
+            and not response.is_streaming
+            and not response.cookies
+            and "Set-Cookie" not in response.headers
+            and len(response.body) <= self.max_entry_size
+        )
+
+    def add(self, key: tuple, entry: CachedResponse) -> None:
+        if entry.size > self.max_bytes:
+            return
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = entry
+            self.size += entry.size
+
+            # 上限を超えた分を、最も長く使われていないものから捨てる
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def remove(self, key: tuple) -> None:
+        """
+        キャッシュからキーを取り除く。lockを取得した状態で呼ぶ
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        キャッシュの上限を調整するための統計情報
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# プロセス内の全てのスレッドで共有するキャッシュ
+response_cache = ResponseCache(
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    max_entry_size=settings.RESPONSE_CACHE_MAX_ENTRY_SIZE,
+    wait_timeout=settings.RESPONSE_CACHE_WAIT_TIMEOUT,
+)
+
+
+class CachePolicy:
+    """
+    view関数のレスポンスをどのようにキャッシュするか
+
+    キャッシュのキーはpath、クエリ文字列、pathのパラメータと、
+    指定したリクエストヘッダー・Cookieの値から作る
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        headers: Iterable[str] = (),
+        cookies: Iterable[str] = (),
+    ):
+        """
+        Args:
+            ttl: キャッシュの有効期限（秒）
+            headers: 値によってレスポンスが変わるリクエストヘッダーの名前
+                ex) ["Accept-Language"]
+            cookies: 値によってレスポンスが変わるCookieの名前
+        """
+        self.ttl = ttl
+        self.headers: Tuple[str, ...] = tuple(headers)
+        self.cookies: Tuple[str, ...] = tuple(cookies)
+
+    def build_key(self, view: View, request: HttpRequest) -> tuple:
+        return (
+            view,
+            request.path,
+            request.query_string,
+            tuple(sorted(request.params.items())),
+            tuple(request.headers.get(name) for name in self.headers),
+            tuple(request.cookies.get(name) for name in self.cookies),
+        )
+
+    def wrap(self, view: View) -> View:
+        """
+        view関数を、このポリシーでレスポンスをキャッシュするview関数にする
+
+        Raises:
+            ValueError: async defのview関数が渡された場合
+        """
+        if is_async_view(view):
+            # キャッシュの待ち合わせはスレッドを止めるので、イベントループ上では使えない
+            raise ValueError(f"async defのview関数はキャッシュできません: {view!r}")
+
+        @wraps(view)
+        def cached_view(request: HttpRequest) -> HttpResponse:
+            if request.method not in CACHEABLE_METHODS:
+                return view(request)
+            key = self.build_key(view, request)
+            return response_cache.get_response(key, view, request, self.ttl)
+
+        cached_view.cache_policy = self
+        return cached_view
+
@@ -0,0 +1,84 @@
+from typing import Callable, Dict
+
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.server.metrics import metrics
+from henango.server.profiler import profiler
+from henango.views.cache import response_cache
+from henango.views.static_cache import static_file_cache
+
+# Prometheusのテキスト形式のContent-Type
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# /metrics/profileで、secondsを省略した時に計測する秒数
+DEFAULT_PROFILE_SECONDS = 5.0
+
+
+def register_cache_stats(prefix: str, stats: Callable[[], Dict[str, int]]) -> None:
+    """
+    キャッシュの統計情報を、メトリクスとして出力するよう登録する
+
+    waitsは、同じキーのレスポンスを作り終えるのを待って使い回した数で、
+    それを数えているキャッシュの場合だけ登録する
+    """
+    available = stats()
+    for key in ("hits", "misses", "waits", "evictions"):
+        if key not in available:
+            continue
+        metrics.register(
+            f"{prefix}_{key}_total",
+            f"キャッシュの{key}の数",
+            lambda key=key: stats()[key],
+            type="counter",
+        )
+    for key in ("entries", "bytes"):
+        metrics.register(
+            f"{prefix}_{key}",
+            f"キャッシュが保持している{key}",
+            lambda key=key: stats()[key],
+        )
+
+
+register_cache_stats("henango_static_cache", static_file_cache.stats)
+register_cache_stats("henango_response_cache", response_cache.stats)
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """
+    サーバのメトリクスを、Prometheusのテキスト形式で返すview関数
+    """
+    return HttpResponse(
+        content_type=METRICS_CONTENT_TYPE,
+        headers={"Cache-Control": "no-store"},
+        body=metrics.render(),
+    )
+
+
+def profile(request: HttpRequest) -> HttpResponse:
+    """
+    クエリのseconds秒の間、全てのスレッドのスタックを集計して返すview関数
+
+    計測が終わるまでレスポンスを返さない
+    ex) curl 'localhost:8080/metrics/profile?seconds=10' > stacks.txt
+    """
+    try:
+        seconds = float(request.query.get("seconds", [DEFAULT_PROFILE_SECONDS])[0])
+    except ValueError:
+        return HttpResponse(
+            status_code=400,
+            content_type="text/plain; charset=utf-8",
+            body=b"seconds must be a number\n",
+        )
+
+    stacks = profiler.profile(seconds)
+    if stacks is None:
+        return HttpResponse(
+            status_code=409,
+            content_type="text/plain; charset=utf-8",
+            body=b"another profile is in progress\n",
+        )
+    return HttpResponse(
+        content_type="text/plain; charset=utf-8",
+        headers={"Cache-Control": "no-store"},
+        body=stacks,
+    )
@@ -1,39 +1,303 @@
 import os
-import traceback
+import re
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import BinaryIO, Optional, Tuple
 
 import settings
+from henango.http.compression import is_compressible, negotiate_encoding
+from henango.http.mime import get_content_type
 from henango.http.request import HttpRequest
-from henango.http.response import HttpResponse
+from henango.http.response import FileResponse, HttpResponse
+from henango.views.static_cache import StaticFileEntry, static_file_cache
+
+# Rangeヘッダーのうち、対応している単一範囲の指定
+# ex) "bytes=0-499", "bytes=500-", "bytes=-500"
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+# 静的ファイルを置くディレクトリの絶対パス。リクエストのたびに求め直さないよう、一度だけ求める
+STATIC_ROOT = os.path.realpath(
+    getattr(
+        settings,
+        "STATIC_ROOT",
+        os.path.join(os.path.dirname(__file__), "../../static"),
+    )
+)
 
 
 def static(request: HttpRequest) -> HttpResponse:
+    """
+    静的ファイルを返すview関数
+
+    小さいファイルはメモリ上のキャッシュから、大きいファイルはos.sendfileで返す。
+    ETag / Last-Modifiedによる条件付きリクエスト(304)と、
+    Rangeヘッダーによる部分的なリクエスト(206)に対応する。
+    大きいファイルは、隣に圧縮済みの .gz ファイルが置かれていればそれを返す
+    """
+    static_file_path = get_static_file_path(request.path)
+    if static_file_path is None:
+        return not_found()
+
+    entry = static_file_cache.get(static_file_path)
+    if entry is not None:
+        return cached_file_response(request, entry)
 
     try:
-        default_static_root = os.path.join(os.path.dirname(__file__), "../../static")
-        static_root = getattr(settings, "STATIC_ROOT", default_static_root)
+        f = open(static_file_path, "rb")
+    except OSError:
+        # ファイルを開けなかった場合は404を返す
+        return not_found()
+
+    stat = os.fstat(f.fileno())
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+    }
+    content_type = get_content_type(static_file_path)
+
+    status_code, byte_range = evaluate_conditions(
+        request, etag, last_modified, stat.st_mtime, stat.st_size
+    )
+    if status_code == 206:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        return FileResponse(
+            f,
+            offset=start,
+            length=end - start + 1,
+            status_code=206,
+            headers=headers,
+            content_type=content_type,
+        )
+
+    if status_code == 200:
+        if is_compressible(content_type):
+            precompressed = open_precompressed(static_file_path, stat)
+            if precompressed is not None:
+                headers["Vary"] = "Accept-Encoding"
+                if accepts_gzip(request):
+                    f.close()
+                    gzip_file, gzip_size = precompressed
+                    headers["ETag"] = etag[:-1] + '-gzip"'
+                    headers["Content-Encoding"] = "gzip"
+                    return FileResponse(
+                        gzip_file,
+                        length=gzip_size,
+                        headers=headers,
+                        content_type=content_type,
+                    )
+                precompressed[0].close()
+
+        return FileResponse(
+            f, length=stat.st_size, headers=headers, content_type=content_type
+        )
+
+    f.close()
+    return status_response(status_code, headers, stat.st_size)
 
-        # pathの先頭の/を削除し、相対パスにしておく
-        relative_path = request.path.lstrip("/")
-        # デフォルトパス指定
-        if not relative_path:
-            relative_path = "index.html"
-        # ファイルのpathを取得
-        static_file_path = os.path.join(static_root, relative_path)
 
-        with open(static_file_path, "rb") as f:
-            response_body = f.read()
+def cached_file_response(
+    request: HttpRequest, entry: StaticFileEntry
+) -> HttpResponse:
+    """
+    キャッシュされた静的ファイルからレスポンスを作る
 
-        content_type = None
+    クライアントがgzipを受け付ける場合は、圧縮済みのものを返す
+    """
+    headers = {
+        "ETag": entry.etag,
+        "Last-Modified": entry.last_modified,
+        "Accept-Ranges": "bytes",
+    }
+    if entry.gzip_body is not None:
+        headers["Vary"] = "Accept-Encoding"
+
+    status_code, byte_range = evaluate_conditions(
+        request, entry.etag, entry.last_modified, entry.mtime, entry.content_length
+    )
+    if status_code == 206:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{entry.content_length}"
         return HttpResponse(
-            body=response_body, content_type=content_type, status_code=200
+            status_code=206,
+            headers=headers,
+            content_type=entry.content_type,
+            body=entry.body[start : end + 1],
         )
 
-    except OSError:
-        # レスポンスを取得できなかった場合は、ログを出力して404を返す
-        traceback.print_exc()
+    if status_code != 200:
+        return status_response(status_code, headers, entry.content_length)
 
-        response_body = b"<html><body><h1>404 Not Found</h1></body></html>"
-        content_type = "text/html;"
+    if entry.gzip_body is not None and accepts_gzip(request):
+        # 圧縮したものは別の表現なので、ETagも区別する
+        headers["ETag"] = entry.etag[:-1] + '-gzip"'
+        headers["Content-Encoding"] = "gzip"
         return HttpResponse(
-            body=response_body, content_type=content_type, status_code=200
+            headers=headers, content_type=entry.content_type, body=entry.gzip_body
         )
+
+    return HttpResponse(
+        headers=headers, content_type=entry.content_type, body=entry.body
+    )
+
+
+def get_static_file_path(path: str) -> Optional[str]:
+    """
+    リクエストのpathから静的ファイルの絶対パスを求める
+
+    Returns:
+        Optional[str]: 静的ファイルの絶対パス
+        ../ などで静的ファイルのディレクトリの外を指定された場合や、
+        ヌル文字を含むなどファイルのパスとして使えない場合はNone
+    """
+    # pathの先頭の/を削除し、相対パスにしておく
+    relative_path = path.lstrip("/")
+    # デフォルトパス指定
+    if not relative_path:
+        relative_path = "index.html"
+    # ファイルのpathを取得
+    try:
+        static_file_path = os.path.realpath(os.path.join(STATIC_ROOT, relative_path))
+    except ValueError:
+        # ヌル文字を含むパスはValueErrorになる
+        return None
+
+    if not static_file_path.startswith(STATIC_ROOT + os.sep):
+        return None
+    return static_file_path
+
+
+def not_found() -> HttpResponse:
+    response_body = b"<html><body><h1>404 Not Found</h1></body></html>"
+    content_type = "text/html; charset=UTF-8"
+    return HttpResponse(
+        body=response_body, content_type=content_type, status_code=404
+    )
+
+
+def status_response(status_code: int, headers: dict, size: int) -> HttpResponse:
+    """
+    ファイルの中身を含まない304, 416のレスポンスを作る
+    """
+    if status_code == 304:
+        return HttpResponse(status_code=304, headers=headers)
+
+    headers = {"Content-Range": f"bytes */{size}"}
+    return HttpResponse(
+        status_code=416,
+        headers=headers,
+        content_type="text/html; charset=UTF-8",
+        body=b"<html><body><h1>416 Range Not Satisfiable</h1></body></html>",
+    )
+
+
+def evaluate_conditions(
+    request: HttpRequest, etag: str, last_modified: str, mtime: float, size: int
+) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """
+    条件付きリクエストとRangeヘッダーから、返すべきステータスコードを判定する
+
+    Returns:
+        Tuple[int, Optional[Tuple[int, int]]]:
+        (ステータスコード, 206の場合は送信する最初と最後のバイトの位置)
+    """
+    # クライアントが持っているものから変更が無ければ、ボディは送らない
+    if is_not_modified(request, etag, mtime):
+        return 304, None
+
+    range_header = request.headers.get("Range")
+    if not range_header or not RANGE_PATTERN.fullmatch(range_header.strip()):
+        # 複数範囲など対応していない指定は無視し、ファイル全体を返す
+        return 200, None
+
+    # If-Rangeが指定されている場合は、変更が無い場合だけRangeに従う
+    if request.headers.get("If-Range") not in (None, etag, last_modified):
+        return 200, None
+
+    byte_range = parse_range(range_header, size)
+    if byte_range is None:
+        return 416, None
+    return 206, byte_range
+
+
+def accepts_gzip(request: HttpRequest) -> bool:
+    """
+    Accept-Encodingから、クライアントがgzipを受け付けるか判定する
+    """
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    return negotiate_encoding(accept_encoding, ("gzip",)) == "gzip"
+
+
+def open_precompressed(
+    path: str, stat: os.stat_result
+) -> Optional[Tuple[BinaryIO, int]]:
+    """
+    静的ファイルの隣に置かれた、圧縮済みの .gz ファイルを開く
+
+    元のファイルより古い .gz ファイルは、内容が古い可能性があるので使わない
+
+    Returns:
+        Optional[Tuple[BinaryIO, int]]: (開いた .gz ファイル, そのバイト数)
+        使える .gz ファイルが無い場合はNone
+    """
+    try:
+        f = open(path + ".gz", "rb")
+    except OSError:
+        return None
+    gzip_stat = os.fstat(f.fileno())
+    if gzip_stat.st_mtime_ns < stat.st_mtime_ns:
+        f.close()
+        return None
+    return f, gzip_stat.st_size
+
+
+def is_not_modified(request: HttpRequest, etag: str, mtime: float) -> bool:
+    """
+    条件付きリクエストの条件から、クライアントのキャッシュが最新か判定する
+
+    If-None-Matchがある場合はそちらを優先し、If-Modified-Sinceは無視する
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # 弱いETag(W/"...")や、圧縮したものに付けたETagも同じものとして比較する
+        tags = [tag.removeprefix("W/").replace('-gzip"', '"') for tag in tags]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        modified = datetime.fromtimestamp(int(mtime), timezone.utc)
+        return modified <= since
+
+    return False
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    単一範囲を指定したRangeヘッダーから、送信するバイトの範囲を求める
+
+    Returns:
+        Optional[Tuple[int, int]]: 送信する最初と最後のバイトの位置（最後も含む）
+        ファイルの範囲外を指定されている場合はNone
+    """
+    first, last = RANGE_PATTERN.fullmatch(range_header.strip()).groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # bytes=-500 は末尾の500バイト
+        start = max(size - int(last), 0)
+        end = size - 1
+    else:
+        return None
+
+    if start > end or start >= size:
+        return None
+    return start, end
@@ -0,0 +1,193 @@
+import os
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from threading import Lock
+from typing import Dict, Optional
+
+import settings
+from henango.http.compression import compress, is_compressible
+from henango.http.mime import get_content_type
+
+
+class StaticFileEntry:
+    """
+    キャッシュされた静的ファイル
+
+    レスポンスに必要な値は、読み込んだ時に全て計算しておく
+    """
+
+    path: str
+    body: bytes
+    gzip_body: Optional[bytes]
+    content_type: str
+    content_length: int
+    etag: str
+    last_modified: str
+    mtime: float
+    mtime_ns: int
+    # 最後にファイルが変更されていないか確認した時刻
+    checked_at: float
+
+    def __init__(self, path: str, body: bytes, stat: os.stat_result):
+        self.path = path
+        self.body = body
+        self.content_type = get_content_type(path)
+        self.content_length = len(body)
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.checked_at = time.monotonic()
+
+        # テキストは圧縮したものも作っておき、リクエストのたびに圧縮しなくて済むようにする
+        self.gzip_body = None
+        if (
+            is_compressible(self.content_type)
+            and len(body) >= settings.COMPRESSION_MIN_SIZE
+        ):
+            compressed = compress(body, "gzip")
+            if len(compressed) < len(body):
+                self.gzip_body = compressed
+
+    @property
+    def size(self) -> int:
+        """
+        キャッシュが使うメモリの量として数えるバイト数
+        """
+        return self.content_length + len(self.gzip_body or b"")
+
+
+class StaticFileCache:
+    """
+    静的ファイルの中身をメモリに保持しておくキャッシュ
+
+    合計サイズが上限を超えると、最も長く使われていないものから捨てる(LRU)。
+    ファイルが変更された場合は、statで更新日時とサイズを確認して読み込み直す。
+    statは1ファイルにつきcheck_interval秒に1回しか行わない。
+    """
+
+    def __init__(self, max_bytes: int, max_file_size: int, check_interval: float):
+        """
+        Args:
+            max_bytes: キャッシュ全体で保持するバイト数の上限
+            max_file_size: キャッシュするファイルの最大サイズ。これより大きいファイルは
+                キャッシュせず、毎回ファイルから送信する
+            check_interval: ファイルが変更されていないか確認する間隔（秒）
+        """
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.check_interval = check_interval
+
+        self.lock = Lock()
+        self.entries: "OrderedDict[str, StaticFileEntry]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path: str) -> Optional[StaticFileEntry]:
+        """
+        静的ファイルをキャッシュから取得する。キャッシュに無ければ読み込んでキャッシュする
+
+        Args:
+            path: 静的ファイルの絶対パス
+
+        Returns:
+            Optional[StaticFileEntry]: キャッシュされたファイル
+            ファイルが存在しない場合や、キャッシュするには大きすぎる場合はNone
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self.entries.move_to_end(path)
+
+        if entry is not None:
+            now = time.monotonic()
+            fresh = now - entry.checked_at < self.check_interval
+            if not fresh and self.is_fresh(entry):
+                entry.checked_at = now
+                fresh = True
+            if fresh:
+                with self.lock:
+                    self.hits += 1
+                return entry
+            self.discard(path)
+
+        with self.lock:
+            self.misses += 1
+        return self.load(path)
+
+    def is_fresh(self, entry: StaticFileEntry) -> bool:
+        """
+        キャッシュした後にファイルが変更されていないか確認する
+        """
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return False
+        return (
+            stat.st_mtime_ns == entry.mtime_ns
+            and stat.st_size == entry.content_length
+        )
+
+    def load(self, path: str) -> Optional[StaticFileEntry]:
+        """
+        ファイルを読み込んでキャッシュに追加する
+
+        ヒット・ミスの数は変えないので、起動時に読み込んでおく場合はこちらを直接呼ぶ
+        """
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size > self.max_file_size:
+                    return None
+                entry = StaticFileEntry(path, f.read(), stat)
+        except OSError:
+            return None
+
+        if entry.size > self.max_bytes:
+            return entry
+
+        with self.lock:
+            previous = self.entries.pop(path, None)
+            if previous is not None:
+                self.size -= previous.size
+            self.entries[path] = entry
+            self.size += entry.size
+
+            # 上限を超えた分を、最も長く使われていないものから捨てる
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+        return entry
+
+    def discard(self, path: str) -> None:
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def stats(self) -> Dict[str, int]:
+        """
+        キャッシュの上限を調整するための統計情報
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# プロセス内の全てのスレッドで共有するキャッシュ
+static_file_cache = StaticFileCache(
+    max_bytes=settings.STATIC_CACHE_MAX_BYTES,
+    max_file_size=settings.STATIC_CACHE_MAX_FILE_SIZE,
+    check_interval=settings.STATIC_CACHE_CHECK_INTERVAL,
+)
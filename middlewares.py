@@ -0,0 +1,45 @@
+import os
+import time
+
+import settings
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+
+
+class ServerTimingMiddleware:
+    """
+    view関数の処理にかかった時間を、Server-Timingヘッダーでブラウザに伝える
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        started_at = time.perf_counter()
+        response = self.get_response(request)
+        duration = (time.perf_counter() - started_at) * 1000
+        response.headers["Server-Timing"] = f"app;dur={duration:.3f}"
+        return response
+
+
+class MaintenanceMiddleware:
+    """
+    FLAG_FILEが存在する間はメンテナンス中とし、view関数を呼ばずに503を返す
+
+    イベントループ上で動く非同期のミドルウェアの例
+    """
+
+    FLAG_FILE = os.path.join(settings.BASE_DIR, "MAINTENANCE")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    async def __call__(self, request: HttpRequest) -> HttpResponse:
+        if os.path.exists(self.FLAG_FILE):
+            return HttpResponse(
+                status_code=503,
+                headers={"Retry-After": "60"},
+                content_type="text/html; charset=UTF-8",
+                body=b"<html><body><h1>503 Service Unavailable</h1></body></html>",
+            )
+        return await self.get_response(request)
@@ -1,13 +1,220 @@
+import atexit
+import json
 import os
-import inspect
+import queue
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional, TextIO
 
+import settings
 
-def log(msg, *args):
+# ログレベル
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+
+class LogWriter:
+    """
+    ログの書き出しを専用のスレッドで行う
+
+    ログを出す側はキューに積むだけなので、書き出しの遅さに引きずられず、
+    スレッド同士が標準出力の書き込みで待たされることもない。
+    キューが一杯の時はログを捨てて、捨てた数を数えておく。
+    """
+
+    def __init__(self, stream: TextIO, queue_size: int):
+        """
+        Args:
+            stream: 書き出し先
+            queue_size: 書き出し待ちにできるログの最大数
+        """
+        self.stream = stream
+        self.queue_size = queue_size
+        # 書き出しが追いつかずに捨てたログの数
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.pid: Optional[int] = None
+        self.queue: "queue.Queue[Optional[str]]" = queue.Queue(queue_size)
+        self.thread: Optional[threading.Thread] = None
+
+    def write(self, line: str) -> None:
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        """
+        書き出しスレッドを起動する
+
+        fork後の子プロセスには親のスレッドが引き継がれないので、プロセスごとに起動し直す
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.queue_size)
+            self.thread = threading.Thread(
+                target=self.run, name="log-writer", daemon=True
+            )
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def run(self) -> None:
+        while True:
+            line = self.queue.get()
+            if line is None:
+                return
+            # 溜まっているログはまとめて1回で書き出す
+            lines = [line]
+            while True:
+                try:
+                    line = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if line is None:
+                    self.flush(lines)
+                    return
+                lines.append(line)
+            self.flush(lines)
+
+    def flush(self, lines) -> None:
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append(f"[mylog.py] == ログを{dropped}件破棄しました ==\n")
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def close(self) -> None:
+        """
+        書き出し待ちのログを全て書き出してからスレッドを止める
+        """
+        if self.pid != os.getpid() or self.thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self.thread.join(timeout=1)
+        self.pid = None
+
+
+def open_stream(destination: str) -> TextIO:
+    """
+    書き出し先の設定値からストリームを得る。"-"は標準出力
+    """
+    if destination == "-":
+        return sys.stdout
+    return open(destination, "a", encoding="utf-8")
+
+
+log_writer = LogWriter(sys.stdout, settings.LOG_QUEUE_SIZE)
+access_log_writer = (
+    LogWriter(open_stream(settings.ACCESS_LOG), settings.LOG_QUEUE_SIZE)
+    if settings.ACCESS_LOG
+    else None
+)
+
+# これより低いレベルのログは出さない
+log_level = LEVELS[settings.LOG_LEVEL.upper()]
+
+# 呼び出し元のファイルのパスと、そのファイル名
+caller_names: Dict[str, str] = {}
+
+
+def log(msg, *args, level: int = INFO, exc_info: bool = False):
     """
     見やすくログを出すメソッド。プレースホルダ対応。
+
+    出力しないレベルのログは、フォーマットも呼び出し元の取得もせずにすぐ戻る
+
+    Args:
+        level: ログレベル
+        exc_info: 処理中の例外のスタックトレースも出すか
     """
+    if level < log_level:
+        return
     PRE_SUFFIX = "=="
     # 呼び出し元のファイル名を取得
-    caller_file = os.path.basename(inspect.stack()[1].filename)
-    formatted = msg.format(*args)
-    print(f"[{caller_file}] {PRE_SUFFIX} {formatted} {PRE_SUFFIX}")
+    # このモジュールのヘルパー経由で呼ばれた場合は、もう1つ上が呼び出し元
+    frame = sys._getframe(1)
+    if frame.f_globals is globals():
+        frame = frame.f_back
+    path = frame.f_code.co_filename
+    caller_file = caller_names.get(path)
+    if caller_file is None:
+        caller_file = caller_names[path] = os.path.basename(path)
+
+    formatted = msg.format(*args) if args else msg
+    line = (
+        f"{time.strftime('%Y-%m-%d %H:%M:%S')} {LEVEL_NAMES[level]} "
+        f"[{caller_file}] {PRE_SUFFIX} {formatted} {PRE_SUFFIX}\n"
+    )
+    if exc_info:
+        line += traceback.format_exc()
+    log_writer.write(line)
+
+
+def debug(msg, *args):
+    log(msg, *args, level=DEBUG)
+
+
+def warning(msg, *args):
+    log(msg, *args, level=WARNING)
+
+
+def error(msg, *args, exc_info: bool = False):
+    log(msg, *args, level=ERROR, exc_info=exc_info)
+
+
+def access_log(
+    address,
+    method: str,
+    path: str,
+    http_version: str,
+    status_code: int,
+    body_size: int,
+    duration: float,
+):
+    """
+    1リクエストごとのアクセスログをJSON Lines形式で出す
+
+    Args:
+        address: クライアントのアドレス情報 (IP, ポート)
+        body_size: 送信したレスポンスボディのバイト数
+        duration: リクエストを受信し終えてからレスポンスを送り終えるまでの秒数
+    """
+    if access_log_writer is None:
+        return
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "remote_addr": address[0] if address else None,
+        "method": method,
+        "path": path,
+        "http_version": http_version,
+        "status": status_code,
+        "bytes": body_size,
+        "duration_ms": round(duration * 1000, 3),
+    }
+    access_log_writer.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+@atexit.register
+def close():
+    """
+    プロセスの終了時に、書き出し待ちのログを書き出す
+    """
+    log_writer.close()
+    if access_log_writer is not None:
+        access_log_writer.close()
@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import sys
+import time
+from typing import List, Tuple
+
+from benchmark import read_response, summarize
+from henango.server.capture import read_capture
+
+
+def load_records(paths: List[str]) -> List[Tuple[float, bytes]]:
+    """
+    キャプチャファイルからリクエストを読み込み、受信した順に並べる
+
+    ローテーションされた複数のファイルを渡してもよい
+    """
+    records = []
+    for path in paths:
+        with open(path, "rb") as f:
+            records.extend(read_capture(f))
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+class Replayer:
+    """
+    記録されたリクエストを、記録された時の間隔を保ってサーバへ送り直す
+
+    リクエストごとに新しいコネクションを使い、レスポンスを読み終えたら切断する
+    """
+
+    def __init__(
+        self, host: str, port: int, speed: float, concurrency: int, timeout: float
+    ):
+        """
+        Args:
+            speed: 再生の速さの倍率。2なら2倍の速さで送る。0の場合は間隔を空けずに送る
+            concurrency: 同時に送信中にするリクエストの最大数
+            timeout: 1リクエストあたりの最大秒数
+        """
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.latencies: List[float] = []
+        self.status_codes = {}
+        self.errors = 0
+
+    async def run(self, records: List[Tuple[float, bytes]]) -> float:
+        """
+        全てのリクエストを送り、レスポンスを受け取り終えるまで待つ
+
+        Returns:
+            float: 再生にかかった秒数
+        """
+        if not records:
+            return 0
+        first_received_at = records[0][0]
+        started_at = time.monotonic()
+        tasks = []
+        for received_at, raw_request in records:
+            if self.speed > 0:
+                offset = (received_at - first_received_at) / self.speed
+                delay = started_at + offset - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.semaphore.acquire()
+            tasks.append(asyncio.create_task(self.send(raw_request)))
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started_at
+
+    async def send(self, raw_request: bytes) -> None:
+        started_at = time.perf_counter()
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            writer.write(raw_request)
+            await writer.drain()
+            has_body = not raw_request.startswith(b"HEAD ")
+            status_code, _ = await asyncio.wait_for(
+                read_response(reader, has_body), self.timeout
+            )
+            # 100 Continueの後に本来のレスポンスが続く
+            while status_code == 100:
+                status_code, _ = await asyncio.wait_for(
+                    read_response(reader, has_body), self.timeout
+                )
+        except (
+            OSError,
+            asyncio.IncompleteReadError,
+            asyncio.TimeoutError,
+            ValueError,
+        ):
+            self.errors += 1
+        else:
+            self.latencies.append(time.perf_counter() - started_at)
+            self.status_codes[status_code] = (
+                self.status_codes.get(status_code, 0) + 1
+            )
+        finally:
+            if writer is not None:
+                writer.close()
+            self.semaphore.release()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="記録したリクエストをサーバへ送り直して負荷をかける"
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="キャプチャファイル ex) capture/requests.bin.*"
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="再生の速さの倍率。0の場合は間隔を空けずに送る",
+    )
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    records = load_records(args.paths)
+    replayer = Replayer(
+        args.host, args.port, args.speed, args.concurrency, args.timeout
+    )
+    elapsed = asyncio.run(replayer.run(records))
+
+    stats = summarize(replayer.latencies, elapsed)
+    print(
+        f"requests={len(records)} elapsed={elapsed:.3f}s errors={replayer.errors} "
+        f"status_codes={dict(sorted(replayer.status_codes.items()))}"
+    )
+    print(
+        f"rps={stats['rps']} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms "
+        f"p999={stats['p999_ms']}ms"
+    )
+    return 1 if replayer.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
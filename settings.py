@@ -1,4 +1,5 @@
 import os
+import secrets
 
 # 実行ファイルのあるディレクトリ
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -8,3 +9,220 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 # テンプレートファイルを置くディレクトリ
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+
+# keep-alive中、次のリクエストを待つ最大秒数
+KEEP_ALIVE_TIMEOUT = 5
+
+# リクエストの最初のバイトを受信してから、ヘッダーを受信しきるまでの最大秒数。超えると408を返す
+HEADER_TIMEOUT = 10
+
+# リクエストボディの受信にかけてよい秒数。
+# MIN_TRANSFER_RATEの速さで受信するのにかかる秒数を、これに加えて待つ。超えると408を返す
+BODY_TIMEOUT = 10
+
+# レスポンスの送信にかけてよい秒数。BODY_TIMEOUTと同様にMIN_TRANSFER_RATEの分を加えて待ち、
+# 超えるとコネクションを切断する
+WRITE_TIMEOUT = 10
+
+# クライアントに求める最低限の送受信の速さ（バイト/秒）
+MIN_TRANSFER_RATE = 500
+
+# 1つのIPアドレスから同時に張れるコネクションの数。超えると429を返す。0の場合は制限しない
+MAX_CONNECTIONS_PER_IP = 100
+
+# 1コネクションで処理する最大リクエスト数
+KEEP_ALIVE_MAX_REQUESTS = 100
+
+# サーバの動作モード
+# "thread": コネクションごとにスレッドを起動する
+# "pool": 一定数のスレッドからなるスレッドプールで処理する
+# "asyncio": イベントループ上のコルーチンでコネクションを処理する
+SERVER_MODE = "thread"
+
+# asyncioモードで、同期的なview関数をスレッドプールで実行するか
+# Falseにするとイベントループ上で直接実行する（viewが重いと全体が止まる）
+ASYNC_RUN_SYNC_VIEWS_IN_EXECUTOR = True
+
+# asyncioモードで、view関数を実行するスレッドプールの最大スレッド数
+# 非同期のミドルウェアの内側にある同期的なview関数を実行するスレッドプールにも使う
+ASYNC_EXECUTOR_MAX_WORKERS = 32
+
+# サーバがbindするアドレスとポート
+HOST = "localhost"
+PORT = 8080
+
+# acceptされるのを待つ接続を、カーネルが溜めておける数（listenのbacklog）
+LISTEN_BACKLOG = 128
+
+# poolモードで、コネクションを処理するスレッドの数
+POOL_WORKERS = 16
+
+# poolモードで、処理待ちのコネクションを積んでおけるキューの長さ
+# 一杯になると、新しいコネクションには503を返す
+POOL_QUEUE_SIZE = 64
+
+# 起動するワーカープロセスの数
+# 2以上にすると、スーパーバイザープロセスが指定した数の子プロセスをforkし、
+# 子プロセスはそれぞれSERVER_MODEで動く
+WORKER_PROCESSES = 1
+
+# 複数プロセスで動かすとき、子プロセスごとにSO_REUSEPORTでソケットをbindするか
+# Falseの場合は、スーパーバイザーが作ったソケットを全ての子プロセスで共有する
+REUSE_PORT = False
+
+# 停止を要求されてから、処理中のコネクションが終わるのを待つ最大秒数
+GRACEFUL_TIMEOUT = 30
+
+# 最初の接続を受け付ける前に、URL conf・テンプレート・静的ファイルを読み込んでおくか
+# Falseの場合は、それぞれ最初に必要になった時に読み込む
+WARM_UP = True
+
+# 起動時にコンパイルしたテンプレートを書き出しておくファイル。Noneの場合は書き出さない
+# 次回の起動時は、変更されていないテンプレートのコンパイルを省く
+STARTUP_SNAPSHOT_PATH = None
+
+# リクエストライン・ヘッダーの合計の最大バイト数。超えると431を返す
+MAX_HEADER_SIZE = 64 * 1024
+
+# リクエストボディの最大バイト数。超えると413を返す
+MAX_BODY_SIZE = 100 * 1024 * 1024
+
+# 静的ファイルのキャッシュが保持するバイト数の上限。超えると古いものから捨てる
+STATIC_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# キャッシュする静的ファイルの最大サイズ。これより大きいファイルは毎回sendfileで送る
+STATIC_CACHE_MAX_FILE_SIZE = 1024 * 1024
+
+# キャッシュした静的ファイルが変更されていないか確認する間隔（秒）
+STATIC_CACHE_CHECK_INTERVAL = 1.0
+
+# コンパイル済みのテンプレートのファイルが変更されていないか確認する間隔（秒）
+TEMPLATE_CHECK_INTERVAL = 1.0
+
+# このレベル以上のログを出力する (DEBUG, INFO, WARNING, ERROR)
+LOG_LEVEL = "INFO"
+
+# アクセスログ(JSON Lines)の出力先。"-"は標準出力、Noneの場合は出力しない
+ACCESS_LOG = "-"
+
+# 書き出し待ちにできるログの最大数。溢れた分は破棄する
+LOG_QUEUE_SIZE = 10000
+
+# 受信したリクエストをファイルに記録するか。記録したものはreplay.pyで再送できる
+CAPTURE_ENABLED = False
+
+# リクエストを記録するファイル。プロセスごとに、後ろにプロセスIDを付けたファイルに記録する
+CAPTURE_PATH = os.path.join(BASE_DIR, "capture", "requests.bin")
+
+# 記録するリクエストの割合 (0〜1)
+CAPTURE_SAMPLE_RATE = 1.0
+
+# 記録するファイルの最大バイト数。超えると新しいファイルに切り替える
+CAPTURE_MAX_BYTES = 64 * 1024 * 1024
+
+# 切り替えた古いファイルを残しておく数
+CAPTURE_BACKUP_COUNT = 5
+
+# 書き出し待ちにできるリクエストの最大数。溢れた分は記録しない
+CAPTURE_QUEUE_SIZE = 1000
+
+# 圧縮するボディの最小バイト数。これより小さいと圧縮しても効果が薄い
+COMPRESSION_MIN_SIZE = 512
+
+# 圧縮するContent-Type（前方一致）
+COMPRESSION_CONTENT_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+)
+
+# zlibの圧縮レベル (1〜9)。大きいほどよく縮むが時間がかかる
+COMPRESSION_LEVEL = 6
+
+# view関数のレスポンスのキャッシュが保持するバイト数の上限。超えると古いものから捨てる
+RESPONSE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# キャッシュするレスポンスボディの最大バイト数
+RESPONSE_CACHE_MAX_ENTRY_SIZE = 1024 * 1024
+
+# 同じレスポンスを作っている他のリクエストを待つ最大秒数。超えると自分で作る
+RESPONSE_CACHE_WAIT_TIMEOUT = 10.0
+
+# セッションIDの署名に使う秘密の鍵。環境変数で指定しない場合は起動ごとに作るので、
+# 再起動すると全てのセッションが無効になる
+SECRET_KEY = os.environ.get("HENANGO_SECRET_KEY") or secrets.token_hex(32)
+
+# ベンチマーク用の、I/Oを待つview関数（/bench/wait_sync/...など）を登録するか
+# 誰でもスレッドを長く占有させられるので、普段は無効にしておく。
+# benchmark.pyが起動するサーバでは、環境変数で有効にする
+BENCHMARK_ROUTES = os.environ.get("HENANGO_BENCHMARK_ROUTES") == "1"
+
+# セッションの保存先 ("memory", "sqlite")
+# WORKER_PROCESSESで複数のプロセスを起動する場合は、プロセス間で共有できる"sqlite"を使う
+SESSION_BACKEND = "memory"
+
+# セッションIDを入れるCookieの名前
+SESSION_COOKIE_NAME = "sessionid"
+
+# セッションの有効期限（秒）
+SESSION_MAX_AGE = 14 * 24 * 60 * 60
+
+# SESSION_BACKENDが"sqlite"の場合に、セッションを保存するファイル
+SESSION_SQLITE_PATH = os.path.join(BASE_DIR, "sessions.sqlite3")
+
+# 有効期限が切れたセッションをまとめて捨てる間隔（秒）
+SESSION_SWEEP_INTERVAL = 60
+
+# リクエスト数や処理時間などのメトリクスを計測するか
+METRICS_ENABLED = True
+
+# メトリクスをPrometheusのテキスト形式で返すパス。Noneの場合は公開しない
+METRICS_PATH = "/metrics"
+
+# 処理時間のヒストグラムのバケットの上限（秒）
+METRICS_LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# METRICS_PATH/profile で、全スレッドのスタックをサンプリングして返すか
+# 計測中のスレッドの状態を外から見られるので、信頼できる環境でだけ有効にする
+PROFILER_ENABLED = False
+
+# スタックをサンプリングする間隔（秒）
+PROFILER_INTERVAL = 0.005
+
+# 1回の計測で許す最大秒数
+PROFILER_MAX_DURATION = 30.0
+
+# view関数の呼び出しを包むミドルウェア。"モジュール名.属性名"で指定し、先にあるものほど外側になる
+# ミドルウェアは内側の処理get_responseを受け取り、リクエストからレスポンスを返す
+# 呼び出し可能なものを返す。__call__がasync defのクラスは非同期のミドルウェアになる
+# ex) ["middlewares.ServerTimingMiddleware"]
+MIDDLEWARE = []
+
+# アップロードされたファイルやリクエストボディを、メモリに持つ最大バイト数
+# これを超えると一時ファイルに書き出す
+UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
+# フォームの1つの値（ファイル以外）の最大バイト数。超えると413を返す
+FORM_MAX_FIELD_SIZE = 1024 * 1024
+
+# フォームの項目の最大数。超えると413を返す
+FORM_MAX_FIELDS = 1000
@@ -1,5 +1,26 @@
+import argparse
+
 from henango.server.server import Server
 
 # エンドポイント.
 if __name__ == "__main__":
-    Server().serve()
+    parser = argparse.ArgumentParser(description="HenaServerを起動する")
+    parser.add_argument(
+        "--mode",
+        choices=Server.MODES,
+        help="動作モード（省略時はsettings.SERVER_MODE）",
+    )
+    parser.add_argument("--host", help="bindするアドレス（省略時はsettings.HOST）")
+    parser.add_argument(
+        "--port", type=int, help="bindするポート（省略時はsettings.PORT）"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="起動するワーカープロセスの数（省略時はsettings.WORKER_PROCESSES）",
+    )
+    args = parser.parse_args()
+
+    Server(
+        mode=args.mode, host=args.host, port=args.port, processes=args.processes
+    ).serve()
@@ -1,11 +1,20 @@
-import os
+from typing import Iterator
 
 import settings
+from henango.template.engine import TemplateEngine
 
+# コンパイル済みのテンプレートは、全てのリクエストで共有する
+engine = TemplateEngine(
+    settings.TEMPLATES_DIR, check_interval=settings.TEMPLATE_CHECK_INTERVAL
+)
 
-def render(template_name: str, context: dict):
-    template_path = os.path.join(settings.TEMPLATES_DIR, template_name)
-    with open(template_path) as f:
-        template = f.read()
 
-    return template.format(**context)
+def render(template_name: str, context: dict) -> str:
+    return engine.get_template(template_name).render(context)
+
+
+def render_stream(template_name: str, context: dict) -> Iterator[str]:
+    """
+    レンダリングした結果を、全体を組み立てずに少しずつ返す
+    """
+    return engine.get_template(template_name).stream(context)
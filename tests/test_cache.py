@@ -0,0 +1,180 @@
+import threading
+import time
+
+import pytest
+
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.views.cache import CachePolicy, ResponseCache
+
+
+def make_cache(**kwargs) -> ResponseCache:
+    options = {"max_bytes": 1024 * 1024, "max_entry_size": 1024, "wait_timeout": 5}
+    options.update(kwargs)
+    return ResponseCache(**options)
+
+
+class CountingView:
+    """
+    呼ばれた回数を数えるview関数
+    """
+
+    def __init__(self, body: bytes = b"body", status_code: int = 200, delay=0.0):
+        self.body = body
+        self.status_code = status_code
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        self.calls += 1
+        time.sleep(self.delay)
+        return HttpResponse(status_code=self.status_code, body=self.body)
+
+
+def test_hit_and_miss():
+    cache = make_cache()
+    view = CountingView()
+    request = HttpRequest(method="GET", path="/")
+
+    first = cache.get_response(("key",), view, request, ttl=60)
+    second = cache.get_response(("key",), view, request, ttl=60)
+
+    assert view.calls == 1
+    assert first.body == second.body == b"body"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cached_response_headers_are_copied():
+    cache = make_cache()
+    request = HttpRequest(method="GET", path="/")
+    first = cache.get_response(("key",), CountingView(), request, ttl=60)
+    first.headers["X-Changed"] = "1"
+
+    second = cache.get_response(("key",), CountingView(), request, ttl=60)
+    assert "X-Changed" not in second.headers
+
+
+def test_entry_expires(monkeypatch):
+    cache = make_cache()
+    view = CountingView()
+    request = HttpRequest(method="GET", path="/")
+    now = time.monotonic()
+
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    cache.get_response(("key",), view, request, ttl=1)
+    monkeypatch.setattr(time, "monotonic", lambda: now + 2)
+    cache.get_response(("key",), view, request, ttl=1)
+
+    assert view.calls == 2
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        HttpResponse(status_code=500, body=b"error"),
+        HttpResponse(headers={"Set-Cookie": "a=b"}, body=b"cookie"),
+        HttpResponse(body=iter([b"streaming"])),
+        HttpResponse(body=b"x" * 2048),
+    ],
+)
+def test_uncacheable_responses(response):
+    cache = make_cache()
+    assert not cache.is_cacheable(response)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = make_cache(max_bytes=2500)
+    request = HttpRequest(method="GET", path="/")
+    for key in ("a", "b"):
+        cache.get_response((key,), CountingView(b"x" * 1000), request, ttl=60)
+    # aを使ったので、次に追加した時に捨てられるのはb
+    cache.get_response(("a",), CountingView(), request, ttl=60)
+    cache.get_response(("c",), CountingView(b"x" * 1000), request, ttl=60)
+
+    assert list(key for (key,) in cache.entries) == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= 2500
+
+
+def test_concurrent_misses_call_view_once():
+    cache = make_cache()
+    view = CountingView(delay=0.2)
+    request = HttpRequest(method="GET", path="/")
+    responses = []
+
+    def get():
+        responses.append(cache.get_response(("key",), view, request, ttl=60))
+
+    threads = [threading.Thread(target=get) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert view.calls == 1
+    assert [response.body for response in responses] == [b"body"] * 10
+    assert cache.stats()["waits"] == 9
+
+
+def test_waiters_call_view_when_leader_fails():
+    cache = make_cache()
+    started = threading.Event()
+    calls = []
+
+    def failing_view(request):
+        calls.append("leader")
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("failed")
+
+    def fallback_view(request):
+        calls.append("waiter")
+        return HttpResponse(body=b"fallback")
+
+    request = HttpRequest(method="GET", path="/")
+    errors = []
+
+    def lead():
+        try:
+            cache.get_response(("key",), failing_view, request, ttl=60)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+    response = cache.get_response(("key",), fallback_view, request, ttl=60)
+    leader.join()
+
+    assert response.body == b"fallback"
+    assert calls == ["leader", "waiter"]
+    assert len(errors) == 1
+    # 失敗したレスポンスはキャッシュされない
+    assert cache.stats()["entries"] == 0
+
+
+def test_policy_key_varies_by_headers_and_cookies():
+    policy = CachePolicy(ttl=60, headers=["Accept-Language"], cookies=["theme"])
+
+    def key(**headers):
+        request = HttpRequest(method="GET", path="/", headers=headers)
+        return policy.build_key(CountingView, request)
+
+    assert key(**{"Accept-Language": "ja"}) == key(**{"Accept-Language": "ja"})
+    assert key(**{"Accept-Language": "ja"}) != key(**{"Accept-Language": "en"})
+    assert key(Cookie="theme=dark") != key(Cookie="theme=light")
+    assert key(Cookie="theme=dark; other=1") == key(Cookie="theme=dark; other=2")
+
+
+def test_policy_rejects_async_views():
+    async def view(request):
+        return HttpResponse()
+
+    class AsyncView:
+        async def __call__(self, request):
+            return HttpResponse()
+
+    for async_view in (view, AsyncView()):
+        with pytest.raises(ValueError):
+            CachePolicy(ttl=60).wrap(async_view)
@@ -0,0 +1,94 @@
+import gzip
+
+import pytest
+
+from henango.http.compression import compress_response, negotiate_encoding
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+
+BODY = b"<p>hello</p>" * 200
+
+
+def make_request(accept_encoding: str = "gzip") -> HttpRequest:
+    return HttpRequest(
+        method="GET", path="/", headers={"Accept-Encoding": accept_encoding}
+    )
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("", None),
+        ("gzip", "gzip"),
+        ("deflate, gzip", "gzip"),
+        ("gzip;q=0.5, deflate", "deflate"),
+        ("gzip;q=0, *", "deflate"),
+        ("br", None),
+        ("*;q=0", None),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def test_body_is_compressed():
+    response = compress_response(
+        make_request(), HttpResponse(body=BODY, content_type="text/html")
+    )
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.body) == BODY
+
+
+def test_streaming_body_is_compressed():
+    response = compress_response(
+        make_request(), HttpResponse(body=iter([BODY, BODY]), content_type="text/html")
+    )
+
+    assert gzip.decompress(b"".join(response.iter_body())) == BODY * 2
+
+
+def test_vary_is_added_when_client_does_not_accept_compression():
+    response = compress_response(
+        make_request(""), HttpResponse(body=BODY, content_type="text/html")
+    )
+
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+
+def test_header_names_are_case_insensitive():
+    # view関数が自分で圧縮したものは、もう一度圧縮しない
+    response = compress_response(
+        make_request(),
+        HttpResponse(
+            body=BODY,
+            content_type="text/html",
+            headers={"content-encoding": "identity", "vary": "Cookie"},
+        ),
+    )
+    assert response.body == BODY
+    assert response.headers == {
+        "content-encoding": "identity",
+        "vary": "Cookie, Accept-Encoding",
+    }
+
+    response = compress_response(
+        make_request(),
+        HttpResponse(body=BODY, content_type="text/html", headers={"etag": '"1"'}),
+    )
+    assert response.body == BODY
+
+
+def test_small_and_binary_bodies_are_not_compressed():
+    response = compress_response(
+        make_request(), HttpResponse(body=b"small", content_type="text/html")
+    )
+    assert response.body == b"small"
+
+    response = compress_response(
+        make_request(), HttpResponse(body=BODY, content_type="image/png")
+    )
+    assert response.body == BODY
+    assert "Vary" not in response.headers
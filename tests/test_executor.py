@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from henango.server.executor import DaemonThreadPoolExecutor
+
+
+def test_results_and_exceptions():
+    executor = DaemonThreadPoolExecutor(2)
+
+    assert executor.submit(pow, 2, 10).result(timeout=5) == 1024
+    with pytest.raises(ZeroDivisionError):
+        executor.submit(lambda: 1 / 0).result(timeout=5)
+    executor.shutdown()
+
+
+def test_threads_are_daemon_and_bounded():
+    executor = DaemonThreadPoolExecutor(2)
+    release = threading.Event()
+    futures = [executor.submit(release.wait, 5) for _ in range(5)]
+
+    assert len(executor.threads) == 2
+    assert all(thread.daemon for thread in executor.threads)
+    release.set()
+    assert all(future.result(timeout=5) for future in futures)
+    executor.shutdown()
+
+
+def test_shutdown_cancels_pending_work_without_waiting():
+    executor = DaemonThreadPoolExecutor(1)
+    release = threading.Event()
+    running = executor.submit(release.wait, 5)
+    pending = executor.submit(int)
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    assert pending.cancelled()
+    assert not running.done()
+    with pytest.raises(RuntimeError):
+        executor.submit(int)
+
+    release.set()
+    assert running.result(timeout=5)
@@ -0,0 +1,68 @@
+import pytest
+
+from henango.http.form import MultipartParser, parse_form
+from henango.http.parser import HttpParseError
+from henango.http.request import HttpRequest
+
+MULTIPART_BODY = (
+    b"--XyZ\r\n"
+    b'Content-Disposition: form-data; name="title"\r\n\r\n'
+    b"hello\r\n"
+    b"--XyZ\r\n"
+    b'Content-Disposition: form-data; name="upload"; filename="a.txt"\r\n'
+    b"Content-Type: text/plain\r\n\r\n"
+    b"file\r\ncontent\r\n"
+    b"--XyZ--\r\n"
+)
+
+
+def split(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_urlencoded():
+    form, files = parse_form(
+        "application/x-www-form-urlencoded", split(b"a=1&b=x+y%21&a=2&c", 3)
+    )
+    assert form == {"a": ["1", "2"], "b": ["x y!"], "c": [""]}
+    assert files == {}
+
+
+@pytest.mark.parametrize("size", [1, 7, 1024])
+def test_multipart(size):
+    form, files = parse_form(
+        "multipart/form-data; boundary=XyZ", split(MULTIPART_BODY, size)
+    )
+
+    assert form == {"title": ["hello"]}
+    uploaded_file = files["upload"][0]
+    assert uploaded_file.filename == "a.txt"
+    assert uploaded_file.content_type == "text/plain"
+    assert uploaded_file.read() == b"file\r\ncontent"
+
+
+def test_uploaded_files_are_closed_with_request():
+    request = HttpRequest(
+        method="POST",
+        path="/",
+        headers={"Content-Type": "multipart/form-data; boundary=XyZ"},
+        body=MULTIPART_BODY,
+    )
+    uploaded_file = request.files["upload"][0]
+
+    request.close()
+    assert uploaded_file.file.closed
+
+
+def test_uploaded_files_are_closed_when_body_is_broken():
+    # ファイルを受け取り終えた後で途切れた場合
+    parser = MultipartParser(b"XyZ")
+    with pytest.raises(HttpParseError):
+        parser.parse([MULTIPART_BODY[:-3]])
+    assert parser.files["upload"][0].file.closed
+
+    # ファイルの受信中に途切れた場合
+    parser = MultipartParser(b"XyZ")
+    with pytest.raises(HttpParseError):
+        parser.parse([MULTIPART_BODY[:-20]])
+    assert parser.file.file.closed
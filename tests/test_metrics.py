@@ -0,0 +1,51 @@
+from henango.server.metrics import Metrics
+
+
+def make_metrics() -> Metrics:
+    return Metrics(enabled=True, buckets=[0.1, 1.0])
+
+
+def test_requests_are_counted_by_route_method_and_status():
+    metrics = make_metrics()
+    metrics.count_request("/now", "GET", 200)
+    metrics.count_request("/now", "GET", 200)
+    metrics.count_request("/now", "POST", 405)
+
+    assert metrics.requests == {("/now", "GET", 200): 2, ("/now", "POST", 405): 1}
+    assert (
+        'henango_requests_total{route="/now",method="GET",status="200"} 2'
+        in metrics.render()
+    )
+
+
+def test_unknown_methods_and_unresolved_requests_share_labels():
+    metrics = make_metrics()
+    for i in range(100):
+        metrics.count_request("", f"METHOD{i}", 400)
+    metrics.count_request("/now", "BREW", 405)
+
+    assert metrics.requests == {
+        ("unmatched", "other", 400): 100,
+        ("/now", "other", 405): 1,
+    }
+
+
+def test_histogram_is_cumulative():
+    metrics = make_metrics()
+    for duration in (0.05, 0.5, 5):
+        metrics.observe("/now", "view", duration)
+
+    output = metrics.render()
+    name = "henango_request_phase_seconds_bucket"
+    assert f'{name}{{route="/now",phase="view",le="0.1"}} 1' in output
+    assert f'{name}{{route="/now",phase="view",le="1"}} 2' in output
+    assert f'{name}{{route="/now",phase="view",le="+Inf"}} 3' in output
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics(enabled=False, buckets=[0.1])
+    metrics.count_request("/now", "GET", 200)
+    metrics.observe("/now", "view", 0.01)
+
+    assert not metrics.requests
+    assert not metrics.durations
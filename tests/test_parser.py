@@ -0,0 +1,175 @@
+from typing import List, Optional
+
+import pytest
+
+from henango.http.parser import HttpParseError, HttpRequestParser
+
+
+def make_parser(data: bytes = b"", max_body_size: int = 1024) -> HttpRequestParser:
+    parser = HttpRequestParser(max_header_size=1024, max_body_size=max_body_size)
+    parser.feed(data)
+    return parser
+
+
+def read_body(parser: HttpRequestParser) -> Optional[bytes]:
+    """
+    バッファにあるボディを最後まで取り出す。データが足りない場合はNone
+    """
+    chunks: List[bytes] = []
+    while True:
+        chunk = parser.parse_body()
+        if chunk is None:
+            return None
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def test_parse_request_line_and_headers():
+    parser = make_parser(
+        b"GET /user/1?a=b HTTP/1.1\r\nHost: localhost\r\nX-Test:  value \r\n\r\n"
+    )
+    request = parser.parse_head()
+
+    assert request.method == "GET"
+    assert request.path == "/user/1"
+    assert request.query_string == "a=b"
+    assert request.http_version == "HTTP/1.1"
+    assert request.headers["x-test"] == "value"
+    assert read_body(parser) == b""
+
+
+def test_parse_head_waits_for_end_of_headers():
+    parser = make_parser(b"GET / HTTP/1.1\r\nHost: localhost\r\n")
+    assert parser.parse_head() is None
+
+    parser.feed(b"\r\n")
+    assert parser.parse_head().path == "/"
+
+
+def test_connection_and_expect_do_not_parse_headers():
+    parser = make_parser(
+        b"POST / HTTP/1.1\r\nConnection: Close\r\nExpect: 100-Continue\r\n"
+        b"Content-Length: 0\r\n\r\n"
+    )
+    request = parser.parse_head()
+
+    assert request.connection == "close"
+    assert request.expect == "100-continue"
+    # ヘッダー全体の辞書へのパースは、参照されるまで行わない
+    assert request.headers._items is None
+
+
+def test_content_length_body_and_pipelined_request():
+    parser = make_parser(
+        b"POST /a HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello"
+        b"GET /b HTTP/1.1\r\n\r\n"
+    )
+    assert parser.parse_head().path == "/a"
+    assert read_body(parser) == b"hello"
+    assert parser.parse_head().path == "/b"
+
+
+def test_content_length_body_arrives_in_pieces():
+    parser = make_parser(b"POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhe")
+    parser.parse_head()
+    assert parser.parse_body() == b"he"
+    assert parser.parse_body() is None
+
+    parser.feed(b"llo")
+    assert read_body(parser) == b"llo"
+
+
+def test_chunked_body():
+    parser = make_parser(
+        b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"3;ext=1\r\nabc\r\na\r\n0123456789\r\n0\r\nX-Trailer: 1\r\n\r\n"
+        b"GET /next HTTP/1.1\r\n\r\n"
+    )
+    parser.parse_head()
+    assert read_body(parser) == b"abc0123456789"
+    assert parser.parse_head().path == "/next"
+
+
+@pytest.mark.parametrize("size", [b"-1", b"+5", b"0x10", b"1_0", b" ", b"g"])
+def test_invalid_chunk_size_is_rejected(size):
+    parser = make_parser(
+        b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n"
+        + size
+        + b"\r\nabcdef\r\n0\r\n\r\nGET /smuggled HTTP/1.1\r\n\r\n"
+    )
+    parser.parse_head()
+    with pytest.raises(HttpParseError) as excinfo:
+        read_body(parser)
+    assert excinfo.value.status_code == 400
+
+
+@pytest.mark.parametrize("value", [b"\xb2", b"-1", b"+5", b"1 2", b"abc"])
+def test_invalid_content_length_is_rejected(value):
+    parser = make_parser(b"POST / HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n")
+    with pytest.raises(HttpParseError) as excinfo:
+        parser.parse_head()
+    assert excinfo.value.status_code == 400
+
+
+def test_conflicting_content_lengths_are_rejected():
+    parser = make_parser(
+        b"POST / HTTP/1.1\r\nContent-Length: 1\r\nContent-Length: 2\r\n\r\n"
+    )
+    with pytest.raises(HttpParseError) as excinfo:
+        parser.parse_head()
+    assert excinfo.value.status_code == 400
+
+
+def test_transfer_encoding_takes_precedence_over_content_length():
+    parser = make_parser(
+        b"POST / HTTP/1.1\r\nContent-Length: 100\r\nTransfer-Encoding: chunked\r\n\r\n"
+        b"2\r\nok\r\n0\r\n\r\n"
+    )
+    parser.parse_head()
+    assert read_body(parser) == b"ok"
+
+
+def test_unsupported_transfer_encoding():
+    parser = make_parser(b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n")
+    with pytest.raises(HttpParseError) as excinfo:
+        parser.parse_head()
+    assert excinfo.value.status_code == 501
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"GET /\r\n\r\n",
+        b"GET / FTP/1.0\r\n\r\n",
+        b"GET / HTTP/1.1\r\nBad Header: 1\r\n\r\n",
+        b"GET / HTTP/1.1\r\nNoColon\r\n\r\n",
+    ],
+)
+def test_malformed_head_is_rejected(data):
+    with pytest.raises(HttpParseError) as excinfo:
+        make_parser(data).parse_head()
+    assert excinfo.value.status_code == 400
+
+
+def test_too_large_header():
+    parser = make_parser(b"GET / HTTP/1.1\r\nX: " + b"a" * 2000)
+    with pytest.raises(HttpParseError) as excinfo:
+        parser.parse_head()
+    assert excinfo.value.status_code == 431
+
+
+def test_too_large_body():
+    parser = make_parser(b"POST / HTTP/1.1\r\nContent-Length: 2000\r\n\r\n")
+    with pytest.raises(HttpParseError) as excinfo:
+        parser.parse_head()
+    assert excinfo.value.status_code == 413
+
+    parser = make_parser(
+        b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n800\r\n",
+        max_body_size=1024,
+    )
+    parser.parse_head()
+    with pytest.raises(HttpParseError) as excinfo:
+        read_body(parser)
+    assert excinfo.value.status_code == 413
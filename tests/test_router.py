@@ -0,0 +1,139 @@
+import pytest
+
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.urls import resolver
+from henango.urls.pattern import UrlPattern
+from henango.urls.resolver import METHOD_NOT_ALLOWED_ROUTE, STATIC_ROUTE, UrlResolver
+from henango.urls.router import Router
+
+
+def view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse(body=b"view")
+
+
+def other_view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse(body=b"other")
+
+
+async def async_view(request: HttpRequest) -> HttpResponse:
+    return HttpResponse(body=b"async")
+
+
+def test_static_path():
+    router = Router([UrlPattern("/now", view)])
+
+    route_match = router.resolve("GET", "/now")
+    assert route_match.url_pattern.view is view
+    assert route_match.params == {}
+    assert router.resolve("GET", "/now/") is None
+    assert router.resolve("GET", "/later") is None
+
+
+def test_parameters_are_converted():
+    router = Router(
+        [
+            UrlPattern("/user/<int:user_id>/profile", view),
+            UrlPattern("/article/<slug:slug>", view),
+            UrlPattern("/files/<path:file_path>", view),
+        ]
+    )
+
+    assert router.resolve("GET", "/user/42/profile").params == {"user_id": 42}
+    assert router.resolve("GET", "/user/abc/profile") is None
+    # intに変換できる桁数の上限を超える場合もマッチしない
+    assert router.resolve("GET", "/user/" + "1" * 5000 + "/profile") is None
+    assert router.resolve("GET", "/article/hello-world").params == {
+        "slug": "hello-world"
+    }
+    assert router.resolve("GET", "/article/a.b") is None
+    assert router.resolve("GET", "/files/a/b/c.txt").params == {
+        "file_path": "a/b/c.txt"
+    }
+
+
+def test_parameters_are_unquoted():
+    router = Router([UrlPattern("/user/<name>", view)])
+    assert router.resolve("GET", "/user/%E5%A4%AA%E9%83%8E").params == {
+        "name": "太郎"
+    }
+
+
+def test_fixed_segment_takes_precedence_in_registration_order():
+    router = Router(
+        [UrlPattern("/user/me", other_view), UrlPattern("/user/<name>", view)]
+    )
+
+    assert router.resolve("GET", "/user/me").url_pattern.view is other_view
+    assert router.resolve("GET", "/user/taro").url_pattern.view is view
+
+
+def test_methods():
+    router = Router(
+        [
+            UrlPattern("/login", view, methods=["get"]),
+            UrlPattern("/login", other_view, methods=["POST"]),
+        ]
+    )
+
+    assert router.resolve("GET", "/login").url_pattern.view is view
+    # GETを受け付ける場合はHEADも受け付ける
+    assert router.resolve("HEAD", "/login").url_pattern.view is view
+    assert router.resolve("POST", "/login").url_pattern.view is other_view
+
+    route_match = router.resolve("DELETE", "/login")
+    assert route_match.url_pattern is None
+    assert route_match.allowed_methods == {"GET", "HEAD", "POST"}
+
+
+@pytest.mark.parametrize(
+    "pattern", ["user", "/user/<unknown:id>", "/<path:p>/edit", "/a<b>"]
+)
+def test_invalid_pattern(pattern):
+    with pytest.raises(ValueError):
+        UrlPattern(pattern, view)
+
+
+def test_async_view_is_detected_once():
+    assert UrlPattern("/async", async_view).is_async
+    assert not UrlPattern("/sync", view).is_async
+
+
+@pytest.fixture
+def url_resolver(monkeypatch):
+    router = Router(
+        [
+            UrlPattern("/user/<int:user_id>", view, methods=["GET"]),
+            UrlPattern("/async", async_view),
+        ]
+    )
+    monkeypatch.setattr(resolver, "router", router)
+    return UrlResolver()
+
+
+def test_resolver_sets_route_and_params(url_resolver):
+    request = HttpRequest(method="GET", path="/user/7")
+
+    assert url_resolver.resolve(request) is view
+    assert request.route == "/user/<int:user_id>"
+    assert request.params == {"user_id": 7}
+    assert not request.view_is_async
+
+    request = HttpRequest(method="GET", path="/async")
+    assert url_resolver.resolve(request) is async_view
+    assert request.view_is_async
+
+
+def test_resolver_method_not_allowed(url_resolver):
+    request = HttpRequest(method="POST", path="/user/7")
+    response = url_resolver.resolve(request)(request)
+
+    assert request.route == METHOD_NOT_ALLOWED_ROUTE
+    assert response.status_code == 405
+    assert response.headers["Allow"] == "GET, HEAD"
+
+
+def test_resolver_falls_back_to_static_files(url_resolver):
+    request = HttpRequest(method="GET", path="/index.html")
+    url_resolver.resolve(request)
+    assert request.route == STATIC_ROUTE
@@ -0,0 +1,44 @@
+import pytest
+
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.http.serializer import ResponseSerializer
+
+
+def serialize(response: HttpResponse, chunked: bool = False) -> bytes:
+    return ResponseSerializer().serialize_head(
+        response,
+        HttpRequest(method="GET", path="/"),
+        keep_alive=True,
+        handled_count=1,
+        chunked=chunked,
+    )
+
+
+def test_head_lines():
+    head = serialize(
+        HttpResponse(body=b"hello", content_type="text/plain", headers={"X-A": "1"})
+    )
+
+    assert head.startswith(b"HTTP/1.1 200 OK\r\nDate: ")
+    assert head.endswith(b"\r\n\r\n")
+    assert b"\r\nContent-Length: 5\r\n" in head
+    assert b"\r\nConnection: keep-alive\r\n" in head
+    assert b"\r\nContent-Type: text/plain\r\n" in head
+    assert b"\r\nX-A: 1\r\n" in head
+
+
+def test_chunked_body():
+    head = serialize(HttpResponse(body=iter([b"a"])), chunked=True)
+    assert b"\r\nTransfer-Encoding: chunked\r\n" in head
+    assert b"Content-Length" not in head
+
+
+@pytest.mark.parametrize("status_code", [101, 204, 304])
+def test_bodiless_status_codes_have_no_length(status_code):
+    head = serialize(HttpResponse(status_code=status_code))
+    assert b"Content-Length" not in head
+    assert b"Transfer-Encoding" not in head
+
+    head = serialize(HttpResponse(status_code=status_code, body=iter([])), True)
+    assert b"Transfer-Encoding" not in head
@@ -0,0 +1,32 @@
+from henango.http.response import HttpResponse
+from henango.http.session import MemorySessionStore, Session, sign, unsign
+
+
+def test_sign_and_unsign():
+    assert unsign(sign("abc")) == "abc"
+
+
+def test_tampered_values_are_rejected():
+    value = sign("abc")
+    session_key, _, value_signature = value.rpartition(".")
+
+    assert unsign(f"other.{value_signature}") is None
+    assert unsign(f"{session_key}.{value_signature[:-1]}") is None
+    assert unsign(session_key) is None
+    assert unsign("") is None
+
+
+def test_session_is_saved_only_when_modified():
+    store = MemorySessionStore(sweep_interval=60)
+    session = Session(store, None)
+    response = HttpResponse()
+
+    assert "username" not in session
+    session.save(response)
+    assert not response.cookies
+
+    session["username"] = "taro"
+    session.save(response)
+    assert len(response.cookies) == 1
+    session_key = unsign(response.cookies[0].value)
+    assert Session(store, session_key)["username"] == "taro"
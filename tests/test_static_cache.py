@@ -0,0 +1,65 @@
+import os
+
+from henango.server import startup
+from henango.views.static_cache import StaticFileCache
+
+
+def make_cache(**kwargs) -> StaticFileCache:
+    options = {"max_bytes": 1024, "max_file_size": 512, "check_interval": 60}
+    options.update(kwargs)
+    return StaticFileCache(**options)
+
+
+def test_hit_and_miss(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"hello")
+    cache = make_cache()
+
+    assert cache.get(str(path)).body == b"hello"
+    assert cache.get(str(path)).body == b"hello"
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_changed_file_is_reloaded(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"hello")
+    cache = make_cache(check_interval=0)
+    cache.get(str(path))
+
+    path.write_bytes(b"hello, world")
+    os.utime(path, ns=(0, 0))
+    assert cache.get(str(path)).body == b"hello, world"
+
+
+def test_large_files_are_not_cached(tmp_path):
+    path = tmp_path / "large.bin"
+    path.write_bytes(b"x" * 1000)
+    assert make_cache().get(str(path)) is None
+
+
+def test_least_recently_used_file_is_evicted(tmp_path):
+    cache = make_cache(max_bytes=1000)
+    for name in ("a", "b", "c"):
+        (tmp_path / name).write_bytes(b"x" * 400)
+    cache.get(str(tmp_path / "a"))
+    cache.get(str(tmp_path / "b"))
+    cache.get(str(tmp_path / "a"))
+    cache.get(str(tmp_path / "c"))
+
+    assert list(cache.entries) == [str(tmp_path / "a"), str(tmp_path / "c")]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_preload_does_not_count_misses(tmp_path, monkeypatch):
+    cache = make_cache()
+    (tmp_path / "index.html").write_bytes(b"<p>index</p>")
+    (tmp_path / "index.html.gz").write_bytes(b"")
+    (tmp_path / "large.bin").write_bytes(b"x" * 1000)
+    monkeypatch.setattr(startup, "STATIC_ROOT", str(tmp_path))
+    monkeypatch.setattr(startup, "static_file_cache", cache)
+
+    assert startup.preload_static_files() == 1
+    assert cache.stats()["misses"] == 0
+    cache.get(str(tmp_path / "index.html"))
+    assert cache.stats()["hits"] == 1
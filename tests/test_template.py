@@ -0,0 +1,88 @@
+import pytest
+
+from henango.template.engine import Template, TemplateEngine, TemplateSyntaxError
+
+
+def render(source: str, autoescape: bool = True, **context) -> str:
+    return Template(source, name="test.html", autoescape=autoescape).render(context)
+
+
+def test_output_is_escaped():
+    assert render("<p>{{ text }}</p>", text="<b>&'\"") == (
+        "<p>&lt;b&gt;&amp;&#x27;&quot;</p>"
+    )
+    assert render("{{ text|safe }}", text="<b>") == "<b>"
+    assert render("{{ text }}", autoescape=False, text="<b>") == "<b>"
+
+
+def test_expressions_and_filters():
+    assert render("{{ user['name']|upper }}", user={"name": "taro"}) == "TARO"
+    assert render("{{ items|length }} {{ len(items) }}", items=[1, 2]) == "2 2"
+    assert render("[{{ missing }}]") == "[]"
+
+
+def test_for_and_for_else():
+    source = (
+        "{% for i, x in enumerate(xs) %}{{ i }}:{{ x }} {% else %}empty{% endfor %}"
+    )
+    assert render(source, xs=["a", "b"]) == "0:a 1:b "
+    assert render(source, xs=[]) == "empty"
+
+
+def test_loop_variable_does_not_leak_into_context():
+    source = "{% for x in xs %}{{ x }}{% endfor %}{{ x }}"
+    assert render(source, xs=[1, 2], x="outer") == "12outer"
+
+
+def test_if_elif_else():
+    source = "{% if n > 1 %}many{% elif n == 1 %}one{% else %}none{% endif %}"
+    assert render(source, n=2) == "many"
+    assert render(source, n=1) == "one"
+    assert render(source, n=0) == "none"
+
+
+def test_comments_are_not_rendered():
+    assert render("a{# hidden {{ x }} #}b") == "ab"
+
+
+def test_stream_yields_whole_output():
+    template = Template("{% for x in xs %}{{ x }}{% endfor %}")
+    chunks = list(template.stream({"xs": ["x" * 5000] * 4}))
+    assert len(chunks) > 1
+    assert "".join(chunks) == "x" * 20000
+
+
+def test_include(tmp_path):
+    (tmp_path / "base.html").write_text(
+        "{% for x in xs %}{% include 'item.html' %}{% endfor %}"
+    )
+    (tmp_path / "item.html").write_text("<{{ x }}>")
+    engine = TemplateEngine(str(tmp_path))
+
+    # forの変数も、includeしたテンプレートから参照できる
+    assert engine.get_template("base.html").render({"xs": [1, 2]}) == "<1><2>"
+
+
+@pytest.mark.parametrize(
+    "source, lineno",
+    [
+        ("{% if a %}", 1),
+        ("\n{% for x in xs %}", 2),
+        ("{% endif %}", 1),
+        ("{% for x in xs %}{% endif %}", 1),
+        ("{% if a %}{% endfor %}", 1),
+        ("{% else %}", 1),
+        ("{% elif a %}", 1),
+        ("{% unknown %}", 1),
+        ("{% for x xs %}{% endfor %}", 1),
+        ("{% for x in xs %}{% else %}{% else %}{% endfor %}", 1),
+        ("{% if a %}\n{% else %}\n{% elif b %}{% endif %}", 3),
+        ("{% if a %}{% else %}\n{% else %}{% endif %}", 2),
+        ("{% for x in xs %}{% elif a %}{% endfor %}", 1),
+    ],
+)
+def test_syntax_errors(source, lineno):
+    with pytest.raises(TemplateSyntaxError) as excinfo:
+        Template(source, name="broken.html")
+    assert excinfo.value.name == "broken.html"
+    assert excinfo.value.lineno == lineno
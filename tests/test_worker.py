@@ -0,0 +1,150 @@
+import socket
+from typing import Dict, Iterator, Tuple
+
+import pytest
+
+import settings
+from henango.http.request import HttpRequest
+from henango.http.response import HttpResponse
+from henango.server.worker import Worker
+from henango.urls import resolver
+from henango.urls.pattern import UrlPattern
+from henango.urls.router import Router
+
+
+def echo(request: HttpRequest) -> HttpResponse:
+    return HttpResponse(body=request.path.encode())
+
+
+def broken(request: HttpRequest) -> HttpResponse:
+    raise RuntimeError("broken")
+
+
+class ResponseReader:
+    """
+    1つのソケットから、Content-Length付きのレスポンスを順番に読み出す
+    """
+
+    def __init__(self, client_socket: socket.socket):
+        self.client_socket = client_socket
+        self.buffer = b""
+
+    def recv(self) -> bytes:
+        data = self.client_socket.recv(65536)
+        self.buffer += data
+        return data
+
+    def read_response(self) -> Tuple[int, Dict[str, str], bytes]:
+        while b"\r\n\r\n" not in self.buffer:
+            assert self.recv(), "レスポンスの途中で切断されました"
+        head, self.buffer = self.buffer.split(b"\r\n\r\n", 1)
+        status_line, *header_lines = head.decode().split("\r\n")
+        headers = {}
+        for line in header_lines:
+            name, value = line.split(":", 1)
+            headers[name.lower()] = value.strip()
+        content_length = int(headers["content-length"])
+        while len(self.buffer) < content_length:
+            assert self.recv(), "レスポンスの途中で切断されました"
+        body = self.buffer[:content_length]
+        self.buffer = self.buffer[content_length:]
+        return int(status_line.split()[1]), headers, body
+
+    def is_closed(self) -> bool:
+        """
+        サーバがコネクションを閉じたか。閉じずに待っている場合はタイムアウトする
+        """
+        return not self.buffer and not self.recv()
+
+
+@pytest.fixture
+def connect(monkeypatch) -> Iterator:
+    router = Router([UrlPattern("/broken", broken), UrlPattern("/<path:path>", echo)])
+    monkeypatch.setattr(resolver, "router", router)
+    server_socket = socket.create_server(("127.0.0.1", 0))
+    client_sockets = []
+
+    def connect() -> Tuple[socket.socket, ResponseReader]:
+        client_socket = socket.create_connection(server_socket.getsockname())
+        client_socket.settimeout(5)
+        client_sockets.append(client_socket)
+        Worker(*server_socket.accept()).start()
+        return client_socket, ResponseReader(client_socket)
+
+    yield connect
+
+    for client_socket in client_sockets:
+        client_socket.close()
+    server_socket.close()
+
+
+def test_keep_alive_reuses_connection(connect):
+    client_socket, reader = connect()
+    for path in ("/a", "/b", "/c"):
+        client_socket.sendall(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+        status_code, headers, body = reader.read_response()
+        assert status_code == 200
+        assert headers["connection"] == "keep-alive"
+        assert body == path.encode()
+
+
+def test_pipelined_requests_are_answered_in_order(connect):
+    client_socket, reader = connect()
+    client_socket.sendall(
+        b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n"
+        # viewが読まなかったボディは読み捨てられ、次のリクエストと混ざらない
+        b"POST /b HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello"
+        b"GET /c HTTP/1.1\r\nHost: x\r\n\r\n"
+    )
+
+    assert [reader.read_response()[2] for _ in range(3)] == [b"/a", b"/b", b"/c"]
+
+
+def test_connection_close(connect):
+    client_socket, reader = connect()
+    client_socket.sendall(
+        b"GET /a HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+        b"GET /b HTTP/1.1\r\nHost: x\r\n\r\n"
+    )
+
+    status_code, headers, body = reader.read_response()
+    assert headers["connection"] == "close"
+    assert body == b"/a"
+    # 後に続くリクエストは処理されない
+    assert reader.is_closed()
+
+
+def test_http_1_0_closes_by_default(connect):
+    client_socket, reader = connect()
+    client_socket.sendall(b"GET /a HTTP/1.0\r\n\r\n")
+    assert reader.read_response()[1]["connection"] == "close"
+    assert reader.is_closed()
+
+    client_socket, reader = connect()
+    client_socket.sendall(b"GET /a HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+    assert reader.read_response()[1]["connection"] == "keep-alive"
+    client_socket.sendall(b"GET /b HTTP/1.0\r\n\r\n")
+    assert reader.read_response()[2] == b"/b"
+    assert reader.is_closed()
+
+
+def test_idle_connection_times_out(connect, monkeypatch):
+    monkeypatch.setattr(settings, "KEEP_ALIVE_TIMEOUT", 0.2)
+    client_socket, reader = connect()
+    client_socket.sendall(b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert reader.read_response()[2] == b"/a"
+
+    # 次のリクエストを送らずにいると、サーバから切断される
+    assert reader.is_closed()
+
+
+def test_unexpected_error_returns_500_and_closes(connect):
+    client_socket, reader = connect()
+    client_socket.sendall(
+        b"GET /broken HTTP/1.1\r\nHost: x\r\n\r\nGET /a HTTP/1.1\r\nHost: x\r\n\r\n"
+    )
+
+    status_code, headers, _ = reader.read_response()
+    assert status_code == 500
+    assert headers["connection"] == "close"
+    assert reader.is_closed()
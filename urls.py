@@ -1,14 +1,25 @@
+import settings
 import views
 from henango.urls.pattern import UrlPattern
+from henango.views.cache import CachePolicy
 
 # pathとview関数の対応
 url_patterns = [
     UrlPattern("/now", views.now),
     UrlPattern("/show_request", views.show_request),
-    UrlPattern("/parameters", views.parameters),
-    UrlPattern("/user/<user_id>/profile", views.user_profile),
+    UrlPattern("/parameters", views.parameters, methods=["POST"]),
+    UrlPattern(
+        "/user/<user_id>/profile", views.user_profile, cache=CachePolicy(ttl=60)
+    ),
     UrlPattern("/set_cookie", views.set_cookie),
-    UrlPattern("/login", views.login),
+    UrlPattern("/login", views.login, methods=["GET", "POST"]),
     # ステータスコード302は一時的なリダイレクトを意味し、ブラウザはLocationヘッダーで指定されたURLへ再度リクエストをし直してくれます。
     UrlPattern("/welcome", views.welcome),
 ]
+
+# I/Oを待つview関数を、同期的なものとasync defのもので比べるベンチマーク用
+if settings.BENCHMARK_ROUTES:
+    url_patterns += [
+        UrlPattern("/bench/wait_sync/<int:milliseconds>", views.wait_sync),
+        UrlPattern("/bench/wait_async/<int:milliseconds>", views.wait_async),
+    ]
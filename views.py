@@ -1,12 +1,11 @@
 import textwrap
+import time
 from datetime import datetime
 from pprint import pformat
-from urllib.parse import parse_qs
 
-from henango.http.cookie import Cookie
 from henango.http.request import HttpRequest
 from henango.http.response import HttpResponse
-from templates.renderer import render
+from templates.renderer import render, render_stream
 
 
 def now(request: HttpRequest) -> HttpResponse:
@@ -30,15 +29,17 @@ def show_request(request: HttpRequest) -> HttpResponse:
 
 def parameters(request: HttpRequest) -> HttpResponse:
     """
-    POSTパラメータを表示するHTMLを表示する
+    POSTパラメータを表示するHTMLを表示する（POSTのみ受け付ける）
+
+    パラメータが多いとHTMLが大きくなるので、レンダリングした分から送信する
+    multipart/form-dataで送られてきたファイルは、ファイル名とサイズを表示する
     """
-    if request.method == "POST":
-        context = {"parameters": pformat(parse_qs(request.body.decode()))}
-        body = render("parameters.html", context)
-        return HttpResponse(body=body)
-    else:
-        body = b"<html><body><h1>405 Method Not Allowed</h1></body></html>"
-        return HttpResponse(body=body, status_code=405)
+    parameters = dict(request.form)
+    for name, files in request.files.items():
+        parameters[name] = [f"{file.filename} ({file.size} bytes)" for file in files]
+    context = {"parameters": parameters}
+    body = render_stream("parameters.html", context)
+    return HttpResponse(body=body)
 
 
 def user_profile(request: HttpRequest) -> HttpResponse:
@@ -56,31 +57,54 @@ def login(request: HttpRequest) -> HttpResponse:
         body = render("login.html", {})
         return HttpResponse(body=body)
 
-    elif request.method == "POST":
-        post_params = parse_qs(request.body.decode())
-        username = post_params["username"][0]
-        email = post_params["email"][0]
-
-        cookies = [
-            Cookie(name="username", value=username, max_age=30),
-            Cookie(name="email", value=email, max_age=30),
-        ]
-
-        return HttpResponse(
-            status_code=302, headers={"Location": "/welcome"}, cookies=cookies
-        )
     else:
-        body = b"<html><body><h1>405 Method Not Allowed</h1></body></html>"
-        return HttpResponse(body=body, status_code=405)
+        # ログインの前後で同じセッションIDを使わせない
+        request.session.cycle_key()
+        request.session["username"] = request.form["username"][0]
+        request.session["email"] = request.form["email"][0]
+
+        return HttpResponse(status_code=302, headers={"Location": "/welcome"})
 
 
 def welcome(request: HttpRequest) -> HttpResponse:
-    if "username" not in request.cookies:
+    if "username" not in request.session:
         return HttpResponse(status_code=302, headers={"Location": "/login"})
 
     # Welcome画面を表示
-    username = request.cookies["username"]
-    email = request.cookies["email"]
+    username = request.session["username"]
+    email = request.session["email"]
     body = render("welcome.html", context={"username": username, "email": email})
 
     return HttpResponse(body=body)
+
+
+# ベンチマーク用のview関数で、待たせる最大のミリ秒
+MAX_WAIT_MILLISECONDS = 10000
+
+
+def wait_sync(request: HttpRequest) -> HttpResponse:
+    """
+    外部サービスの呼び出しなど、I/Oを待つview関数をtime.sleepで模したもの
+
+    待っている間もWorkerのスレッド（asyncioではスレッドプールのスレッド）を占有する
+    """
+    milliseconds = min(request.params["milliseconds"], MAX_WAIT_MILLISECONDS)
+    time.sleep(milliseconds / 1000)
+    body = f"waited {milliseconds}ms (sync)\n"
+    return HttpResponse(content_type="text/plain; charset=UTF-8", body=body)
+
+
+async def wait_async(request: HttpRequest) -> HttpResponse:
+    """
+    wait_syncをasync defで書いたもの
+
+    asyncioで動かす場合は、待っている間にスレッドを占有しないので、
+    スレッドプールの大きさを超える数のリクエストを同時に待てる
+    """
+    # スレッドで動かす場合の起動を遅くしないよう、呼ばれた時に読み込む
+    import asyncio
+
+    milliseconds = min(request.params["milliseconds"], MAX_WAIT_MILLISECONDS)
+    await asyncio.sleep(milliseconds / 1000)
+    body = f"waited {milliseconds}ms (async)\n"
+    return HttpResponse(content_type="text/plain; charset=UTF-8", body=body)